@@ -0,0 +1,259 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free vertex lighting bake: sun and point lights with shadows plus
+hemisphere ambient occlusion, traced against a BVH of the world triangles.
+
+The BVH is a linear BVH: triangles are sorted along a Morton curve, packed
+into leaves of LEAF_SIZE and paired up level by level. Rays are traced in
+batches one tree level at a time, so all the work is done on arrays. Only
+occlusion is needed, the first hit of a ray ends it.
+
+Cubes (the objects of a world) are baked in worker processes, each worker
+builds the BVH once in init_worker. Ambient occlusion is accumulated over
+passes, so a few samples per pass already give a usable preview:
+
+    init_worker(triangles, cubes, lights, settings)
+    index, direct, unoccluded = bake_cube((index, pass_number, samples))
+"""
+
+import numpy as np
+
+LEAF_SIZE = 4
+# rays traced together, bounds the size of the traversal arrays
+RAY_BATCH = 8192
+# ray/triangle tests done together
+PAIR_BATCH = 1 << 20
+
+
+######################################################
+# BVH
+######################################################
+def spread_bits(values):
+    """Spreads the lower 10 bits of values out to every third bit."""
+    values = values.astype(np.uint32) & 0x3FF
+    values = (values | (values << 16)) & 0x030000FF
+    values = (values | (values << 8)) & 0x0300F00F
+    values = (values | (values << 4)) & 0x030C30C3
+    values = (values | (values << 2)) & 0x09249249
+    return values
+
+def morton_codes(points):
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    cells = (points - lower) / np.maximum(upper - lower, 1e-12) * 1023
+    return (spread_bits(cells[:, 0]) << 2) | (spread_bits(cells[:, 1]) << 1) | spread_bits(cells[:, 2])
+
+def cross(a, b):
+    return np.column_stack((a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1],
+                            a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2],
+                            a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]))
+
+def dot(a, b):
+    return np.einsum("ij,ij->i", a, b)
+
+def normalize(vectors):
+    lengths = np.sqrt(dot(vectors, vectors))
+    return vectors / np.maximum(lengths, 1e-12)[:, None]
+
+
+class BVH:
+    """Linear BVH over triangles given as a (count, 3, 3) array."""
+
+    def __init__(self, triangles):
+        triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+        self.triangle_count = len(triangles)
+        self.levels = []
+        if not self.triangle_count:
+            return
+
+        triangles = triangles[np.argsort(morton_codes(triangles.mean(axis=1)), kind="mergesort")]
+        self.v0 = triangles[:, 0]
+        self.e1 = triangles[:, 1] - self.v0
+        self.e2 = triangles[:, 2] - self.v0
+
+        starts = np.arange(0, self.triangle_count, LEAF_SIZE)
+        mins = np.minimum.reduceat(triangles.min(axis=1), starts)
+        maxs = np.maximum.reduceat(triangles.max(axis=1), starts)
+        self.levels.append((mins, maxs))
+        while len(mins) > 1:
+            starts = np.arange(0, len(mins), 2)
+            mins = np.minimum.reduceat(mins, starts)
+            maxs = np.maximum.reduceat(maxs, starts)
+            self.levels.append((mins, maxs))
+        # root first
+        self.levels.reverse()
+
+    def occluded(self, origins, directions, distances):
+        """Returns for each ray whether it hits a triangle closer than its distance."""
+        origins = np.asarray(origins, dtype=np.float32).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float32).reshape(-1, 3)
+        distances = np.broadcast_to(np.asarray(distances, dtype=np.float32), (len(origins),))
+        hit = np.zeros(len(origins), dtype=bool)
+        if not self.triangle_count:
+            return hit
+        for start in range(0, len(origins), RAY_BATCH):
+            end = start + RAY_BATCH
+            hit[start:end] = self.occluded_batch(origins[start:end], directions[start:end], distances[start:end])
+        return hit
+
+    def occluded_batch(self, origins, directions, distances):
+        # slab test with the inverse direction, zero components become tiny
+        tiny = np.where(directions < 0, np.float32(-1e-20), np.float32(1e-20))
+        inverse = np.float32(1.0) / np.where(np.abs(directions) < 1e-20, tiny, directions)
+        scaled_origins = origins * inverse
+
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.int64)
+        for depth, (mins, maxs) in enumerate(self.levels):
+            if depth:
+                rays = np.repeat(rays, 2)
+                nodes = np.repeat(nodes * 2, 2)
+                nodes[1::2] += 1
+                inside = nodes < len(mins)
+                rays, nodes = rays[inside], nodes[inside]
+
+            ray_inverse = inverse[rays]
+            ray_origins = scaled_origins[rays]
+            t1 = mins[nodes] * ray_inverse - ray_origins
+            t2 = maxs[nodes] * ray_inverse - ray_origins
+            near = np.minimum(t1, t2).max(axis=1)
+            far = np.maximum(t1, t2).min(axis=1)
+            keep = (near <= far) & (far >= 0) & (near <= distances[rays])
+            rays, nodes = rays[keep], nodes[keep]
+            if not len(rays):
+                return np.zeros(len(origins), dtype=bool)
+
+        # every leaf holds up to LEAF_SIZE triangles
+        rays = np.repeat(rays, LEAF_SIZE)
+        triangles = (np.repeat(nodes * LEAF_SIZE, LEAF_SIZE) +
+                     np.tile(np.arange(LEAF_SIZE), len(nodes)))
+        valid = triangles < self.triangle_count
+        rays, triangles = rays[valid], triangles[valid]
+
+        hit = np.zeros(len(origins), dtype=bool)
+        for start in range(0, len(rays), PAIR_BATCH):
+            pair_rays = rays[start:start + PAIR_BATCH]
+            pair_triangles = triangles[start:start + PAIR_BATCH]
+            # rays that hit something already are done
+            open_pairs = ~hit[pair_rays]
+            pair_rays, pair_triangles = pair_rays[open_pairs], pair_triangles[open_pairs]
+            hits = self.intersect(origins[pair_rays], directions[pair_rays], distances[pair_rays], pair_triangles)
+            hit[pair_rays[hits]] = True
+        return hit
+
+    def intersect(self, origins, directions, distances, triangles):
+        """Moeller-Trumbore test of ray/triangle pairs."""
+        e1, e2 = self.e1[triangles], self.e2[triangles]
+        p = cross(directions, e2)
+        determinant = dot(e1, p)
+        valid = np.abs(determinant) > 1e-12
+        inverse = 1.0 / np.where(valid, determinant, 1.0)
+
+        s = origins - self.v0[triangles]
+        u = dot(s, p) * inverse
+        q = cross(s, e1)
+        v = dot(directions, q) * inverse
+        t = dot(e2, q) * inverse
+        return valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0) & (t < distances)
+
+
+######################################################
+# SHADING
+######################################################
+def hemisphere_directions(normals, samples, rng):
+    """Cosine weighted directions around each normal, (count, samples, 3)."""
+    helper = np.where(np.abs(normals[:, :1]) < 0.9, [[1.0, 0.0, 0.0]], [[0.0, 1.0, 0.0]])
+    tangents = normalize(cross(normals, helper))
+    bitangents = cross(normals, tangents)
+
+    u1 = rng.random_sample((len(normals), samples, 1))
+    u2 = rng.random_sample((len(normals), samples, 1)) * 2 * np.pi
+    radius = np.sqrt(u1)
+    return (tangents[:, None] * (radius * np.cos(u2)) +
+            bitangents[:, None] * (radius * np.sin(u2)) +
+            normals[:, None] * np.sqrt(1 - u1))
+
+def direct_light(bvh, points, normals, lights, settings):
+    """Summed RGB light of all lights, shadowed if settings["shadows"]."""
+    light = np.zeros((len(points), 3))
+    origins = points + normals * settings["bias"]
+    for lamp in lights:
+        if lamp["type"] == "SUN":
+            to_light = np.broadcast_to(normalize(np.array([lamp["direction"]], dtype=np.float64)), points.shape)
+            distance = np.full(len(points), np.inf)
+            strength = np.full(len(points), lamp["energy"])
+        else:
+            offset = np.asarray(lamp["position"], dtype=np.float64) - points
+            distance = np.sqrt(dot(offset, offset))
+            to_light = offset / np.maximum(distance, 1e-12)[:, None]
+            # blender's inverse square falloff
+            falloff = lamp["distance"] ** 2
+            strength = lamp["energy"] * falloff / (falloff + distance ** 2)
+
+        facing = dot(normals, to_light)
+        lit = facing > 0
+        if settings["shadows"] and lit.any():
+            lit[lit] = ~bvh.occluded(origins[lit], to_light[lit], distance[lit])
+        light[lit] += (facing * strength)[lit, None] * np.asarray(lamp["color"], dtype=np.float64)
+    return light
+
+def ambient_occlusion(bvh, points, normals, samples, settings, rng):
+    """Number of unoccluded hemisphere samples of each point."""
+    if samples <= 0:
+        return np.zeros(len(points))
+    directions = hemisphere_directions(normals, samples, rng).reshape(-1, 3)
+    origins = np.repeat(points + normals * settings["bias"], samples, axis=0)
+    occluded = bvh.occluded(origins, directions, settings["ao_distance"])
+    return samples - occluded.reshape(-1, samples).sum(axis=1)
+
+def get_colors(direct, unoccluded, samples, settings):
+    """Final vertex colors from the direct light and the AO gathered so far."""
+    ambient = unoccluded / samples if samples else np.ones(len(direct))
+    color = direct + np.asarray(settings["ambient"], dtype=np.float64) * ambient[:, None]
+    return np.clip(color, 0.0, 1.0)
+
+
+######################################################
+# WORKERS
+######################################################
+# what init_worker got, plus the BVH
+worker_state = {}
+
+def init_worker(triangles, cubes, lights, settings):
+    """
+    cubes is a list of (points, normals) to bake, lights a list of dicts
+    with type SUN (direction towards the sun) or POINT (position,
+    distance), color and energy.
+    """
+    worker_state["bvh"] = BVH(triangles)
+    worker_state["cubes"] = cubes
+    worker_state["lights"] = lights
+    worker_state["settings"] = settings
+
+def bake_cube(task):
+    """
+    Bakes pass pass_number of a cube with samples AO samples. The direct
+    light is only computed in the first pass, later passes add ambient
+    occlusion samples.
+    Returns (cube index, direct light or None, unoccluded AO samples).
+    """
+    index, pass_number, samples = task
+    bvh = worker_state["bvh"]
+    settings = worker_state["settings"]
+    points, normals = worker_state["cubes"][index]
+    points = np.asarray(points, dtype=np.float64)
+    normals = normalize(np.asarray(normals, dtype=np.float64))
+
+    direct = None
+    if pass_number == 0:
+        direct = direct_light(bvh, points, normals, worker_state["lights"], settings)
+    rng = np.random.RandomState((settings.get("seed", 0) * 7919 + pass_number * 104729 + index) % (2 ** 32))
+    unoccluded = ambient_occlusion(bvh, points, normals, samples, settings, rng)
+    return index, direct, unoccluded
@@ -0,0 +1,266 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Headless batch converter for whole directory trees, spread over a process
+pool. Only uses the bpy-free codecs, so it runs with a plain Python that has
+numpy or inside Blender:
+
+    python -m io_scene_habitatb.batch ncp levels/ [out/]
+    python -m io_scene_habitatb.batch prm cars/ out/ --scale 1.5 --axes x,-z,y
+    python -m io_scene_habitatb.batch w levels/ --set-flags 0x400 --clear-flags 0x800
+
+    blender --background --python-expr "from io_scene_habitatb import batch; batch.main()" -- ncp levels/
+
+Commands:
+    ncp     regenerate collision (.ncp) from every world (.w)
+    prm     re-encode meshes (.prm, .m) with a new scale, axes or flags
+    w       re-encode worlds (.w) with fixed face flags
+
+Without an output folder, files are written next to (or over) their source.
+"""
+
+import argparse, os, struct, sys, time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from . import const, codec_prm, codec_w, codec_ncp
+
+EXTENSIONS = {
+    "ncp": (".w",),
+    "prm": (".prm", ".m"),
+    "w": (".w",),
+    }
+
+
+######################################################
+# CONVERSIONS
+######################################################
+def apply_flags(flags, options):
+    set_flags = np.uint16(options["set_flags"] & 0xFFFF)
+    keep_flags = np.uint16(~options["clear_flags"] & 0xFFFF)
+    return (flags | set_flags) & keep_flags
+
+def parse_axes(text):
+    """
+    Parses "x,-z,y" (new x = old x, new y = -old z, new z = old y) into a
+    3x3 row-vector matrix.
+    """
+    axes = [axis.strip().lower() for axis in text.split(",")]
+    if len(axes) != 3 or sorted(axis.lstrip("-") for axis in axes) != ["x", "y", "z"]:
+        raise ValueError("axes must name x, y and z once each, e.g. x,-z,y: {}".format(text))
+    matrix = np.zeros((3, 3))
+    for new, axis in enumerate(axes):
+        matrix["xyz".index(axis.lstrip("-")), new] = -1 if axis.startswith("-") else 1
+    return matrix
+
+def convert_w_to_ncp(data, options):
+    """Builds collision for every valid face of a world."""
+    index, _ = codec_w.index_cubes(data)
+    positions, loop_verts, loop_total = [], [], []
+    vertex_offset = 0
+    for entry in index:
+        polys, verts = codec_prm.read_polys_verts(data, int(entry["offset"]),
+                                                  int(entry["poly_count"]), int(entry["vertex_count"]))
+        faces = codec_prm.decode_polys(polys, len(verts))
+        valid = faces["valid"]
+
+        # faces are wound the other way round in blender, which is what the encoder expects
+        order, present = codec_prm.export_loop_order(faces["loop_count"][valid])
+        indices = faces["indices"][valid][np.arange(len(order))[:, None], order]
+
+        positions.append(verts["position"])
+        loop_verts.append(indices[present] + vertex_offset)
+        loop_total.append(faces["loop_count"][valid])
+        vertex_offset += len(verts)
+
+    if loop_total:
+        positions = np.concatenate(positions)
+        loop_verts = np.concatenate(loop_verts)
+        loop_total = np.concatenate(loop_total)
+    else:
+        positions, loop_verts, loop_total = np.zeros((0, 3)), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if len(loop_total) > 0x7FFF:
+        raise ValueError("NCP files are limited to 32767 polyhedra ({})".format(len(loop_total)))
+
+    polyhedra = np.zeros(len(loop_total), dtype=codec_ncp.POLYHEDRON_DTYPE)
+    codec_ncp.encode_polyhedra(polyhedra, positions, loop_verts, np.cumsum(loop_total) - loop_total,
+                               loop_total, np.full(len(loop_total), options["material"], dtype=np.int32))
+    return (struct.pack("<h", len(polyhedra)) + polyhedra.tobytes() +
+            codec_ncp.encode_grid(*codec_ncp.build_grid(polyhedra["bbox"])))
+
+def convert_prm(data, options):
+    """Rescales, reorients and fixes the flags of a mesh."""
+    buf = bytearray(data)
+    # the arrays are views into buf, everything is changed in place
+    polys, verts = codec_prm.read_prm(buf)
+
+    matrix = options["axes"] * options["scale"]
+    verts["position"] = np.dot(verts["position"], matrix)
+    verts["normal"] = np.dot(verts["normal"], options["axes"])
+
+    # mirroring turns the faces inside out, reverse their corners again
+    if np.linalg.det(matrix) < 0:
+        loop_total = np.where(polys["flags"] & const.FACE_QUAD, 4, 3)
+        order, _ = codec_prm.export_loop_order(loop_total)
+        rows = np.arange(len(polys))[:, None]
+        for field in ("indices", "colors", "uvs"):
+            polys[field] = polys[field][rows, order]
+
+    polys["flags"] = apply_flags(polys["flags"], options)
+    return bytes(buf)
+
+def convert_w(data, options):
+    """Fixes the flags of all faces of a world, everything else is kept."""
+    buf = bytearray(data)
+    index, _ = codec_w.index_cubes(buf)
+    for entry in index:
+        polys, _ = codec_prm.read_polys_verts(buf, int(entry["offset"]), int(entry["poly_count"]), 0)
+        polys["flags"] = apply_flags(polys["flags"], options)
+    return bytes(buf)
+
+CONVERSIONS = {
+    "ncp": convert_w_to_ncp,
+    "prm": convert_prm,
+    "w": convert_w,
+    }
+
+
+######################################################
+# BATCH
+######################################################
+def collect_tasks(command, source, destination):
+    """Returns (source, output) paths for every file the command applies to."""
+    extensions = EXTENSIONS[command]
+    if os.path.isfile(source):
+        root, paths = os.path.dirname(source), [source]
+    else:
+        root, paths = source, []
+        for folder, _, names in os.walk(source):
+            paths.extend(os.path.join(folder, name) for name in sorted(names)
+                         if os.path.splitext(name)[1].lower() in extensions)
+
+    tasks = []
+    for path in paths:
+        output = path if destination is None else os.path.join(destination, os.path.relpath(path, root))
+        if command == "ncp":
+            output = os.path.splitext(output)[0] + ".ncp"
+        tasks.append((path, output))
+    return tasks
+
+def convert_file(command, source, output, options):
+    """
+    Runs in the worker processes. Returns source, input and output sizes
+    and the error message if the conversion failed.
+    """
+    try:
+        with open(source, "rb") as file:
+            data = file.read()
+        result = CONVERSIONS[command](data, options)
+        folder = os.path.dirname(output)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(output, "wb") as file:
+            file.write(result)
+        return source, len(data), len(result), None
+    except Exception as e:
+        return source, 0, 0, "{}: {}".format(type(e).__name__, e)
+
+def run(command, source, destination=None, options=None, jobs=None):
+    """
+    Converts every matching file below source and prints a summary.
+    Returns the number of files that failed.
+    """
+    options = dict(options or {})
+    options.setdefault("scale", 1.0)
+    options.setdefault("axes", np.identity(3))
+    options.setdefault("set_flags", 0)
+    options.setdefault("clear_flags", 0)
+    options.setdefault("material", 0)
+
+    tasks = collect_tasks(command, source, destination)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(tasks) or 1))
+    print("converting {} files with {} workers...".format(len(tasks), jobs))
+
+    time1 = time.perf_counter()
+    bytes_in = bytes_out = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(convert_file,
+                           [command] * len(tasks),
+                           [task[0] for task in tasks],
+                           [task[1] for task in tasks],
+                           [options] * len(tasks),
+                           chunksize=max(1, len(tasks) // (jobs * 4)))
+        for path, size_in, size_out, error in results:
+            if error:
+                failed += 1
+                print(" failed: {} ({})".format(path, error))
+                continue
+            bytes_in += size_in
+            bytes_out += size_out
+
+    elapsed = max(time.perf_counter() - time1, 1e-9)
+    converted = len(tasks) - failed
+    print("converted {} of {} files in {:.2f} sec: {:.1f} files/s, {:.2f} MB/s in, {:.2f} MB/s out".format(
+        converted, len(tasks), elapsed, converted / elapsed,
+        bytes_in / 1048576 / elapsed, bytes_out / 1048576 / elapsed))
+    return failed
+
+
+######################################################
+# COMMAND LINE
+######################################################
+def get_parser():
+    parser = argparse.ArgumentParser(prog="io_scene_habitatb.batch", description="Batch convert Re-Volt files.")
+    parser.add_argument("command", choices=sorted(CONVERSIONS), help="ncp: .w to .ncp, prm: re-encode .prm/.m, w: re-encode .w")
+    parser.add_argument("source", help="file or folder, folders are searched recursively")
+    parser.add_argument("destination", nargs="?", help="output folder, defaults to writing next to the sources")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes, defaults to the cpu count")
+    parser.add_argument("--scale", type=float, default=1.0, help="prm: scale factor")
+    parser.add_argument("--axes", default="x,y,z", help="prm: new axes in terms of the old ones, e.g. x,-z,y")
+    parser.add_argument("--set-flags", type=lambda v: int(v, 0), default=0, help="prm, w: face flags to set")
+    parser.add_argument("--clear-flags", type=lambda v: int(v, 0), default=0, help="prm, w: face flags to clear")
+    parser.add_argument("--material", type=int, default=0, help="ncp: surface material of all polyhedra")
+    return parser
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+        # blender passes the script's own arguments after "--"
+        if "--" in argv:
+            argv = argv[argv.index("--") + 1:]
+
+    # workers must not be spawned as another blender instance
+    try:
+        import bpy
+        if getattr(bpy.app, "binary_path_python", None):
+            multiprocessing.set_executable(bpy.app.binary_path_python)
+    except ImportError:
+        pass
+
+    args = get_parser().parse_args(argv)
+    try:
+        axes = parse_axes(args.axes)
+    except ValueError as e:
+        print(e)
+        return 2
+    options = {
+        "scale": args.scale,
+        "axes": axes,
+        "set_flags": args.set_flags,
+        "clear_flags": args.clear_flags,
+        "material": args.material,
+        }
+    return 1 if run(args.command, args.source, args.destination, options, args.jobs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
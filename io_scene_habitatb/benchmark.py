@@ -0,0 +1,460 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Benchmarks for the format codecs and the import/export operators, run on
+synthetic files (see synthetic.py). Sizes are polygon counts, node
+counts for PAN and line counts of the parameters.txt corpus.
+
+    python -m io_scene_habitatb.benchmark --sizes 1000,10000,100000
+    python -m io_scene_habitatb.benchmark --save baseline.json
+    python -m io_scene_habitatb.benchmark --compare baseline.json --threshold 0.2
+
+The codec cases run without bpy. Under Blender the operator cases are run
+as well:
+
+    blender --background --python-expr "from io_scene_habitatb import benchmark; benchmark.main()" -- --operators
+
+--check compares the array mesh build with the bmesh one instead, on
+PRMs with degenerate and duplicate faces added. Without bpy only the loop
+arrays are checked against the bmesh rules, under Blender both meshes are
+built and compared as well. It also runs the NCP queries on a file
+without polyhedra, which must miss everywhere:
+
+    python -m io_scene_habitatb.benchmark --check
+    blender --background --python-expr "from io_scene_habitatb import benchmark; benchmark.main()" -- --check
+
+Every case reports the best of --repeat runs. With --compare, cases that
+got slower than the baseline by more than the threshold are flagged and
+the exit code is 1.
+"""
+
+import argparse, json, os, platform, shutil, sys, tempfile, time
+import numpy as np
+
+from . import const, codec_prm, codec_w, codec_ncp, codec_pan, ncp_query, parameters, synthetic
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# largest size each format can hold
+SIZE_LIMITS = {
+    "prm": 0xFFFF,
+    "ncp": 0x7FFF,
+    }
+
+
+######################################################
+# CODEC CASES
+######################################################
+def parse_prm(data):
+    polys, verts = codec_prm.read_prm(data)
+    codec_prm.mesh_loops(codec_prm.decode_polys(polys, len(verts)))
+
+def encode_prm(data):
+    polys_in, verts_in = codec_prm.read_prm(data)
+    loops = codec_prm.mesh_loops(codec_prm.decode_polys(polys_in, len(verts_in)))
+    arrays = {key: loops[key] for key in ("flags", "texture", "loop_verts", "loop_start", "loop_total",
+                                          "loop_colors", "loop_alpha", "loop_uvs")}
+
+    def run():
+        buf, polys, verts = codec_prm.allocate_prm(len(arrays["loop_total"]), len(verts_in))
+        codec_prm.encode_polys(polys, **arrays)
+        verts[:] = verts_in
+        return buf
+    return run
+
+def roundtrip_prm(data):
+    polys_in, verts_in = codec_prm.read_prm(data)
+    loops = codec_prm.mesh_loops(codec_prm.decode_polys(polys_in, len(verts_in)))
+    buf, polys, verts = codec_prm.allocate_prm(len(loops["loop_total"]), len(verts_in))
+    codec_prm.encode_polys(polys, **{key: loops[key] for key in ("flags", "texture", "loop_verts", "loop_start",
+                                                                 "loop_total", "loop_colors", "loop_alpha", "loop_uvs")})
+    verts[:] = verts_in
+
+def parse_w(data):
+    index, _ = codec_w.index_cubes(data)
+    for entry in index:
+        polys, verts = codec_prm.read_polys_verts(data, int(entry["offset"]), int(entry["poly_count"]), int(entry["vertex_count"]))
+        codec_prm.mesh_loops(codec_prm.decode_polys(polys, len(verts)))
+
+def encode_w(data):
+    index, _ = codec_w.index_cubes(data)
+    cubes = []
+    for entry in index:
+        polys, verts = codec_prm.read_polys_verts(data, int(entry["offset"]), int(entry["poly_count"]), int(entry["vertex_count"]))
+        cubes.append((codec_prm.mesh_loops(codec_prm.decode_polys(polys, len(verts))), verts["position"].astype(np.float64)))
+
+    def run():
+        cube_mins, cube_maxs = [], []
+        for loops, coords in cubes:
+            center = coords.mean(axis=0)
+            radius, mins, maxs = codec_w.cube_bounds(coords, center)
+            cube_mins.append(mins)
+            cube_maxs.append(maxs)
+            buf, polys, verts = codec_w.allocate_cube(center, radius, mins, maxs, len(loops["loop_total"]), len(coords))
+            codec_prm.encode_polys(polys, loops["flags"], loops["texture"], loops["loop_verts"],
+                                   loops["loop_start"], loops["loop_total"],
+                                   loops["loop_colors"], loops["loop_alpha"], loops["loop_uvs"])
+            verts["position"] = coords
+        codec_w.level_ball(cube_mins, cube_maxs)
+    return run
+
+def parse_ncp(data):
+    polyhedra = codec_ncp.read_ncp(data)
+    codec_ncp.polyhedron_corners(polyhedra)
+    codec_ncp.read_grid(data, codec_ncp.grid_offset(polyhedra))
+
+def encode_ncp(data):
+    polyhedra_in = codec_ncp.read_ncp(data)
+    corners, valid = codec_ncp.polyhedron_corners(polyhedra_in)
+    corner_counts = valid.sum(axis=1)
+    positions = corners[valid]
+    loop_start = np.cumsum(corner_counts) - corner_counts
+    loop_verts = np.arange(len(positions))
+    materials = polyhedra_in["surface"]
+
+    def run():
+        polyhedra = np.zeros(len(corner_counts), dtype=codec_ncp.POLYHEDRON_DTYPE)
+        codec_ncp.encode_polyhedra(polyhedra, positions, loop_verts, loop_start, corner_counts, materials)
+        codec_ncp.encode_grid(*codec_ncp.build_grid(polyhedra["bbox"]))
+    return run
+
+def parse_pan(data):
+    start_node, total_dist, nodes = codec_pan.read_pan(data)
+    codec_pan.next_edges(nodes)
+
+def parse_parameters(data):
+    texts = [text.decode("ascii") for text in data.split(b"\0")]
+
+    def run():
+        for text in texts:
+            parameters.parse_parameters(text)
+    return run
+
+# name -> (format, function, whether it prepares and returns the timed function)
+CODEC_CASES = [
+    ("prm/parse", "prm", parse_prm, False),
+    ("prm/encode", "prm", encode_prm, True),
+    ("prm/roundtrip", "prm", roundtrip_prm, False),
+    ("w/parse", "w", parse_w, False),
+    ("w/encode", "w", encode_w, True),
+    ("ncp/parse", "ncp", parse_ncp, False),
+    ("ncp/encode", "ncp", encode_ncp, True),
+    ("pan/parse", "pan", parse_pan, False),
+    ("parameters/parse", "parameters", parse_parameters, True),
+    ]
+
+
+######################################################
+# OPERATOR CASES (blender only)
+######################################################
+def clear_scene():
+    import bpy
+    for ob in list(bpy.data.objects):
+        bpy.data.objects.remove(ob, do_unlink=True)
+    for me in list(bpy.data.meshes):
+        bpy.data.meshes.remove(me)
+
+def get_operator_cases():
+    """Returns (name, format, prepare, run) for the import and export operators."""
+    import bpy
+
+    def importer(operator):
+        return lambda path: (clear_scene, lambda: operator(filepath=path))
+
+    def exporter(import_operator, export_operator):
+        def prepare(path):
+            out = path + ".out"
+            def setup():
+                clear_scene()
+                import_operator(filepath=path)
+            return setup, lambda: export_operator(filepath=out)
+        return prepare
+
+    return [
+        ("op/import_prm", "prm", importer(bpy.ops.import_scene.prm)),
+        ("op/import_w", "w", importer(bpy.ops.import_scene.w)),
+        ("op/import_ncp", "ncp", importer(bpy.ops.import_scene.ncp)),
+        ("op/import_pan", "pan", importer(bpy.ops.import_scene.pan)),
+        ("op/export_prm", "prm", exporter(bpy.ops.import_scene.prm, bpy.ops.export_scene.prm)),
+        ("op/export_w", "w", exporter(bpy.ops.import_scene.w, bpy.ops.export_scene.w)),
+        ("op/export_ncp", "ncp", exporter(bpy.ops.import_scene.ncp, bpy.ops.export_scene.ncp)),
+        ]
+
+def enable_addon():
+    import addon_utils
+    addon_utils.enable(__package__, default_set=False)
+
+
+######################################################
+# MESH BUILD CHECKS
+######################################################
+def corrupt_polys(polys, vertex_count, seed=0):
+    """
+    Adds the faces bmesh refuses to a copy of polys: degenerate faces,
+    indices out of range, quads repeating a vertex and duplicates of
+    earlier faces in another vertex order.
+    """
+    rng = np.random.RandomState(seed)
+    polys = polys.copy()
+    rows = rng.permutation(len(polys))[:len(polys) // 5]
+    degenerate, out_of_range, repeated, duplicated = np.array_split(rows, 4)
+
+    polys["indices"][degenerate, 1] = polys["indices"][degenerate, 0]
+    polys["indices"][out_of_range, 2] = vertex_count + 5
+    polys["flags"][repeated] |= const.FACE_QUAD
+    polys["indices"][repeated, 3] = polys["indices"][repeated, 0]
+
+    duplicates = polys[duplicated]
+    duplicates["indices"][:, :3] = duplicates["indices"][:, [1, 2, 0]]
+    return np.concatenate((polys, duplicates))
+
+def reference_mesh_loops(faces, vertex_count):
+    """
+    Face by face version of codec_prm.mesh_loops that follows what bmesh
+    does in mesh_build.build_mesh_bmesh: faces with repeated or missing
+    vertices are refused, so are faces with the vertices of an earlier one,
+    and normal_flip reverses the loops behind the first one.
+    """
+    loops = {key: [] for key in ("polys", "loop_total", "loop_verts", "loop_uvs",
+                                 "loop_colors", "loop_alpha", "flags", "texture")}
+    existing = set()
+    indices = faces["indices"].tolist()
+    for poly, loop_count in enumerate(faces["loop_count"].tolist()):
+        verts = indices[poly][:loop_count]
+        if len(set(verts)) < loop_count or max(verts) >= vertex_count or frozenset(verts) in existing:
+            continue
+        existing.add(frozenset(verts))
+
+        order = [0] + list(range(loop_count - 1, 0, -1))
+        loops["polys"].append(poly)
+        loops["loop_total"].append(loop_count)
+        loops["loop_verts"].extend(verts[i] for i in order)
+        loops["loop_uvs"].extend(faces["uvs"][poly][order])
+        loops["loop_colors"].extend(faces["colors"][poly][order])
+        loops["loop_alpha"].extend(faces["alpha"][poly][order])
+        loops["flags"].append(faces["flags"][poly])
+        loops["texture"].append(faces["texture"][poly])
+
+    loops = {key: np.array(values) for key, values in loops.items()}
+    loops["loop_start"] = np.cumsum(loops["loop_total"]) - loops["loop_total"]
+    return loops
+
+def check_mesh_loops(data):
+    """Returns the arrays in which mesh_loops differs from the bmesh rules on a corrupted PRM."""
+    polys, verts = codec_prm.read_prm(data)
+    faces = codec_prm.decode_polys(corrupt_polys(polys, len(verts)), len(verts))
+    loops = codec_prm.mesh_loops(faces)
+    reference = reference_mesh_loops(faces, len(verts))
+
+    differences = []
+    for key in sorted(reference):
+        a, b = np.asarray(loops[key]), reference[key]
+        if a.shape != b.shape or not np.allclose(a, b):
+            differences.append(key)
+    return differences
+
+def check_mesh_build(data):
+    """
+    Builds a corrupted PRM with mesh_build.build_mesh and with the bmesh
+    reference, returns the differences compare_meshes finds (blender only).
+    """
+    import bpy
+    from . import mesh_build
+
+    polys, verts = codec_prm.read_prm(data)
+    faces = codec_prm.decode_polys(corrupt_polys(polys, len(verts)), len(verts))
+    positions = verts["position"].astype(np.float64)
+    a = bpy.data.meshes.new("check_array")
+    b = bpy.data.meshes.new("check_bmesh")
+    try:
+        mesh_build.build_mesh(a, positions, faces, {})
+        mesh_build.build_mesh_bmesh(b, positions, faces, {})
+        return mesh_build.compare_meshes(a, b)
+    finally:
+        bpy.data.meshes.remove(a)
+        bpy.data.meshes.remove(b)
+
+def check_empty_ncp():
+    """Returns the queries that fail or hit something on an NCP without polyhedra."""
+    polyhedra = np.zeros(0, dtype=codec_ncp.POLYHEDRON_DTYPE)
+    query = ncp_query.NCPQuery(polyhedra)
+    points = np.array([[0.0, -100.0, 0.0], [500.0, 0.0, -250.0]])
+    queries = {
+        "raycast": lambda: query.raycast(points, [[0.0, 1.0, 0.0]] * 2)[1],
+        "ground": lambda: query.ground(points[:, 0], points[:, 2])[2],
+        "sweep_spheres": lambda: query.sweep_spheres(points, points + [0.0, 200.0, 0.0], 10.0)[1],
+        }
+
+    differences = []
+    for name, run in sorted(queries.items()):
+        try:
+            index = run()
+        except Exception as e:
+            differences.append("{} ({})".format(name, type(e).__name__))
+            continue
+        if (index != -1).any():
+            differences.append(name)
+    return differences
+
+def run_checks(sizes):
+    """Runs the mesh build and NCP query checks, returns the number of failed ones."""
+    checks = [("mesh_loops", check_mesh_loops)]
+    if "bpy" in sys.modules:
+        checks.append(("build_mesh", check_mesh_build))
+
+    failed = 0
+    for size in sorted(set(case_size("prm", size) for size in sizes)):
+        data = synthetic.make_prm(size)
+        for name, check in checks:
+            differences = check(data)
+            print("{:<28} {}".format("check/{}/{}".format(name, size), ", ".join(differences) or "ok"))
+            failed += bool(differences)
+
+    differences = check_empty_ncp()
+    print("{:<28} {}".format("check/empty_ncp", ", ".join(differences) or "ok"))
+    failed += bool(differences)
+    return failed
+
+
+######################################################
+# RUNNER
+######################################################
+def best_time(func, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        time1 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - time1)
+    return min(times)
+
+def case_size(file_format, size):
+    return min(size, SIZE_LIMITS.get(file_format, size))
+
+def run(sizes=DEFAULT_SIZES, repeat=3, operators=False, case_filter=None):
+    """Runs all cases and returns {"case/size": seconds}."""
+    results = {}
+    inputs = {}
+
+    def get_input(file_format, size):
+        key = (file_format, size)
+        if key not in inputs:
+            inputs[key] = synthetic.GENERATORS[file_format](size)
+        return inputs[key]
+
+    for size in sizes:
+        for name, file_format, func, prepares in CODEC_CASES:
+            if case_filter and case_filter not in name:
+                continue
+            actual_size = case_size(file_format, size)
+            key = "{}/{}".format(name, actual_size)
+            if key in results:
+                continue
+            data = get_input(file_format, actual_size)
+            timed = func(data) if prepares else (lambda: func(data))
+            results[key] = best_time(timed, repeat)
+            print("{:<28} {:>10.4f} sec  {:>8.1f} MB/s".format(key, results[key], len(data) / 1048576 / max(results[key], 1e-9)))
+
+    if operators:
+        enable_addon()
+        folder = tempfile.mkdtemp(prefix="habitatb_benchmark_")
+        try:
+            for size in sizes:
+                for name, file_format, prepare in get_operator_cases():
+                    if case_filter and case_filter not in name:
+                        continue
+                    actual_size = case_size(file_format, size)
+                    key = "{}/{}".format(name, actual_size)
+                    if key in results:
+                        continue
+                    path = os.path.join(folder, "bench{}.{}".format(actual_size, file_format))
+                    if not os.path.exists(path):
+                        with open(path, "wb") as file:
+                            file.write(get_input(file_format, actual_size))
+                    setup, func = prepare(path)
+                    results[key] = best_time(func, repeat, setup)
+                    print("{:<28} {:>10.4f} sec".format(key, results[key]))
+        finally:
+            clear_scene()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return results
+
+def compare(results, baseline, threshold):
+    """Returns the cases that got slower than the baseline by more than threshold."""
+    slower = []
+    for key, seconds in sorted(results.items()):
+        before = baseline.get(key)
+        if before and seconds > before * (1 + threshold):
+            slower.append((key, before, seconds))
+    return slower
+
+def save_results(path, results, repeat):
+    with open(path, "w") as file:
+        json.dump({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "repeat": repeat,
+            "results": results,
+            }, file, indent=2, sort_keys=True)
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="io_scene_habitatb.benchmark", description="Benchmark the Re-Volt file codecs.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma separated polygon (node, line) counts, e.g. 1000,10000,1000000")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best one counts")
+    parser.add_argument("--filter", help="only run cases whose name contains this, e.g. w/ or encode")
+    parser.add_argument("--operators", action="store_true", help="also run the import/export operators (blender only)")
+    parser.add_argument("--check", action="store_true", help="only check that the array mesh build matches bmesh and that NCP queries handle empty files, in blender the meshes are built both ways")
+    parser.add_argument("--save", metavar="FILE", help="write the results to a baseline file")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a baseline file")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown against the baseline (0.15 = 15%%)")
+    return parser
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+        # blender passes the script's own arguments after "--"
+        if "--" in argv:
+            argv = argv[argv.index("--") + 1:]
+    args = get_parser().parse_args(argv)
+
+    if args.operators and "bpy" not in sys.modules:
+        print("--operators needs to run inside blender")
+        return 2
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    if args.check:
+        if "bpy" in sys.modules:
+            enable_addon()
+        return 1 if run_checks(sizes) else 0
+
+    results = run(sizes, args.repeat, args.operators, args.filter)
+
+    if args.save:
+        save_results(args.save, results, args.repeat)
+        print("saved {} results to {}".format(len(results), args.save))
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        slower = compare(results, baseline, args.threshold)
+        for key, before, seconds in slower:
+            print("SLOWER {:<28} {:.4f} -> {:.4f} sec ({:+.0%})".format(key, before, seconds, seconds / before - 1))
+        if slower:
+            return 1
+        print("no case is more than {:.0%} slower than {}".format(args.threshold, args.compare))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
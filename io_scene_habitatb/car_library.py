@@ -0,0 +1,256 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free index of the cars in a Re-Volt cars folder, kept in a JSON file
+between sessions. Every car folder is stored with its name, model paths,
+texture page and the mtimes of the folder and the files it uses:
+
+    index, counts = car_library.update("C:/Games/Re-Volt/cars")
+    for folder, car in car_library.find_cars(index, "mill"):
+        print(car["name"], car_library.get_model_paths(index, folder))
+
+update only reads the parameters.txt of folders whose mtime or files
+changed since the last scan. It runs from the command line as well:
+
+    python -m io_scene_habitatb.car_library cars/ --find mill
+"""
+
+import argparse, json, os, sys, time, zlib
+
+from . import parameters
+from .timing import log
+
+INDEX_VERSION = 1
+
+# index path -> index, so it's only read from disk once per session
+loaded = {}
+
+
+######################################################
+# INDEX FILE
+######################################################
+def get_index_path(cars_folder, config_folder=None):
+    """Index file of a cars folder, there's one per folder in config_folder."""
+    if config_folder is None:
+        config_folder = os.path.join(os.path.expanduser("~"), ".habitatb")
+    key = zlib.crc32(os.path.normcase(os.path.abspath(cars_folder)).encode("utf-8"))
+    return os.path.join(config_folder, "cars_{:08x}.json".format(key))
+
+def new_index(cars_folder):
+    return {"version": INDEX_VERSION, "root": os.path.abspath(cars_folder), "cars": {}}
+
+def load_index(path, cars_folder):
+    """Reads an index, a missing, outdated or broken one gives an empty index."""
+    index = loaded.get(path)
+    if index is not None and index["root"] == os.path.abspath(cars_folder):
+        return index
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            index = json.load(file)
+    except (OSError, ValueError) as e:
+        if os.path.exists(path):
+            log.warning("car index %s can't be read, rescanning: %s", path, e)
+        index = None
+    if not index or index.get("version") != INDEX_VERSION or index.get("root") != os.path.abspath(cars_folder):
+        index = new_index(cars_folder)
+    loaded[path] = index
+    return index
+
+def save_index(index, path):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    # written next to it first, a crash never leaves half an index
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(index, file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+    loaded[path] = index
+
+
+######################################################
+# SCANNING
+######################################################
+def get_file_name(files, game_path):
+    """Actual name of a file referenced by its game path (cars\\car\\body.prm)."""
+    if not isinstance(game_path, str):
+        return None
+    return files.get(game_path.replace("\\", "/").split("/")[-1].lower())
+
+def scan_car(path, folder_mtime):
+    """Reads a car folder into an index entry."""
+    files = {}
+    mtimes = {}
+    for entry in os.scandir(path):
+        if entry.is_file():
+            files[entry.name.lower()] = entry.name
+            mtimes[entry.name] = entry.stat().st_mtime_ns
+
+    car = {
+        "folder_mtime": folder_mtime,
+        "parameters": files.get("parameters.txt"),
+        "name": None,
+        "models": {},
+        "model_files": {},
+        "tpage": None,
+        "tpage_file": None,
+        "files": {},
+        }
+    if car["parameters"] is None:
+        return car
+
+    used = [car["parameters"]]
+    params = parameters.read_parameters(os.path.join(path, car["parameters"]))
+    if isinstance(params, dict):
+        name = params.get("name")
+        car["name"] = name if isinstance(name, str) and name else None
+        for key, value in params.items():
+            if key.startswith("model ") and isinstance(value, str) and value.lower() != "none":
+                number = key.split(" ")[1]
+                car["models"][number] = value
+                file_name = get_file_name(files, value)
+                if file_name:
+                    car["model_files"][number] = file_name
+                    used.append(file_name)
+        tpage = params.get("tpage")
+        car["tpage"] = tpage if isinstance(tpage, str) else None
+        car["tpage_file"] = get_file_name(files, tpage)
+        if car["tpage_file"]:
+            used.append(car["tpage_file"])
+    else:
+        car["parameters"] = None
+
+    car["files"] = {name: mtimes[name] for name in used}
+    return car
+
+def is_fresh(car, path, folder_mtime):
+    """Whether an entry still matches its folder."""
+    if car.get("folder_mtime") != folder_mtime:
+        return False
+    for name, mtime in car["files"].items():
+        try:
+            if os.stat(os.path.join(path, name)).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+def update_index(index):
+    """
+    Rescans the car folders that changed and drops the ones that are gone.
+    Returns the number of added, updated, removed and unchanged cars.
+    """
+    root = index["root"]
+    cars = index["cars"]
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+
+    seen = set()
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        seen.add(entry.name)
+        folder_mtime = entry.stat().st_mtime_ns
+        car = cars.get(entry.name)
+        if car is not None and is_fresh(car, entry.path, folder_mtime):
+            counts["unchanged"] += 1
+            continue
+        try:
+            cars[entry.name] = scan_car(entry.path, folder_mtime)
+        except OSError as e:
+            log.warning("car folder %s can't be read: %s", entry.path, e)
+            cars.pop(entry.name, None)
+            continue
+        counts["updated" if car is not None else "added"] += 1
+
+    for name in set(cars) - seen:
+        del cars[name]
+        counts["removed"] += 1
+    return counts
+
+def update(cars_folder, index_path=None):
+    """
+    Loads the index of cars_folder, brings it up to date and saves it if
+    anything changed. Returns the index and the counts of update_index.
+    """
+    if index_path is None:
+        index_path = get_index_path(cars_folder)
+    time1 = time.perf_counter()
+    index = load_index(index_path, cars_folder)
+    counts = update_index(index)
+    if counts["added"] or counts["updated"] or counts["removed"] or not os.path.exists(index_path):
+        save_index(index, index_path)
+    log.info("car index of %s: %d added, %d updated, %d removed, %d unchanged in %.3f sec",
+             cars_folder, counts["added"], counts["updated"], counts["removed"], counts["unchanged"],
+             time.perf_counter() - time1)
+    return index, counts
+
+
+######################################################
+# QUERIES
+######################################################
+def get_cars(index):
+    """(folder, car) of all folders with a valid parameters.txt, sorted by name."""
+    cars = [(folder, car) for folder, car in index["cars"].items() if car["parameters"]]
+    return sorted(cars, key=lambda item: (get_name(*item).lower(), item[0].lower()))
+
+def get_name(folder, car):
+    return car["name"] or folder
+
+def find_cars(index, text):
+    """Cars whose name or folder contains text, ignoring case."""
+    text = text.lower()
+    return [(folder, car) for folder, car in get_cars(index)
+            if text in folder.lower() or text in get_name(folder, car).lower()]
+
+def get_parameters_path(index, folder):
+    return os.path.join(index["root"], folder, index["cars"][folder]["parameters"])
+
+def get_model_paths(index, folder):
+    """{model number: file} of the models of a car that exist."""
+    car = index["cars"][folder]
+    return {int(number): os.path.join(index["root"], folder, name) for number, name in car["model_files"].items()}
+
+def get_tpage_path(index, folder):
+    name = index["cars"][folder]["tpage_file"]
+    return os.path.join(index["root"], folder, name) if name else None
+
+
+######################################################
+# COMMAND LINE
+######################################################
+def get_parser():
+    parser = argparse.ArgumentParser(prog="io_scene_habitatb.car_library", description="Index the cars of a Re-Volt cars folder.")
+    parser.add_argument("cars", help="the cars folder of a Re-Volt install")
+    parser.add_argument("--index", help="index file, defaults to one in ~/.habitatb")
+    parser.add_argument("--find", help="list the cars whose name or folder contains this")
+    return parser
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+        # blender passes the script's own arguments after "--"
+        if "--" in argv:
+            argv = argv[argv.index("--") + 1:]
+    args = get_parser().parse_args(argv)
+
+    time1 = time.perf_counter()
+    index, counts = update(args.cars, args.index)
+    print("{} cars: {} added, {} updated, {} removed, {} unchanged in {:.3f} sec".format(
+        len(get_cars(index)), counts["added"], counts["updated"], counts["removed"], counts["unchanged"],
+        time.perf_counter() - time1))
+
+    if args.find is not None:
+        for folder, car in find_cars(index, args.find):
+            print("{:<32} {:<16} {} models".format(get_name(folder, car), folder, len(car["model_files"])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free NCP decoding. Polyhedra are read into one structured array and
+their corners are solved for all polyhedra at once.
+
+NCP {
+    short       polyhedron_count
+    Polyhedron[polyhedron_count]
+
+    LookupGrid
+}
+
+Polyhedron (112 bytes) {
+    long        type        (bit 0 set: quad)
+    long        surface     (material)
+    float       planes[5][4]    (normal, distance: floor plane, then the cutting planes)
+    float       bbox[6]     (xlo, xhi, ylo, yhi, zlo, zhi)
+}
+
+LookupGrid {
+    float       min_x, min_z
+    float       x_size, z_size  (cell counts)
+    float       grid_size       (cell edge length)
+
+    Cell[x_size * z_size] {     (cell x + z * x_size)
+        long    count
+        long    polyhedra[count]
+    }
+}
+
+In memory the grid is a header tuple plus a CSR cell table: cell c holds
+indices[offsets[c]:offsets[c + 1]].
+"""
+
+import struct
+import numpy as np
+
+POLYHEDRON_DTYPE = np.dtype([
+    ("type", "<i4"),
+    ("surface", "<i4"),
+    ("planes", "<f4", (5, 4)),
+    ("bbox", "<f4", (6,)),
+    ])
+
+assert POLYHEDRON_DTYPE.itemsize == 112
+
+GRID_SIZE = 1024
+
+
+######################################################
+# DECODING
+######################################################
+def read_ncp(data):
+    """Returns the polyhedra of an NCP file as an array."""
+    polyhedron_count = int(np.frombuffer(data, dtype="<i2", count=1)[0])
+    return np.frombuffer(data, dtype=POLYHEDRON_DTYPE, count=polyhedron_count, offset=2)
+
+def grid_offset(polyhedra):
+    """Offset of the lookup grid in a file holding these polyhedra."""
+    return 2 + len(polyhedra) * POLYHEDRON_DTYPE.itemsize
+
+def read_grid(data, offset):
+    """
+    Reads the lookup grid starting at offset. Returns the header and the
+    CSR cell table, or None if the file has no grid.
+    """
+    if len(data) - offset < 20:
+        return None
+    header = struct.unpack_from("<5f", data, offset)
+    cell_count = int(header[2]) * int(header[3])
+    offset += 20
+
+    # cell lengths vary, so only their counts are walked one by one
+    counts = np.zeros(cell_count, dtype=np.int64)
+    count_positions = np.zeros(cell_count, dtype=np.int64)
+    position = 0
+    for c in range(cell_count):
+        count = struct.unpack_from("<l", data, offset + position * 4)[0]
+        counts[c] = count
+        count_positions[c] = position
+        position += 1 + count
+
+    cells = np.frombuffer(data, dtype="<i4", count=position, offset=offset)
+    is_index = np.ones(position, dtype=bool)
+    is_index[count_positions] = False
+    offsets = np.zeros(cell_count + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    header = (header[0], header[1], int(header[2]), int(header[3]), header[4])
+    return header, offsets, cells[is_index].astype(np.int64)
+
+def intersect_planes(n1, d1, n2, d2, n3, d3):
+    """
+    Solves the 3x3 systems n . x = -d for stacks of plane triples.
+    Returns the points and a mask that is False where the planes don't meet
+    in a single point (zero determinant).
+    """
+    det = np.einsum("...i,...i", n1, np.cross(n2, n3))
+    valid = det != 0
+    safe_det = np.where(valid, det, 1.0)[..., None]
+    points = -(d1[..., None] * np.cross(n2, n3) +
+               d2[..., None] * np.cross(n3, n1) +
+               d3[..., None] * np.cross(n1, n2)) / safe_det
+    return points, valid
+
+def polyhedron_corners(polyhedra):
+    """
+    Intersects the floor plane with every pair of neighbouring cutting planes.
+    Returns (N, 4, 3) corners and a (N, 4) mask of the usable ones, the fourth
+    corner of triangles is always masked out.
+    """
+    planes = polyhedra["planes"].astype(np.float64)
+    normals = planes[:, :, :3]
+    distances = planes[:, :, 3]
+
+    is_quad = (polyhedra["type"] & 1) != 0
+    plane_count = np.where(is_quad, 4, 3)
+
+    # cutting plane pairs (1, 2), (2, 3), (3, 1 or 4), (4, 1)
+    n = np.arange(4)
+    a = n + 1
+    b = (n[None, :] + 1) % plane_count[:, None] + 1
+    rows = np.arange(len(polyhedra))[:, None]
+
+    corners, valid = intersect_planes(
+        normals[:, None, 0], distances[:, None, 0],
+        normals[:, a], distances[:, a],
+        normals[rows, b], distances[rows, b])
+    valid &= n[None, :] < plane_count[:, None]
+    return corners, valid
+
+
+######################################################
+# ENCODING
+######################################################
+def face_loops(loop_start, loop_total):
+    """
+    Returns every face's loops laid out face after face, the loop following
+    each of them within its face and where each face's run starts.
+    """
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+    runs = np.cumsum(loop_total) - loop_total
+    local = np.arange(loop_total.sum()) - np.repeat(runs, loop_total)
+    first = np.repeat(loop_start, loop_total)
+    loops = first + local
+    next_loops = first + (local + 1) % np.repeat(loop_total, loop_total)
+    return loops, next_loops, runs
+
+def encode_polyhedra(polyhedra, positions, loop_verts, loop_start, loop_total, materials):
+    """
+    Fills polyhedron records from transformed vertex positions and the
+    mesh's loops: the floor plane through the face, a cutting plane along
+    each of the first four edges and the face's bbox.
+    """
+    if not len(polyhedra):
+        return
+    positions = np.asarray(positions, dtype=np.float64)
+    loop_verts = np.asarray(loop_verts, dtype=np.int64)
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+
+    loops, next_loops, runs = face_loops(loop_start, loop_total)
+    points = positions[loop_verts[loops]]
+    next_points = positions[loop_verts[next_loops]]
+
+    # floor plane (newell normal)
+    normals = np.add.reduceat(np.cross(points, next_points), runs)
+    normals /= np.maximum(np.sqrt((normals ** 2).sum(axis=1)), 1e-30)[:, None]
+    origin = positions[loop_verts[loop_start]]
+
+    planes = np.zeros((len(polyhedra), 5, 4))
+    planes[:, 0, :3] = normals
+    planes[:, 0, 3] = -(origin * normals).sum(axis=1)
+
+    # cutting planes go along the first four edges in reverse order
+    corner_count = np.minimum(loop_total, 4)
+    for k in range(4):
+        present = k < corner_count
+        i = np.where(present, corner_count - 1 - k, 0)
+        a = positions[loop_verts[loop_start + i]]
+        b = positions[loop_verts[loop_start + (i + 1) % corner_count]]
+        cut = np.cross(normals, a - b)
+        cut /= np.maximum(np.sqrt((cut ** 2).sum(axis=1)), 1e-30)[:, None]
+        planes[:, k + 1, :3] = np.where(present[:, None], cut, 0)
+        planes[:, k + 1, 3] = np.where(present, -(a * cut).sum(axis=1), 0)
+
+    mins = np.minimum.reduceat(points, runs)
+    maxs = np.maximum.reduceat(points, runs)
+
+    polyhedra["type"] = loop_total >= 4
+    polyhedra["surface"] = materials
+    polyhedra["planes"] = planes
+    polyhedra["bbox"] = np.column_stack((mins[:, 0], maxs[:, 0], mins[:, 1], maxs[:, 1], mins[:, 2], maxs[:, 2]))
+
+def build_grid(bboxes, grid_size=GRID_SIZE):
+    """
+    Bins polyhedron bboxes into the lookup grid. Returns the grid header
+    (min_x, min_z, x_size, z_size, grid_size) and the CSR cell table.
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 6)
+    if not len(bboxes):
+        return (0.0, 0.0, 0, 0, grid_size), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    min_x, max_x = bboxes[:, 0].min(), bboxes[:, 1].max()
+    min_z, max_z = bboxes[:, 4].min(), bboxes[:, 5].max()
+    x_size = int(np.ceil((max_x - min_x) / grid_size))
+    z_size = int(np.ceil((max_z - min_z) / grid_size))
+
+    # cell range covered by every polyhedron
+    from_x = np.floor((bboxes[:, 0] - min_x) / grid_size).astype(np.int64)
+    to_x = np.ceil((bboxes[:, 1] - min_x) / grid_size).astype(np.int64)
+    from_z = np.floor((bboxes[:, 4] - min_z) / grid_size).astype(np.int64)
+    to_z = np.ceil((bboxes[:, 5] - min_z) / grid_size).astype(np.int64)
+    span_x = np.maximum(to_x - from_x, 0)
+    span_z = np.maximum(to_z - from_z, 0)
+    counts = span_x * span_z
+
+    # one (cell, polyhedron) pair per covered cell
+    pair_polys = np.repeat(np.arange(len(bboxes)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_span_z = np.repeat(span_z, counts)
+    pair_x = np.repeat(from_x, counts) + local // np.maximum(pair_span_z, 1)
+    pair_z = np.repeat(from_z, counts) + local % np.maximum(pair_span_z, 1)
+    pair_cells = pair_x + pair_z * x_size
+
+    # stable sort keeps the polyhedra ascending within every cell
+    order = np.argsort(pair_cells, kind="mergesort")
+    indices = pair_polys[order]
+    offsets = np.zeros(x_size * z_size + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(pair_cells, minlength=x_size * z_size))
+    return (float(min_x), float(min_z), x_size, z_size, grid_size), offsets, indices
+
+def encode_grid(header, offsets, indices):
+    """Returns the lookup grid section as one buffer."""
+    cell_count = len(offsets) - 1
+    counts = np.diff(offsets)
+    cells = np.empty(cell_count + len(indices), dtype="<i4")
+    count_positions = offsets[:-1] + np.arange(cell_count)
+    cells[count_positions] = counts
+    cells[np.arange(len(indices)) + np.repeat(np.arange(cell_count) + 1, counts)] = indices
+    return struct.pack("<5f", *header) + cells.tobytes()
@@ -0,0 +1,73 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free PAN (position nodes) decoding. All nodes are read into one
+structured array.
+
+PAN {
+    long    number_nodes
+    long    start_node
+    float   total_dist
+
+    Nodes[number_nodes]
+}
+
+Node (48 bytes) {
+    Vector  position
+    float   distance        (to the finish line)
+
+    long[4] previous_node_ids   (-1: unused)
+    long[4] next_node_ids
+}
+"""
+
+import struct
+import numpy as np
+
+HEADER_FORMAT = "<llf"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+NODE_DTYPE = np.dtype([
+    ("position", "<f4", (3,)),
+    ("distance", "<f4"),
+    ("previous", "<i4", (4,)),
+    ("next", "<i4", (4,)),
+    ])
+
+assert NODE_DTYPE.itemsize == 48
+
+
+def read_pan(data):
+    """Returns start node, total distance and the nodes of a PAN file."""
+    node_count, start_node, total_dist = struct.unpack_from(HEADER_FORMAT, data, 0)
+    nodes = np.frombuffer(data, dtype=NODE_DTYPE, count=node_count, offset=HEADER_SIZE)
+    return start_node, total_dist, nodes
+
+def next_edges(nodes):
+    """
+    Returns the node pairs connected by next links as (node, next node), in
+    node order. Nodes linked both ways give one edge, pointing along the
+    link of the lower node.
+    """
+    count = len(nodes)
+    sources = np.repeat(np.arange(count, dtype=np.int64), 4)
+    targets = nodes["next"].astype(np.int64).ravel()
+    used = (targets >= 0) & (targets < count) & (targets != sources)
+    sources = sources[used]
+    targets = targets[used]
+    # first link of every pair of nodes, whichever way it points
+    keys = np.minimum(sources, targets) * count + np.maximum(sources, targets)
+    first = np.sort(np.unique(keys, return_index=True)[1])
+    return np.column_stack((sources[first], targets[first]))
+
+def encode_pan(start_node, total_dist, nodes):
+    """Returns a whole PAN file for a node array."""
+    nodes = np.asarray(nodes, dtype=NODE_DTYPE)
+    return struct.pack(HEADER_FORMAT, len(nodes), start_node, total_dist) + nodes.tobytes()
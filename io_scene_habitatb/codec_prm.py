@@ -0,0 +1,217 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free PRM decoding. The whole file is mapped onto numpy structured
+arrays in one go, the importers only consume the resulting arrays.
+
+PRM {
+    unsigned short  poly_count
+    unsigned short  vertex_count
+
+    Polygon[poly_count]
+    Vertex[vertex_count]
+}
+
+Polygon (60 bytes) {
+    unsigned short  flags
+    short           texture
+    unsigned short  indices[4]
+    unsigned char   colors[4][4]    (b, g, r, a)
+    float           uvs[4][2]
+}
+
+Vertex (24 bytes) {
+    float           position[3]
+    float           normal[3]
+}
+"""
+
+import struct
+import numpy as np
+
+from . import const
+
+HEADER_DTYPE = np.dtype([
+    ("poly_count", "<u2"),
+    ("vertex_count", "<u2"),
+    ])
+
+POLY_DTYPE = np.dtype([
+    ("flags", "<u2"),
+    ("texture", "<i2"),
+    ("indices", "<u2", (4,)),
+    ("colors", "u1", (4, 4)),
+    ("uvs", "<f4", (4, 2)),
+    ])
+
+VERTEX_DTYPE = np.dtype([
+    ("position", "<f4", (3,)),
+    ("normal", "<f4", (3,)),
+    ])
+
+assert POLY_DTYPE.itemsize == 60
+assert VERTEX_DTYPE.itemsize == 24
+
+
+######################################################
+# DECODING
+######################################################
+def read_polys_verts(data, offset, poly_count, vertex_count):
+    """Maps a polygon block followed by a vertex block onto arrays."""
+    polys = np.frombuffer(data, dtype=POLY_DTYPE, count=poly_count, offset=offset)
+    offset += poly_count * POLY_DTYPE.itemsize
+    verts = np.frombuffer(data, dtype=VERTEX_DTYPE, count=vertex_count, offset=offset)
+    return polys, verts
+
+def read_prm(data):
+    """Returns the polygon and vertex records of a PRM file as arrays."""
+    header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1)[0]
+    return read_polys_verts(data, HEADER_DTYPE.itemsize,
+                            int(header["poly_count"]), int(header["vertex_count"]))
+
+def transform_points(points, matrix):
+    """
+    Same as Vector(p) * matrix for every point: row vectors, padded with w = 1
+    when the matrix is 4x4.
+    """
+    m = np.array(matrix, dtype=np.float64)
+    out = np.dot(points, m[:3, :3])
+    if m.shape[0] == 4:
+        out += m[3, :3]
+    return out
+
+def decode_polys(polys, vertex_count):
+    """
+    Expands polygon records into per-loop arrays.
+    Loops keep file order, the importers reverse the winding themselves.
+    """
+    indices = polys["indices"].astype(np.int64)
+    flags = polys["flags"]
+
+    # quads that only reference three distinct vertices are triangles
+    i0, i1, i2, i3 = indices[:, 0], indices[:, 1], indices[:, 2], indices[:, 3]
+    tri_distinct = (i0 != i1) & (i1 != i2) & (i0 != i2)
+    quad_distinct = tri_distinct & (i3 != i0) & (i3 != i1) & (i3 != i2)
+    ordered = np.sort(indices, axis=1)
+    distinct_count = (ordered[:, 1:] != ordered[:, :-1]).sum(axis=1) + 1
+    is_quad = ((flags & const.FACE_QUAD) != 0) & (distinct_count != 3)
+
+    loop_count = np.where(is_quad, 4, 3)
+    in_range = np.where(is_quad, indices.max(axis=1), indices[:, :3].max(axis=1)) < vertex_count
+    valid = np.where(is_quad, quad_distinct, tri_distinct) & in_range
+
+    colors = polys["colors"].astype(np.float32) / 255
+
+    return {
+        "flags": flags.astype(np.int32),
+        "texture": polys["texture"].astype(np.int32),
+        "indices": indices,
+        "loop_count": loop_count,
+        "valid": valid,
+        "uvs": np.dstack((polys["uvs"][:, :, 0], 1 - polys["uvs"][:, :, 1])),
+        "colors": colors[:, :, 2::-1],
+        "alpha": 1 - colors[:, :, 3],
+        }
+
+def mesh_loops(faces):
+    """
+    Flattens decoded polygons into the per-loop arrays of a Blender mesh,
+    matching what creating them one by one through bmesh gives: invalid
+    faces and faces reusing the vertices of an earlier one are dropped and
+    the winding is flipped, which keeps the first corner in place.
+    """
+    keep = faces["valid"].copy()
+
+    # faces are unique by their vertex set, the first one wins
+    keys = np.where(np.arange(4) < faces["loop_count"][:, None], faces["indices"], -1)
+    keys = np.sort(keys, axis=1)
+    candidates = keep.nonzero()[0]
+    order = candidates[np.lexsort((candidates,) + tuple(keys[candidates].T[::-1]))]
+    duplicate = np.zeros(len(order), dtype=bool)
+    duplicate[1:] = np.all(keys[order][1:] == keys[order][:-1], axis=1)
+    keep[order[duplicate]] = False
+
+    polys = keep.nonzero()[0]
+    loop_total = faces["loop_count"][polys]
+    is_quad = loop_total > 3
+    slots = np.where(is_quad[:, None], [0, 3, 2, 1], [0, 2, 1, 3])
+    present = slots < loop_total[:, None]
+    rows = polys[:, None]
+
+    return {
+        "polys": polys,
+        "loop_start": np.cumsum(loop_total) - loop_total,
+        "loop_total": loop_total,
+        "loop_verts": faces["indices"][rows, slots][present],
+        "loop_uvs": faces["uvs"][rows, slots][present],
+        "loop_colors": faces["colors"][rows, slots][present],
+        "loop_alpha": faces["alpha"][rows, slots][present],
+        "flags": faces["flags"][polys],
+        "texture": faces["texture"][polys],
+        }
+
+
+######################################################
+# ENCODING
+######################################################
+def allocate_prm(poly_count, vertex_count):
+    """
+    Preallocates a whole PRM file. Returns the buffer and writable polygon
+    and vertex arrays that live inside of it, so the file can be written
+    out in one go once they are filled.
+    """
+    if poly_count > 0xFFFF or vertex_count > 0xFFFF:
+        raise ValueError("PRM meshes are limited to 65535 polygons and vertices ({} / {})".format(poly_count, vertex_count))
+    buf = bytearray(HEADER_DTYPE.itemsize + poly_count * POLY_DTYPE.itemsize + vertex_count * VERTEX_DTYPE.itemsize)
+    struct.pack_into("<HH", buf, 0, poly_count, vertex_count)
+    polys, verts = read_polys_verts(buf, HEADER_DTYPE.itemsize, poly_count, vertex_count)
+    return buf, polys, verts
+
+def export_loop_order(loop_total):
+    """
+    Returns the (N, 4) loop slots faces are written in (2-1-0-3 for
+    triangles, 3-2-1-0 for quads) and a mask of the slots that exist.
+    """
+    loop_total = np.asarray(loop_total)
+    is_quad = loop_total > 3
+    order = np.where(is_quad[:, None], [3, 2, 1, 0], [2, 1, 0, 3])
+    return order, order < loop_total[:, None]
+
+def encode_polys(polys, flags, texture, loop_verts, loop_start, loop_total,
+                 loop_colors=None, loop_alpha=None, loop_uvs=None):
+    """
+    Fills polygon records from per-face and per-loop mesh arrays.
+    Colors and alpha are 0..1 floats, missing layers write opaque white
+    and zero UVs. Slots of missing corners get zero indices, (1, 1, 1, 1)
+    color bytes and zero UVs.
+    """
+    order, present = export_loop_order(loop_total)
+    loops = np.where(present, np.asarray(loop_start)[:, None] + order, 0)
+    is_quad = np.asarray(loop_total) > 3
+
+    polys["flags"] = np.where(is_quad, np.asarray(flags) | const.FACE_QUAD, flags)
+    polys["texture"] = texture
+    polys["indices"] = np.where(present, np.asarray(loop_verts)[loops], 0)
+
+    colors = np.full(loops.shape + (4,), 255, dtype=np.int64)
+    if loop_colors is not None:
+        colors[:, :, 2::-1] = (np.asarray(loop_colors, dtype=np.float32)[loops] * 255).astype(np.int64)
+    if loop_alpha is not None:
+        colors[:, :, 3] = (np.asarray(loop_alpha, dtype=np.float32)[loops] * 255).astype(np.int64)
+    colors[~present] = 1
+    polys["colors"] = colors
+
+    uvs = np.zeros(loops.shape + (2,), dtype=np.float32)
+    if loop_uvs is not None:
+        loop_uvs = np.asarray(loop_uvs, dtype=np.float32)
+        uvs[:, :, 0] = loop_uvs[loops, 0]
+        uvs[:, :, 1] = 1 - loop_uvs[loops, 1]
+    uvs[~present] = 0
+    polys["uvs"] = uvs
@@ -0,0 +1,205 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free W reading. The file is memory-mapped and a single pass over the
+cube headers builds an offset index, cubes are only decoded when asked for.
+
+W {
+    long        cube_count
+    Cube[cube_count]
+
+    long        big_cube_count
+    BigCube[big_cube_count]
+
+    long        texture_animation_count
+    ...
+}
+
+Cube {
+    float       center[3]
+    float       radius
+    float       bbox[6]     (xlo, xhi, ylo, yhi, zlo, zhi)
+    short       poly_count
+    short       vertex_count
+
+    Polygon[poly_count]     (see codec_prm)
+    Vertex[vertex_count]
+}
+"""
+
+import mmap, struct
+import numpy as np
+
+from . import codec_prm
+
+CUBE_HEADER_DTYPE = np.dtype([
+    ("center", "<f4", (3,)),
+    ("radius", "<f4"),
+    ("bbox", "<f4", (6,)),
+    ("poly_count", "<u2"),
+    ("vertex_count", "<u2"),
+    ])
+CUBE_HEADER_FORMAT = "<10f2H"
+
+# one entry per cube, filled by the header pass
+CUBE_INDEX_DTYPE = np.dtype([
+    ("center", "<f4", (3,)),
+    ("radius", "<f4"),
+    ("bbox", "<f4", (6,)),
+    ("poly_count", "<u4"),
+    ("vertex_count", "<u4"),
+    ("offset", "<u8"),
+    ])
+
+
+def index_cubes(data):
+    """
+    Walks the cube headers once and returns the cube index and the offset
+    right behind the last cube.
+    """
+    cube_count = struct.unpack_from("<l", data, 0)[0]
+    index = np.zeros(cube_count, dtype=CUBE_INDEX_DTYPE)
+    rows = []
+    offset = 4
+    for n in range(cube_count):
+        header = struct.unpack_from(CUBE_HEADER_FORMAT, data, offset)
+        offset += CUBE_HEADER_DTYPE.itemsize
+        poly_count, vertex_count = header[10], header[11]
+        rows.append(header + (offset,))
+        offset += poly_count * codec_prm.POLY_DTYPE.itemsize + vertex_count * codec_prm.VERTEX_DTYPE.itemsize
+
+    if rows:
+        rows = np.array(rows, dtype=np.float64)
+        index["center"] = rows[:, 0:3]
+        index["radius"] = rows[:, 3]
+        index["bbox"] = rows[:, 4:10]
+        index["poly_count"] = rows[:, 10]
+        index["vertex_count"] = rows[:, 11]
+        index["offset"] = rows[:, 12]
+    return index, offset
+
+def transform_bboxes(bboxes, matrix):
+    """
+    Transforms (xlo, xhi, ylo, yhi, zlo, zhi) boxes by transforming their
+    corners and returns the boxes around the results as (mins, maxs).
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 6)
+    corners = np.empty((len(bboxes), 8, 3))
+    for c in range(8):
+        corners[:, c, 0] = bboxes[:, 0 + (c & 1)]
+        corners[:, c, 1] = bboxes[:, 2 + ((c >> 1) & 1)]
+        corners[:, c, 2] = bboxes[:, 4 + ((c >> 2) & 1)]
+    corners = codec_prm.transform_points(corners.reshape(-1, 3), matrix).reshape(-1, 8, 3)
+    return corners.min(axis=1), corners.max(axis=1)
+
+
+class WReader:
+    """
+    Indexed reader for W files. Use as a context manager or call close().
+
+    reader.index holds center, radius, bbox, poly_count, vertex_count and
+    file offset of every cube.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.file = open(filepath, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.index, self.end_offset = index_cubes(self.data)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        if getattr(self, "data", None) is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    def cube(self, n):
+        """Decodes cube n and returns its polygon and vertex records."""
+        entry = self.index[n]
+        polys, verts = codec_prm.read_polys_verts(self.data, int(entry["offset"]),
+                                                  int(entry["poly_count"]), int(entry["vertex_count"]))
+        # copy out of the map so it can be closed while the arrays live on
+        return polys.copy(), verts.copy()
+
+    def select(self, start=0, end=None, region=None, matrix=None):
+        """
+        Returns the numbers of all cubes in [start, end] whose bbox intersects
+        region = (mins, maxs). The region is given in file space, or in the
+        space the cubes are transformed into by matrix.
+        """
+        count = len(self.index)
+        end = count - 1 if end is None or end < 0 else min(end, count - 1)
+        mask = np.zeros(count, dtype=bool)
+        mask[start:end + 1] = True
+
+        if region is not None:
+            if matrix is None:
+                bboxes = self.index["bbox"]
+                mins, maxs = bboxes[:, 0::2], bboxes[:, 1::2]
+            else:
+                mins, maxs = transform_bboxes(self.index["bbox"], matrix)
+            lo = np.asarray(region[0], dtype=np.float64)
+            hi = np.asarray(region[1], dtype=np.float64)
+            mask &= np.all((mins <= hi) & (maxs >= lo), axis=1)
+
+        return mask.nonzero()[0]
+
+
+######################################################
+# ENCODING
+######################################################
+def cube_bounds(positions, center):
+    """
+    Returns the bound ball radius around center and the bbox (mins, maxs)
+    of a cube's transformed vertex positions.
+    """
+    if not len(positions):
+        return 0.0, np.zeros(3), np.zeros(3)
+    radius = float(np.sqrt(((positions - center) ** 2).sum(axis=1).max()))
+    return radius, positions.min(axis=0), positions.max(axis=0)
+
+def level_ball(cube_mins, cube_maxs):
+    """Returns center and radius of the ball around all cube bboxes."""
+    if not len(cube_mins):
+        return np.zeros(3), 0.0
+    mins = np.min(cube_mins, axis=0)
+    maxs = np.max(cube_maxs, axis=0)
+    return (mins + maxs) / 2, float(np.sqrt(((maxs - mins) ** 2).sum())) / 2
+
+def pack_cube_header(center, radius, mins, maxs, poly_count, vertex_count):
+    return struct.pack(CUBE_HEADER_FORMAT, center[0], center[1], center[2], radius,
+                       mins[0], maxs[0], mins[1], maxs[1], mins[2], maxs[2],
+                       poly_count, vertex_count)
+
+def allocate_cube(center, radius, mins, maxs, poly_count, vertex_count):
+    """
+    Preallocates one cube with its header written. Returns the buffer and
+    writable polygon and vertex arrays inside of it.
+    """
+    if poly_count > 0x7FFF or vertex_count > 0x7FFF:
+        raise ValueError("W cubes are limited to 32767 polygons and vertices ({} / {})".format(poly_count, vertex_count))
+    header_size = CUBE_HEADER_DTYPE.itemsize
+    buf = bytearray(header_size + poly_count * codec_prm.POLY_DTYPE.itemsize + vertex_count * codec_prm.VERTEX_DTYPE.itemsize)
+    buf[:header_size] = pack_cube_header(center, radius, mins, maxs, poly_count, vertex_count)
+    polys, verts = codec_prm.read_polys_verts(buf, header_size, poly_count, vertex_count)
+    return buf, polys, verts
@@ -0,0 +1,168 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Per-scene index of what can be exported, so the tool panel and the W and
+NCP exporters don't have to look at every object of the scene.
+
+The index counts objects by rv_type, export_as_w and export_as_ncp and
+keeps the mesh objects that go into a W or NCP file in scene order. It is
+updated in place by the update callbacks of those properties, dropped when
+objects are added to or removed from the scene or an object newly goes
+into a W or NCP file, and cleared on file load and undo. It's rebuilt the
+next time it's asked for.
+"""
+
+import bpy
+from collections import Counter, OrderedDict
+
+# scene pointer -> index
+indexes = {}
+
+
+######################################################
+# INDEX
+######################################################
+def get_state(ob):
+    """What an object contributes to the index."""
+    revolt = ob.revolt
+    return (revolt.rv_type, revolt.export_as_w, revolt.export_as_ncp, ob.type == 'MESH', ob.name)
+
+def get_files(state):
+    """The files (WORLD, NCP) an object with this state goes into."""
+    rv_type, export_as_w, export_as_ncp, is_mesh, name = state
+    files = set()
+    if is_mesh and (rv_type == "WORLD" or export_as_w):
+        files.add("WORLD")
+    if is_mesh and (rv_type == "NCP" or export_as_ncp):
+        files.add("NCP")
+    return files
+
+def count_state(index, state, sign):
+    rv_type, export_as_w, export_as_ncp, is_mesh, name = state
+    index["counts"][rv_type] += sign
+    index["counts"]["export_as_w"] += sign * export_as_w
+    index["counts"]["export_as_ncp"] += sign * export_as_ncp
+
+def add_state(index, pointer, state):
+    index["states"][pointer] = state
+    count_state(index, state, 1)
+    for rv_type in get_files(state):
+        index[rv_type][pointer] = state[-1]
+
+def build_index(scene):
+    index = {
+        "object_count": len(scene.objects),
+        "counts": Counter(),
+        "states": {},
+        "WORLD": OrderedDict(),
+        "NCP": OrderedDict(),
+        }
+    for ob in scene.objects:
+        add_state(index, ob.as_pointer(), get_state(ob))
+    indexes[scene.as_pointer()] = index
+    return index
+
+def get_index(scene):
+    index = indexes.get(scene.as_pointer())
+    if index is None or index["object_count"] != len(scene.objects):
+        index = build_index(scene)
+    return index
+
+def update_object(ob):
+    """
+    Updates the entry of ob in the indexes of all its scenes in place, the
+    export objects keep their order. An index an object newly goes into a
+    file of is dropped instead, the rebuild puts it in scene order.
+    """
+    pointer = ob.as_pointer()
+    state = get_state(ob)
+    for scene in ob.users_scene:
+        index = indexes.get(scene.as_pointer())
+        if index is None:
+            continue
+        old_state = index["states"].get(pointer)
+        if old_state is None or get_files(state) - get_files(old_state):
+            del indexes[scene.as_pointer()]
+            continue
+        count_state(index, old_state, -1)
+        count_state(index, state, 1)
+        index["states"][pointer] = state
+        for rv_type in ("WORLD", "NCP"):
+            if rv_type in get_files(state):
+                # assigning an existing key keeps its position
+                index[rv_type][pointer] = state[-1]
+            else:
+                index[rv_type].pop(pointer, None)
+
+
+######################################################
+# QUERIES
+######################################################
+def get_counts(scene):
+    """Object counts by rv_type, plus export_as_w and export_as_ncp."""
+    return get_index(scene)["counts"]
+
+def can_export(scene, rv_type):
+    """Whether there are mesh objects for a WORLD or NCP file."""
+    return bool(get_index(scene)[rv_type])
+
+def get_export_objects(scene, rv_type):
+    """Mesh objects going into a WORLD or NCP file, in scene order as of the last rebuild."""
+    for attempt in range(2):
+        objects = []
+        for pointer, name in get_index(scene)[rv_type].items():
+            ob = scene.objects.get(name)
+            if ob is None or ob.as_pointer() != pointer:
+                # renamed or replaced since the index was built
+                break
+            objects.append(ob)
+        else:
+            return objects
+        build_index(scene)
+    return objects
+
+
+######################################################
+# CALLBACKS
+######################################################
+def on_property_update(self, context):
+    """Update callback of the object properties the index depends on."""
+    update_object(self.id_data)
+
+@bpy.app.handlers.persistent
+def on_scene_update(scene):
+    index = indexes.get(scene.as_pointer())
+    if index is None:
+        return
+    # objects were added or removed, also when as many were added as removed
+    if (index["object_count"] != len(scene.objects) or
+            index["states"].keys() != {ob.as_pointer() for ob in scene.objects}):
+        del indexes[scene.as_pointer()]
+
+@bpy.app.handlers.persistent
+def on_load(dummy):
+    indexes.clear()
+
+HANDLERS = (
+    (bpy.app.handlers.scene_update_post, on_scene_update),
+    (bpy.app.handlers.load_post, on_load),
+    (bpy.app.handlers.undo_post, on_load),
+    (bpy.app.handlers.redo_post, on_load),
+    )
+
+def register():
+    for handlers, function in HANDLERS:
+        handlers.append(function)
+
+def unregister():
+    for handlers, function in HANDLERS:
+        if function in handlers:
+            handlers.remove(function)
+    indexes.clear()
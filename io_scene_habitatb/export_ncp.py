@@ -8,12 +8,14 @@
 # ##### END LICENSE BLOCK #####
 
 
-import time, struct, math
+import struct, math
 import os.path as path
 from math import sqrt, pow, ceil, floor, pi
 import bpy, bmesh, mathutils
+import numpy as np
 from mathutils import Matrix
-from . import helpers, const
+from . import helpers, const, codec_ncp, export_prm, export_w, timing, export_index
+from .timing import log
 
 
 
@@ -21,93 +23,49 @@ from . import helpers, const
 # EXPORT MAIN FILES
 ######################################################
 
-def save_ncp_file(file, ob, matrix):
+def save_ncp_file(file, matrix):
     scn = bpy.context.scene
 
-    bm = bmesh.new() # big mesh for all ncp objects
-
-    # merge all objects into one mesh
-    for obj in scn.objects:
-        if obj.data and (obj.revolt.rv_type == "NCP" or obj.revolt.export_as_ncp == True):
-            tempmesh = bpy.data.meshes.new("temp") # create a temporary mesh
-            bmtemp = bmesh.new() # temporary mesh to add to the bm
-            bmtemp.from_mesh(obj.data) # fill temp mesh with object data
-            
-            # apply scale, position and rotation
-            bmesh.ops.scale(bm, vec=ob.scale, space=ob.matrix_basis, verts=bm.verts)
-            bmesh.ops.transform(bm, matrix=Matrix.Translation(ob.location), space=ob.matrix_world, verts=bm.verts)
-            bmesh.ops.rotate(bm, cent=ob.location, matrix=ob.rotation_euler.to_matrix(), space=ob.matrix_world, verts=bm.verts)
-            
-            bmtemp.to_mesh(tempmesh) # save temp bmesh into mesh
-            bmtemp.free()
-            bm.from_mesh(tempmesh) # add temp mesh to the big mesh
-
-    file.write(struct.pack("<h", len(bm.faces)))
-    material_layer = bm.faces.layers.int.get("revolt_material") or bm.faces.layers.int.new("revolt_material")
-    
-    print(file.name)
-    
-    for face in bm.faces:
-        # write face type (tris / quad) and material.
-        file.write(struct.pack("<ll", 0 if len(face.verts) < 4 else 1, face[material_layer]))
-        
-        # write the floor plane
-        normal = face.normal * matrix
-        normal.length = 1
-        point = face.verts[0].co * matrix
-        distance = -point.x * normal.x - point.y * normal.y - point.z * normal.z
-        file.write(struct.pack("<4f", normal[0], normal[1], normal[2], distance))
-        
-        # write each cutting plane.
-        vertex_count = len(face.verts[:4])
-        for i in range(vertex_count - 1, -1, -1):
-            a = face.verts[i].co * matrix
-            b = face.verts[(i + 1) % vertex_count].co * matrix
-            normal2 = normal.cross(a - b)
-            normal2.length = 1
-            distance = -a.x * normal2.x - a.y * normal2.y - a.z * normal2.z
-            file.write(struct.pack("<4f", normal2[0], normal2[1], normal2[2], distance))
-            
-        # write the rest of the cutting planes if the number of edges is lower than four.
-        for i in range(4 - vertex_count):
-            file.write(struct.pack("<4f", 0, 0, 0, 0))
-        
-        # write bounding box.
-        verts = [v.co * matrix for v in face.verts]
-        min_point = [min([v.x for v in verts]), min([v.y for v in verts]), min([v.z for v in verts])]
-        max_point = [max([v.x for v in verts]), max([v.y for v in verts]), max([v.z for v in verts])]
-        file.write(struct.pack("<6f", min_point[0], max_point[0], min_point[1], max_point[1], min_point[2], max_point[2]))
+    export_objs = export_index.get_export_objects(scn, "NCP")
+
+    file.write(struct.pack("<h", sum(len(obj.data.polygons) for obj in export_objs)))
+
+    # encode and write the polyhedra object by object, only the bboxes are kept for the lookup grid
+    bboxes = []
+    for obj in export_objs:
+        mesh = obj.data
+
+        # apply scale, position and rotation
+        with timing.phase("transform"):
+            coords, normals = export_prm.get_vertex_arrays(mesh, export_w.get_export_matrix(obj), matrix)
+
+        poly_count = len(mesh.polygons)
+        with timing.phase("mesh arrays"):
+            material_layer = mesh.polygon_layers_int.get("revolt_material")
+            if material_layer:
+                materials = export_prm.get_layer_values(material_layer.data, "value", poly_count, dtype=np.int32)
+            else:
+                materials = np.zeros(poly_count, dtype=np.int32)
+            loop_verts = export_prm.get_layer_values(mesh.loops, "vertex_index", len(mesh.loops), dtype=np.int32)
+            loop_start = export_prm.get_layer_values(mesh.polygons, "loop_start", poly_count, dtype=np.int32)
+            loop_total = export_prm.get_layer_values(mesh.polygons, "loop_total", poly_count, dtype=np.int32)
+
+        with timing.phase("encode"):
+            polyhedra = np.zeros(poly_count, dtype=codec_ncp.POLYHEDRON_DTYPE)
+            codec_ncp.encode_polyhedra(polyhedra, coords, loop_verts, loop_start, loop_total, materials)
+        with timing.phase("write"):
+            file.write(polyhedra.tobytes())
+        bboxes.append(polyhedra["bbox"].copy())
+        timing.count("faces", poly_count)
+        timing.count("bytes", polyhedra.nbytes)
         
     # write the lookup grid.
-    grid_size = 1024
-    x_coords = [(v.co * matrix).x for v in bm.verts]
-    z_coords = [(v.co * matrix).z for v in bm.verts]
-    min_x = min(x_coords)
-    max_x = max(x_coords)
-    min_z = min(z_coords)
-    max_z = max(z_coords)
-    x_size = ceil((max_x - min_x) / grid_size)
-    z_size = ceil((max_z - min_z) / grid_size)
-    lookup_table = [[] for n in range(x_size * z_size)]
-    
-    for face in bm.faces:
-        verts = [v.co * matrix for v in face.verts]
-        from_x = floor((min([v.x for v in verts]) - min_x) / grid_size)
-        to_x = ceil((max([v.x for v in verts]) - min_x) / grid_size)
-        from_z = floor((min([v.z for v in verts]) - min_z) / grid_size)
-        to_z = ceil((max([v.z for v in verts]) - min_z) / grid_size)
-        for x in range(from_x, to_x):
-            for z in range(from_z, to_z):
-                lookup_table[x + z * x_size].append(face.index)
-    
-    file.write(struct.pack("<5f", min_x, min_z, x_size, z_size, grid_size))
-    for list in lookup_table:
-        file.write(struct.pack("<l", len(list)))
-        for index in list:
-            file.write(struct.pack("<l", index))
-        
-    file.close()
-    bm.free()
+    with timing.phase("grid"):
+        bboxes = np.concatenate(bboxes) if bboxes else np.zeros((0, 6), dtype=np.float32)
+        grid = codec_ncp.encode_grid(*codec_ncp.build_grid(bboxes))
+    with timing.phase("write"):
+        file.write(grid)
+    timing.count("bytes", len(grid))
 
 
 
@@ -115,26 +73,18 @@ def save_ncp_file(file, ob, matrix):
 # EXPORT
 ######################################################
 def save_ncp(filepath, context, matrix):
-             
-    time1 = time.clock()
 
-    ob = bpy.context.active_object
-    print("exporting ncp: {} as {}...".format(str(ob), filepath))
+    log.info("exporting ncp: %s...", filepath)
 
     # write the actual data
     file = open(filepath, 'wb')
-    save_ncp_file(file, ob, matrix)
+    save_ncp_file(file, matrix)
     file.close()
-     
-    # ncp export complete
-    print(" done in %.4f sec." % (time.clock() - time1))
 
 
-def save(operator, filepath, context, matrix):
+def save(operator, filepath, context, matrix, report_memory=False):
     
     # save ncp file
-    save_ncp(filepath,
-             context, matrix
-             )
+    helpers.run_measured(operator, report_memory, save_ncp, filepath, context, matrix)
 
     return {'FINISHED'}
\ No newline at end of file
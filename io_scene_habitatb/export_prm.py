@@ -8,108 +8,120 @@
 # ##### END LICENSE BLOCK #####
 
 
-import time, struct, math
+import struct, math
 import os.path as path
 
 import bpy, bmesh
+import numpy as np
 from mathutils import Color, Vector, Matrix
-from . import helpers, const
+from . import helpers, const, codec_prm, timing
+from .timing import log
 
 ######################################################
 # EXPORT MAIN FILES
 ######################################################
 
-def save_prm_file(file, ob, matrix):
-    scn = bpy.context.scene
+def get_layer_values(collection, attribute, count, width=1, dtype=np.float32):
+    values = np.empty(count * width, dtype=dtype)
+    collection.foreach_get(attribute, values)
+    return values.reshape(-1, width) if width > 1 else values
+
+def get_texture_numbers(mesh, use_tex_num, default_texture=0):
+    """
+    Returns the texture number of every face. Image names are only
+    resolved once per image.
+    """
+    poly_count = len(mesh.polygons)
+    texture_layer = mesh.polygon_layers_int.get("texture")
+    if texture_layer:
+        textures = get_layer_values(texture_layer.data, "value", poly_count, dtype=np.int32)
+    else:
+        textures = np.full(poly_count, default_texture, dtype=np.int32)
+
+    uv_texture = mesh.uv_textures.active
+    if uv_texture and not use_tex_num:
+        image_numbers = {None: -2}
+        face_images = [face.image.name if face.image else None for face in uv_texture.data]
+        for name in face_images:
+            if name not in image_numbers:
+                image_numbers[name] = helpers.texture_to_int(name)
+        numbers = np.array([image_numbers[name] for name in face_images], dtype=np.int32)
+        textures = np.where(numbers != -2, numbers, textures)
+    return textures
+
+def get_poly_arrays(mesh, use_tex_num, default_texture=0):
+    """Collects all per-face and per-loop data needed to write polygons."""
+    poly_count = len(mesh.polygons)
+    loop_count = len(mesh.loops)
+
+    arrays = {
+        "loop_start": get_layer_values(mesh.polygons, "loop_start", poly_count, dtype=np.int32),
+        "loop_total": get_layer_values(mesh.polygons, "loop_total", poly_count, dtype=np.int32),
+        "loop_verts": get_layer_values(mesh.loops, "vertex_index", loop_count, dtype=np.int32),
+        "texture": get_texture_numbers(mesh, use_tex_num, default_texture),
+        }
+
+    flag_layer = mesh.polygon_layers_int.get("flags")
+    if flag_layer:
+        arrays["flags"] = get_layer_values(flag_layer.data, "value", poly_count, dtype=np.int32)
+    else:
+        arrays["flags"] = np.zeros(poly_count, dtype=np.int32)
+
+    uv_layer = mesh.uv_layers.active
+    vc_layer = mesh.vertex_colors.get("color")
+    va_layer = mesh.vertex_colors.get("alpha")
+    if uv_layer:
+        arrays["loop_uvs"] = get_layer_values(uv_layer.data, "uv", loop_count, 2)
+    if vc_layer:
+        arrays["loop_colors"] = get_layer_values(vc_layer.data, "color", loop_count, 3)
+    if va_layer:
+        # the alpha is stored as the color's value
+        arrays["loop_alpha"] = get_layer_values(va_layer.data, "color", loop_count, 3).max(axis=1)
+    return arrays
+
+def get_vertex_arrays(mesh, space_matrix, matrix):
+    """
+    Returns vertex positions transformed by the (column-vector) space
+    matrix and then the (row-vector) export matrix, and the normals.
+    """
+    vertex_count = len(mesh.vertices)
+    coords = get_layer_values(mesh.vertices, "co", vertex_count, 3).astype(np.float64)
+    normals = get_layer_values(mesh.vertices, "normal", vertex_count, 3)
+
+    space = np.array(space_matrix, dtype=np.float64)
+    coords = np.dot(coords, space[:3, :3].T) + space[:3, 3]
+    coords = codec_prm.transform_points(coords, matrix)
+    normals = np.column_stack((normals[:, 0], -normals[:, 2], normals[:, 1]))
+    return coords, normals
+
+def get_scale_matrix(ob):
+    """Same as bmesh.ops.scale with vec=ob.scale in ob.matrix_basis space."""
+    basis = ob.matrix_basis
+    scale = Matrix.Identity(4)
+    for i in range(3):
+        scale[i][i] = ob.scale[i]
+    return basis.inverted() * scale * basis
 
-    # get mesh name
+def save_prm_file(file, ob, matrix):
     mesh = ob.data
 
-    # create bmesh
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-
-    # transform
-    bmesh.ops.scale(bm, vec=ob.scale, space=ob.matrix_basis, verts=bm.verts)
-
-
-    # bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-
-    # write amount of polygons and vertices
-    poly_count = len(bm.faces)
-    vertex_count = len(bm.verts)
-    file.write(struct.pack("<HH", poly_count, vertex_count))
-
-    # get layers
-    uv_layer = bm.loops.layers.uv.active
-    vc_layer = bm.loops.layers.color.get("color")
-    va_layer = bm.loops.layers.color.get("alpha")
-    flag_layer = bm.faces.layers.int.get("flags") or bm.faces.layers.int.new("flags")
-    texture_layer = bm.faces.layers.int.get("texture") or bm.faces.layers.int.new("texture")
-    texturefile_layer = bm.faces.layers.tex.active or bm.faces.layers.tex.new("uv")
-
-
-    # go through all polygons
-    for face in bm.faces:
-        # get flags
-        # figure out whether the face is quad
-        is_quad = len(face.verts) > 3
-
-        # set the quad-flag if the poly is quadratic
-        if is_quad:
-            face[flag_layer] |= const.FACE_QUAD
-
-        # write the flags
-        flags = face[flag_layer] if flag_layer else 0
-        file.write(struct.pack("<H", flags))
-
-        # write the texture
-        if face[texturefile_layer].image and not ob.revolt.use_tex_num:
-            texnum = helpers.texture_to_int(face[texturefile_layer].image.name)
-        elif texture_layer:
-            texnum = face[texture_layer]
-        else:
-            texnum = -1
-
-        file.write(struct.pack("<h", texnum))
-
-        # get vertex order
-        vert_order = [2, 1, 0, 3] if not is_quad else [3, 2, 1, 0]
-
-        # write indices
-        for i in vert_order:
-            if i < len(face.verts):
-                file.write(struct.pack("<H", face.verts[i].index))
-            else:
-                file.write(struct.pack("<H", 0))
-
-        # write the vertex colors
-        for i in vert_order:
-            if i < len(face.verts):
-                # get color from the channel or fall back to a default valueCA
-                color = face.loops[i][vc_layer] if vc_layer else Color((1, 1, 1))
-                alpha = face.loops[i][va_layer] if va_layer else Color((1, 1, 1))
-                file.write(struct.pack("<BBBB", int(color.b * 255), int(color.g * 255), int(color.r * 255), int((alpha.v) * 255)))
-            else:
-                file.write(struct.pack("<BBBB", 1, 1, 1, 1)) # write opaque white as default
-
-        # write the uv
-        for i in vert_order:
-            if i < len(face.verts) and uv_layer:
-                uv = face.loops[i][uv_layer].uv
-                file.write(struct.pack("<ff", uv[0], 1 - uv[1]))
-            else:
-                file.write(struct.pack("<ff", 0, 0))
-
-    # export vertex positions and normals
-    for vertex in bm.verts:
-        coord = Vector((vertex.co[0], vertex.co[1], vertex.co[2])) * matrix
-        normal = Vector((vertex.normal[0], -vertex.normal[2], vertex.normal[1]))
-        file.write(struct.pack("<fff", *coord))
-        file.write(struct.pack("<fff", *normal))
-
-    # free the bmesh
-    bm.free()
+    with timing.phase("mesh arrays"):
+        polys_in = get_poly_arrays(mesh, ob.revolt.use_tex_num)
+    with timing.phase("transform"):
+        coords, normals = get_vertex_arrays(mesh, get_scale_matrix(ob), matrix)
+
+    # assemble the whole file in one buffer
+    with timing.phase("encode"):
+        buf, polys, verts = codec_prm.allocate_prm(len(mesh.polygons), len(mesh.vertices))
+        codec_prm.encode_polys(polys, **polys_in)
+        verts["position"] = coords
+        verts["normal"] = normals
+
+    with timing.phase("write"):
+        file.write(buf)
+    timing.count("faces", len(polys))
+    timing.count("vertices", len(verts))
+    timing.count("bytes", len(buf))
 
 
 
@@ -118,19 +130,14 @@ def save_prm_file(file, ob, matrix):
 ######################################################
 def save_prm(filepath, context, matrix):
 
-    time1 = time.clock()
-
     ob = bpy.context.active_object
-    print("exporting PRM: {} as {}...".format(str(ob), filepath))
+    log.info("exporting PRM: %s as %s...", ob.name, filepath)
 
     # write the actual data
     file = open(filepath, 'wb')
     save_prm_file(file, ob, matrix)
     file.close()
 
-    # prm export complete
-    print(" done in %.4f sec." % (time.clock() - time1))
-
 
 def save(operator, filepath, context, matrix):
 
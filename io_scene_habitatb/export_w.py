@@ -8,173 +8,152 @@
 # ##### END LICENSE BLOCK #####
 
 
-import time, struct, math
+import struct, math
 import os.path as path
 
 import bpy, bmesh, mathutils
+import numpy as np
 from mathutils import Color, Vector, Matrix
-from . import helpers, const
+from . import helpers, const, codec_prm, codec_w, export_prm, timing, export_index
+from .timing import log
 
 
 ######################################################
 # EXPORT MAIN FILES
 ######################################################
 
-def save_w_file(file, matrix):
+def get_export_matrix(ob):
+    """
+    Same transform as the former bmesh scale, translate and rotate ops,
+    which comes down to the world matrix for objects without a parent.
+    """
+    world = ob.matrix_world
+    rotation = Matrix.Translation(ob.location) * ob.rotation_euler.to_matrix().to_4x4()
+    return world.inverted() * rotation * world * export_prm.get_scale_matrix(ob)
+
+def split_by_cube(arrays, coords, normals, cubes):
+    """
+    Splits the polygon and vertex arrays of a mesh by the cube number of
+    each face. Yields the arrays of every cube with only the vertices it
+    uses, in the order of the cube numbers.
+    """
+    for number in np.unique(cubes).tolist():
+        polys = (cubes == number).nonzero()[0]
+        loop_total = arrays["loop_total"][polys]
+        loop_start = np.cumsum(loop_total) - loop_total
+        loops = np.repeat(arrays["loop_start"][polys] - loop_start, loop_total) + np.arange(loop_total.sum())
+        used, loop_verts = np.unique(arrays["loop_verts"][loops], return_inverse=True)
+
+        part = {
+            "loop_start": loop_start,
+            "loop_total": loop_total,
+            "loop_verts": loop_verts,
+            "flags": arrays["flags"][polys],
+            "texture": arrays["texture"][polys],
+            }
+        for key in ("loop_uvs", "loop_colors", "loop_alpha"):
+            if key in arrays:
+                part[key] = arrays[key][loops]
+        yield part, coords[used], normals[used]
+
+def write_cube(file, center, polys_in, coords, normals):
+    """Encodes and writes one cube, returns its bbox (mins, maxs)."""
+    with timing.phase("transform"):
+        r, mins, maxs = codec_w.cube_bounds(coords, center)
+    with timing.phase("encode"):
+        buf, polys, verts = codec_w.allocate_cube(center, r, mins, maxs, len(polys_in["loop_total"]), len(coords))
+        codec_prm.encode_polys(polys, **polys_in)
+        verts["position"] = coords
+        verts["normal"] = normals
+    with timing.phase("write"):
+        file.write(buf)
+    timing.count("faces", len(polys))
+    timing.count("vertices", len(verts))
+    timing.count("bytes", len(buf))
+    return mins, maxs
+
+def save_w_file(file, matrix, split_cubes=True):
+    """
+    Writes every world object as a cube. With split_cubes, objects with a
+    "cube" face layer (merged imports) are written as one cube per number.
+    """
     scn = bpy.context.scene
 
-    export_objs = []
-    for obj in scn.objects:
-        if obj.revolt.rv_type == "WORLD" or obj.revolt.export_as_w == True:
-            export_objs.append(obj)
+    export_objs = export_index.get_export_objects(scn, "WORLD")
 
-    # write the amount of meshes
-    file.write(struct.pack("<l", len(export_objs)))
-
-    # big mesh for writing the big ball
-    big_mesh = bmesh.new()
+    # the amount of cubes is written once it's known
+    count_offset = file.tell()
+    file.write(struct.pack("<l", 0))
 
     if not export_objs:
         return
 
+    # cubes are written one at a time, only their bounds are kept for the big ball
+    cube_mins = []
+    cube_maxs = []
+    cube_count = 0
+
     for ob in export_objs:
         # get mesh name
         mesh = ob.data
 
-        # create bmesh
-        bm = bmesh.new()
-        bm.from_mesh(mesh)
-        tempmesh = bpy.data.meshes.new("temp") # create a temporary mesh
-
-        # apply location, rotation and scale to object
-        bmesh.ops.scale(bm, vec=ob.scale, space=ob.matrix_basis, verts=bm.verts)
-        bmesh.ops.transform(bm, matrix=Matrix.Translation(ob.location), space=ob.matrix_world, verts=bm.verts)
-        bmesh.ops.rotate(bm, cent=ob.location, matrix=ob.rotation_euler.to_matrix(), space=ob.matrix_world, verts=bm.verts)
-
-        # add to big mesh
-        bm.to_mesh(tempmesh) # save temp bmesh into mesh
-        big_mesh.from_mesh(tempmesh)
-
-        c = Vector(ob.location) * matrix
-        r = max([helpers.get_distance(Vector(v.co) * matrix, c) for v in bm.verts])
-        file.write(struct.pack("ffff", c[0], c[1], c[2], r))
-
-        # write bounding box
-        mins = Vector([min([v.co.x for v in bm.verts]), min([v.co.y for v in bm.verts]), min([v.co.z for v in bm.verts])]) * matrix
-        maxs = Vector([max([v.co.x for v in bm.verts]), max([v.co.y for v in bm.verts]), max([v.co.z for v in bm.verts])]) * matrix
-        file.write(struct.pack("<6f", mins[0], maxs[0], mins[1], maxs[1], mins[2], maxs[2]))
-
-        # write amount of polygons and vertices
-        poly_count = len(bm.faces)
-        vertex_count = len(bm.verts)
-        file.write(struct.pack("<hh", poly_count, vertex_count))
-
-        # get layers
-        uv_layer = bm.loops.layers.uv.active
-        vc_layer = bm.loops.layers.color.get("color")
-        va_layer = bm.loops.layers.color.get("alpha")
-        flag_layer = bm.faces.layers.int.get("flags") or bm.faces.layers.int.new("flags")
-        texture_layer = bm.faces.layers.int.get("texture")
-        texturefile_layer = bm.faces.layers.tex.active or bm.faces.layers.tex.new("texfile")
-
-
-        # go through all polygons
-        for face in bm.faces:
-            # get flags
-            # figure out whether the face is quad
-            is_quad = len(face.verts) > 3
-
-            # set the quad-flag if the poly is quadratic
-            if is_quad:
-                face[flag_layer] |= const.FACE_QUAD
-
-            # write the flags
-            flags = face[flag_layer] if flag_layer else 0
-            file.write(struct.pack("<H", flags))
-
-            # write the texture
-            if face[texturefile_layer].image:
-                texnum = helpers.texture_to_int(face[texturefile_layer].image.name)
-            elif texture_layer:
-                texnum = face[texture_layer]
+        # transform all vertices in one go
+        with timing.phase("transform"):
+            coords, normals = export_prm.get_vertex_arrays(mesh, get_export_matrix(ob), matrix)
+
+        with timing.phase("mesh arrays"):
+            polys_in = export_prm.get_poly_arrays(mesh, False, -1)
+            cube_layer = mesh.polygon_layers_int.get("cube") if split_cubes else None
+            if cube_layer:
+                cubes = export_prm.get_layer_values(cube_layer.data, "value", len(mesh.polygons), dtype=np.int32)
+                parts = list(split_by_cube(polys_in, coords, normals, cubes))
             else:
-                texnum = -1
-
-            file.write(struct.pack("<h", texnum))
-
-            # get vertex order
-            vert_order = [2, 1, 0, 3] if not is_quad else [3, 2, 1, 0]
-
-            # write indices
-            for i in vert_order:
-                if i < len(face.verts):
-                    file.write(struct.pack("<H", face.verts[i].index))
-                else:
-                    file.write(struct.pack("<H", 0))
-
-            # write the vertex colors
-            for i in vert_order:
-                if i < len(face.verts):
-                    # get color from the channel or fall back to a default valueCA
-                    color = face.loops[i][vc_layer] if vc_layer else Color((1, 1, 1))
-                    alpha = face.loops[i][va_layer] if va_layer else Color((1, 1, 1))
-                    file.write(struct.pack("<BBBB", int(color.b * 255), int(color.g * 255), int(color.r * 255), int((alpha.v) * 255)))
-                else:
-                    file.write(struct.pack("<BBBB", 1, 1, 1, 1)) # write opaque white as default
-
-            # write the uv
-            for i in vert_order:
-                if i < len(face.verts) and uv_layer:
-                    uv = face.loops[i][uv_layer].uv
-                    file.write(struct.pack("<ff", uv[0], 1 - uv[1]))
-                else:
-                    file.write(struct.pack("<ff", 0, 0))
-
-        # export vertex positions and normals
-        for vertex in bm.verts:
-            coord = Vector((vertex.co[0], vertex.co[1], vertex.co[2])) * matrix
-            normal = Vector((vertex.normal[0], -vertex.normal[2], vertex.normal[1]))
-            file.write(struct.pack("<fff", *coord))
-            file.write(struct.pack("<fff", *normal))
-
-        # free the bmesh
-        bm.free()
+                parts = [(polys_in, coords, normals)]
+
+        for part_polys, part_coords, part_normals in parts:
+            if cube_layer:
+                center = (part_coords.min(axis=0) + part_coords.max(axis=0)) / 2
+            else:
+                center = codec_prm.transform_points(ob.location[:], matrix)
+            mins, maxs = write_cube(file, center, part_polys, part_coords, part_normals)
+            if len(part_coords):
+                cube_mins.append(mins)
+                cube_maxs.append(maxs)
+            cube_count += 1
+    timing.count("cubes", cube_count)
+
+    end_offset = file.tell()
+    file.seek(count_offset)
+    file.write(struct.pack("<l", cube_count))
+    file.seek(end_offset)
 
     # write a bounding box surrounding the whole level
-    mins = Vector([min([v.co.x for v in big_mesh.verts]), min([v.co.y for v in big_mesh.verts]), min([v.co.z for v in big_mesh.verts])]) * matrix
-    maxs = Vector([max([v.co.x for v in big_mesh.verts]), max([v.co.y for v in big_mesh.verts]), max([v.co.z for v in big_mesh.verts])]) * matrix
-    file.write(struct.pack("<lffff", 1, (mins.x + maxs.x) / 2, (mins.y + maxs.y) / 2, (mins.z + maxs.z) / 2, helpers.get_distance(mins, maxs) / 2))
-    file.write(struct.pack("<l", len(export_objs)))
-    for i in range(len(export_objs)):
+    center, radius = codec_w.level_ball(cube_mins, cube_maxs)
+    file.write(struct.pack("<lffff", 1, center[0], center[1], center[2], radius))
+    file.write(struct.pack("<l", cube_count))
+    for i in range(cube_count):
         file.write(struct.pack("<l", i))
 
     # no texture animations today
     file.write(struct.pack("<l", 0))
 
-    big_mesh.free()
-
 
 ######################################################
 # EXPORT
 ######################################################
-def save_w(filepath, context, matrix):
+def save_w(filepath, context, matrix, split_cubes=True):
 
-    time1 = time.clock()
-
-    # print("exporting W: {} as {}...".format(str(ob), filepath))
+    log.info("exporting W: %s...", filepath)
 
     # write the actual data
     file = open(filepath, 'wb')
-    save_w_file(file, matrix)
+    save_w_file(file, matrix, split_cubes)
     file.close()
 
-    # prm export complete
-    print(" done in %.4f sec." % (time.clock() - time1))
-
 
-def save(operator, filepath, context, matrix):
+def save(operator, filepath, context, matrix, report_memory=False, split_cubes=True):
 
-    # save PRM file
-    save_w(filepath, context, matrix)
+    # save W file
+    helpers.run_measured(operator, report_memory, save_w, filepath, context, matrix, split_cubes)
 
     return {'FINISHED'}
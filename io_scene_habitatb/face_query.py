@@ -0,0 +1,227 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free face queries over flags, texture numbers and NCP materials. An
+expression is compiled once and evaluated on whole arrays:
+
+    query = face_query.compile_query("translucent and not double")
+    mask = query({"flags": flags, "texture": texture, "material": material})
+
+Flags are written by name (double, translucent, mirror, additive, texanim,
+noenv, env, cloth, skip, quad), texture and material are compared with
+==, !=, <, <=, >, >= or tested with in {...}. Materials can be given by
+number or by name (ICE1, MATERIAL_ICE1). Terms are combined with and, or,
+not and parentheses, &&, || and ! work as well:
+
+    texture in {3, 4} and env
+    material == ICE1 or material == ICE2
+    !(flags & 0x2) && texture >= 0
+"""
+
+import re
+import numpy as np
+
+from . import const
+
+FLAG_NAMES = {
+    "quad": const.FACE_QUAD,
+    "double": const.FACE_DOUBLE,
+    "doublesided": const.FACE_DOUBLE,
+    "double-sided": const.FACE_DOUBLE,
+    "translucent": const.FACE_TRANSLUCENT,
+    "mirror": const.FACE_MIRROR,
+    "additive": const.FACE_TRANSL_TYPE,
+    "texanim": const.FACE_TEXANIM,
+    "texture-animation": const.FACE_TEXANIM,
+    "noenv": const.FACE_NOENV,
+    "no-envmap": const.FACE_NOENV,
+    "env": const.FACE_ENV,
+    "envmap": const.FACE_ENV,
+    "cloth": const.FACE_CLOTH,
+    "skip": const.FACE_SKIP,
+    "no-export": const.FACE_SKIP,
+    }
+
+# material_ice1 and ice1 both work
+MATERIAL_NAMES = {item[0].lower(): item[4] for item in const.materials}
+MATERIAL_NAMES.update({item[0][len("MATERIAL_"):].lower(): item[4] for item in const.materials})
+
+FIELDS = ("flags", "texture", "material")
+
+COMPARISONS = {
+    "==": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    }
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<number>-?(?:0x[0-9a-f]+|\d+)) |
+        (?P<operator>==|!=|<=|>=|&&|\|\||[<>!&(){},=]) |
+        (?P<name>[a-z_][a-z0-9_\-]*)
+    )""", re.VERBOSE | re.IGNORECASE)
+
+
+######################################################
+# PARSER
+######################################################
+def tokenize(expression):
+    """Returns a list of (kind, text, position), kind is number, operator or name."""
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError("Unexpected character at {}: {}".format(position + 1, expression[position:].strip()[:10]))
+        kind = match.lastgroup
+        text = match.group(kind)
+        tokens.append((kind, text.lower() if kind == "name" else text, match.start(kind)))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """Recursive descent parser turning tokens into a function of the face arrays."""
+
+    def __init__(self, expression):
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError("Unexpected end of the expression")
+        self.position += 1
+        return token
+
+    def accept(self, *texts):
+        kind, text, position = self.peek()
+        if kind in ("operator", "name") and text in texts:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, text):
+        if not self.accept(text):
+            kind, found, position = self.peek()
+            raise ValueError("Expected '{}' {}".format(text, "at {}, got '{}'".format(position + 1, found) if kind else "at the end"))
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("The expression is empty")
+        function = self.parse_or()
+        kind, text, position = self.peek()
+        if kind is not None:
+            raise ValueError("Unexpected '{}' at {}".format(text, position + 1))
+        return function
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.accept("or", "||"):
+            terms.append(self.parse_and())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda arrays: np.logical_or.reduce([term(arrays) for term in terms])
+
+    def parse_and(self):
+        terms = [self.parse_not()]
+        while self.accept("and", "&&"):
+            terms.append(self.parse_not())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda arrays: np.logical_and.reduce([term(arrays) for term in terms])
+
+    def parse_not(self):
+        if self.accept("not", "!"):
+            term = self.parse_not()
+            return lambda arrays: ~term(arrays)
+        return self.parse_term()
+
+    def parse_term(self):
+        if self.accept("("):
+            term = self.parse_or()
+            self.expect(")")
+            return term
+
+        kind, text, position = self.next()
+        if kind != "name":
+            raise ValueError("Expected a flag or field name at {}, got '{}'".format(position + 1, text))
+        if text in FLAG_NAMES:
+            mask = FLAG_NAMES[text]
+            return lambda arrays: (arrays["flags"] & mask) != 0
+        if text not in FIELDS:
+            raise ValueError("Unknown flag or field '{}' at {}".format(text, position + 1))
+        return self.parse_comparison(text)
+
+    def parse_comparison(self, field):
+        if field == "flags" and self.accept("&"):
+            mask = self.parse_value(field)
+            return lambda arrays: (arrays["flags"] & mask) != 0
+
+        negate = self.accept("not")
+        if self.accept("in"):
+            self.expect("{")
+            values = [self.parse_value(field)]
+            while self.accept(","):
+                values.append(self.parse_value(field))
+            self.expect("}")
+            values = np.array(values)
+            if negate:
+                return lambda arrays: ~(arrays[field][:, None] == values).any(axis=1)
+            return lambda arrays: (arrays[field][:, None] == values).any(axis=1)
+        if negate:
+            raise ValueError("Expected 'in' after '{} not'".format(field))
+
+        kind, text, position = self.next()
+        if text == "=":
+            text = "=="
+        if kind != "operator" or text not in COMPARISONS:
+            raise ValueError("Expected a comparison after '{}' at {}, got '{}'".format(field, position + 1, text))
+        compare = COMPARISONS[text]
+        value = self.parse_value(field)
+        return lambda arrays: compare(arrays[field], value)
+
+    def parse_value(self, field):
+        kind, text, position = self.next()
+        if kind == "number":
+            return int(text, 16) if "x" in text.lower() else int(text)
+        if kind == "name" and field == "material" and text in MATERIAL_NAMES:
+            return MATERIAL_NAMES[text]
+        if kind == "name" and field == "flags" and text in FLAG_NAMES:
+            return FLAG_NAMES[text]
+        raise ValueError("Expected a {} value at {}, got '{}'".format(field, position + 1, text))
+
+
+def compile_query(expression):
+    """
+    Returns a function taking a dict with flags, texture and material arrays
+    and returning the mask of the matching faces. Raises ValueError with a
+    readable message for invalid expressions.
+    """
+    return Parser(expression).parse()
+
+def select(selection, mask, mode):
+    """Combines the current selection with mask, mode is REPLACE, EXTEND, SUBTRACT or TOGGLE."""
+    if mode == 'REPLACE':
+        return mask.copy()
+    if mode == 'EXTEND':
+        return selection | mask
+    if mode == 'SUBTRACT':
+        return selection & ~mask
+    if mode == 'TOGGLE':
+        return selection ^ mask
+    raise ValueError("Unknown selection mode: {}".format(mode))
@@ -8,11 +8,17 @@
 # ##### END LICENSE BLOCK #####
 
 
-import mathutils
 import math
+import os
 import struct
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 import bpy
 import bmesh
+import numpy as np
+
+from . import const, timing, mesh_edit, face_query
+from .timing import log
 
 scale = 10.0
 
@@ -31,58 +37,120 @@ def texture_to_int(string):
     else:
         return num
 
-def get_face_material(self):
-    bm = bmesh.from_edit_mesh(bpy.context.object.data)
-    layer = bm.faces.layers.int.get("revolt_material") or bm.faces.layers.int.new("revolt_material")
-    selected_faces = [face for face in bm.faces if face.select]
-    if len(selected_faces) == 0 or any([face[layer] != selected_faces[0][layer] for face in selected_faces]):
-        return -1
+######################################################
+# FACE SELECTION AGGREGATE
+######################################################
+# bumped whenever the edited mesh may have changed
+data_generation = 0
+selection_cache = {"key": None, "aggregate": None}
+
+def invalidate_selection():
+    global data_generation
+    data_generation += 1
+
+@bpy.app.handlers.persistent
+def on_scene_update(scene):
+    ob = scene.objects.active
+    if ob is not None and ob.mode == 'EDIT' and (ob.is_updated_data or ob.data.is_updated):
+        invalidate_selection()
+
+def get_selection_aggregate():
+    """
+    Returns the AND of the flags, the common texture and material (-1
+    where they differ) and the count of each flag of the selected faces
+    from one pass over the faces.
+    The result is kept until the selection or the mesh changes, so all face
+    property getters of a panel redraw share it. The selection is part of
+    the key, so selecting other faces always recomputes it.
+    """
+    me = bpy.context.object.data
+    bm = bmesh.from_edit_mesh(me)
+    selected = [(i, face) for i, face in enumerate(bm.faces) if face.select]
+    key = (me.as_pointer(), id(bm), data_generation, len(bm.faces),
+           hash(tuple(i for i, face in selected)))
+    if selection_cache["key"] == key:
+        return selection_cache["aggregate"]
+
+    # missing layers read as 0 on every face
+    flag_layer = bm.faces.layers.int.get("flags")
+    texture_layer = bm.faces.layers.int.get("texture")
+    material_layer = bm.faces.layers.int.get("revolt_material")
+
+    values = [(face[flag_layer] if flag_layer else 0,
+               face[texture_layer] if texture_layer else 0,
+               face[material_layer] if material_layer else 0) for i, face in selected]
+
+    if not values:
+        aggregate = {"count": 0, "flags": 0, "texture": -1, "material": -1,
+                     "flag_counts": [0] * len(const.FACE_PROPS)}
+    else:
+        values = np.array(values, dtype=np.int64)
+        flags, textures, materials = values.T
+        aggregate = {
+            "count": len(values),
+            "flags": int(np.bitwise_and.reduce(flags)),
+            "texture": int(textures[0]) if (textures == textures[0]).all() else -1,
+            "material": int(materials[0]) if (materials == materials[0]).all() else -1,
+            # number of selected faces each of const.FACE_PROPS is set for
+            "flag_counts": ((flags[:, None] & np.array(const.FACE_PROPS)) != 0).sum(axis=0).tolist(),
+            }
+    selection_cache["key"] = key
+    selection_cache["aggregate"] = aggregate
+    return aggregate
+
+def set_selected_faces(context, name, value, mask=None):
+    """
+    Assigns value to int layer name of the selected faces, or sets or
+    clears the bits of mask with it, returns the number of faces. In edit
+    mode the edit mesh is written through bmesh, so neither the property
+    setters nor the faceprops operators leave edit mode for it.
+    """
+    ob = context.object
+    if ob.mode != 'EDIT':
+        me = ob.data
+        if mask is None:
+            count = mesh_edit.set_face_value(me, name, value)
+        else:
+            count = mesh_edit.set_face_bits(me, mask, value)
+        me.update()
     else:
-        return selected_faces[0][layer]
+        bm = bmesh.from_edit_mesh(ob.data)
+        layer = bm.faces.layers.int.get(name) or bm.faces.layers.int.new(name)
+        count = 0
+        for face in bm.faces:
+            if not face.select:
+                continue
+            if mask is None:
+                face[layer] = value
+            elif value:
+                face[layer] |= mask
+            else:
+                face[layer] &= ~mask
+            count += 1
+        bmesh.update_edit_mesh(ob.data, False, False)
+    invalidate_selection()
+    return count
+
+def get_face_material(self):
+    return get_selection_aggregate()["material"]
 
 def set_face_material(self, value):
-    bm = bmesh.from_edit_mesh(bpy.context.object.data)
-    layer = bm.faces.layers.int.get("revolt_material") or bm.faces.layers.int.new("revolt_material")
-    for face in bm.faces:
-        if face.select:
-            face[layer] = value
+    set_selected_faces(bpy.context, "revolt_material", value)
 
 def get_face_texture(self):
-    bm = bmesh.from_edit_mesh(bpy.context.object.data)
-    layer = bm.faces.layers.int.get("texture") or bm.faces.layers.int.new("texture")
-    selected_faces = [face for face in bm.faces if face.select]
-    if len(selected_faces) == 0 or any([face[layer] != selected_faces[0][layer] for face in selected_faces]):
-        return -1
-    else:
-        return selected_faces[0][layer]
+    return get_selection_aggregate()["texture"]
 
 def set_face_texture(self, value):
-    bm = bmesh.from_edit_mesh(bpy.context.object.data)
-    layer = bm.faces.layers.int.get("texture") or bm.faces.layers.int.new("texture")
-    for face in bm.faces:
-        if face.select:
-            face[layer] = value
+    set_selected_faces(bpy.context, "texture", value)
 
 def get_face_property(self):
-    bm = bmesh.from_edit_mesh(bpy.context.object.data)
-    layer = bm.faces.layers.int.get("flags") or bm.faces.layers.int.new("flags")
-    selected_faces = [face for face in bm.faces if face.select]
-    if len(selected_faces) == 0:
-        return 0
-    output = selected_faces[0][layer]
-    for face in selected_faces:
-        output = output & face[layer]
-    return output
+    return get_selection_aggregate()["flags"]
 
 def is_face_prop(self, face, prop):
     return face["flags"] & prop
 
 def set_face_property(self, value, mask):
-    bm = bmesh.from_edit_mesh(bpy.context.object.data)
-    layer = bm.faces.layers.int.get("flags") or bm.faces.layers.int.new("flags")
-    for face in bm.faces:
-        if face.select:
-            face[layer] = face[layer] | mask if value else face[layer] & ~mask
+    set_selected_faces(bpy.context, "flags", value, mask)
 
 def get_flag_long(self, start):
     return struct.unpack("=l", bytes(self.flags[start:start + 4]))[0]
@@ -91,12 +159,6 @@ def set_flag_long(self, value, start):
     for i,b in enumerate(struct.pack("=l", value), start):
         self.flags[i] = b
 
-def get_intersection(d1, n1, d2, n2, d3, n3):
-    den = n1.dot(n1.cross(n3))
-    if abs(den) < 1e-100:
-        return None # no intersection
-    return (d1 * n1.cross(n3) + d2 * n3.cross(n1) + d3 * n1.cross(n1)) / den
-
 def to_blender_scale(val):
     return val / scale
 
@@ -117,32 +179,84 @@ def to_blender_axis(val):
 #     flagB = float(flags_bytes[1]) / 255.0
 #     return mathutils.Color((flagR, 1.0, flagB))
 
+def run_measured(operator, report_memory, func, *args):
+    """Runs func(*args) and reports its peak Python memory if asked to."""
+    if not report_memory:
+        return func(*args)
+    # tracing may already run for the profiler, it keeps running then
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        return func(*args)
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+        log.info("peak memory %.2f MB", peak / 1048576)
+        operator.report({'INFO'}, "Peak memory: %.2f MB" % (peak / 1048576))
+
+def import_files(operator, filepaths, parse, build):
+    """
+    Parses files in a thread pool and builds their Blender data one after
+    another on the main thread. parse must be bpy-free and only return
+    plain data, build gets that data.
+    """
+    def timed_parse(filepath):
+        with timing.phase("parse"):
+            return parse(filepath)
+
+    workers = max(1, min(len(filepaths), os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(timed_parse, filepath) for filepath in filepaths]
+        for filepath, future in zip(filepaths, futures):
+            log.info("importing: %r...", filepath)
+            try:
+                data = future.result()
+                with timing.phase("mesh build"):
+                    build(data)
+            except Exception as e:
+                log.warning("could not import %s: %s", filepath, e)
+                operator.report({'WARNING'}, "Could not import {}: {}".format(os.path.basename(filepath), e))
+                continue
+            timing.count("files")
+
 def redraw():
     # bpy.ops.wm.redraw_timer(type="DRAW", iterations=1) does not work
     bpy.context.area.tag_redraw()
 
 # BUTTON FUNCTIONS\
 
-def select_faces(context, prop):
-    bm = bmesh.from_edit_mesh(context.object.data)
-    flag_layer = bm.faces.layers.int.get("flags") or bm.faces.layers.int.new("flags")
-
-    for face in bm.faces:
-        if face[flag_layer] & prop:
-            face.select = not face.select
-    redraw()   
-
-def set_vertex_color(context, number):
-    print(context, number)
-    bm = bmesh.from_edit_mesh(context.object.data)        
-    verts = [ v for v in bm.verts if v.select ]
-    if verts:
-        colors = bm.loops.layers.color.get("color")   
-        for v in verts:
-            for loop in v.link_loops:
-                loop[colors] = mathutils.Color((number/100, number/100, number/100))
-                
-        bmesh.update_edit_mesh(context.object.data)
+def select_faces(context, prop, mode='TOGGLE'):
+    """Changes the selection of all faces that have a flag of prop set."""
+    me = context.object.data
+    bm = bmesh.from_edit_mesh(me)
+    arrays, selection = mesh_edit.get_edit_face_arrays(bm)
+    mesh_edit.set_edit_face_selection(bm, face_query.select(selection, (arrays["flags"] & prop) != 0, mode))
+    bmesh.update_edit_mesh(me, False, False)
+    invalidate_selection()
+    redraw()
+
+def select_faces_by_query(context, expression, mode='REPLACE'):
+    """
+    Selects faces by a face_query expression, returns the number of
+    matching faces. Raises ValueError for invalid expressions.
+    """
+    query = face_query.compile_query(expression)
+    me = context.object.data
+    bm = bmesh.from_edit_mesh(me)
+    arrays, selection = mesh_edit.get_edit_face_arrays(bm)
+    mask = query(arrays)
+    mesh_edit.set_edit_face_selection(bm, face_query.select(selection, mask, mode))
+    bmesh.update_edit_mesh(me, False, False)
+    invalidate_selection()
+    return int(mask.sum())
+
+def set_vertex_color(context, number, layer="color"):
+    """Paints the loops of all selected vertices grey, number is in percent."""
+    log.debug("set vertex %s %s", layer, number)
+    with mesh_edit.object_mode(context.object) as me:
+        return mesh_edit.set_loop_color(me, layer, (number / 100,) * 3)
 
 def set_all_w(context):
     for obj in bpy.context.selected_objects:
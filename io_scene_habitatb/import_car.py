@@ -0,0 +1,134 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Imports a whole car from its parameters.txt. Every part of the body, wheel,
+spring, axle, pin, spinner and aerial blocks is placed at its offset.
+Each distinct PRM is only read once, parts using the same file become
+linked duplicates sharing its mesh and the car's texture page.
+"""
+
+import bpy, os
+import numpy as np
+
+from . import helpers, parameters, codec_prm, import_prm
+from .timing import log
+
+# block type -> model number entries, offset entries that add up
+PART_BLOCKS = {
+    "body": (("modelnum",), ("offset",)),
+    "wheel": (("modelnum",), ("offset1", "offset2")),
+    "spring": (("modelnum",), ("offset",)),
+    "axle": (("modelnum",), ("offset",)),
+    "pin": (("modelnum",), ("offset",)),
+    "spinner": (("modelnum",), ("offset",)),
+    "aerial": (("secmodelnum", "topmodelnum"), ("offset",)),
+    }
+
+
+######################################################
+# PARAMETERS
+######################################################
+def to_int(value, default=-1):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def to_vector(value):
+    try:
+        vector = [float(v) for v in value]
+    except (TypeError, ValueError):
+        return np.zeros(3)
+    return np.array(vector[:3] if len(vector) >= 3 else [0.0, 0.0, 0.0])
+
+def get_parts(params):
+    """Returns (name, model number, offset) of every part that has a model."""
+    parts = []
+    for block in sorted(key for key, value in params.items() if isinstance(value, dict)):
+        part_type = block.split(" ")[0]
+        if part_type not in PART_BLOCKS:
+            continue
+        entries = params[block]
+        number_keys, offset_keys = PART_BLOCKS[part_type]
+
+        offset = np.zeros(3)
+        for key in offset_keys:
+            offset += to_vector(entries.get(key))
+
+        for key in number_keys:
+            number = to_int(entries.get(key))
+            if number >= 0:
+                name = block if len(number_keys) == 1 else "{} {}".format(block, key[:-len("modelnum")])
+                parts.append((name, number, offset))
+    return parts
+
+def get_model_paths(params, folder):
+    """Returns {model number: file} for all models found in the car's folder."""
+    paths = {}
+    for key, value in params.items():
+        if not key.startswith("model ") or not isinstance(value, str):
+            continue
+        path = import_prm.find_car_file(folder, value)
+        if path:
+            paths[to_int(key.split(" ")[1])] = path
+        else:
+            log.warning("model not found: %s", value)
+    return paths
+
+
+######################################################
+# IMPORT
+######################################################
+def load(operator, filepath, context, matrix, model_paths=None, tpage_path=None):
+    """
+    model_paths ({model number: file}) and tpage_path come from the car
+    library, without them the files are looked up in the car's folder.
+    """
+    matrix = np.array(matrix)
+    folder = os.path.dirname(os.path.abspath(filepath))
+    params = parameters.read_parameters(filepath)
+    if not isinstance(params, dict):
+        operator.report({'ERROR'}, "Not a valid parameters file: {}".format(filepath))
+        return {'CANCELLED'}
+
+    if model_paths is None:
+        model_paths = get_model_paths(params, folder)
+    parts = [(name, model_paths[number], offset) for name, number, offset in get_parts(params) if number in model_paths]
+
+    # every distinct file is parsed and built once
+    tpage = import_prm.load_tpage(folder, params, tpage_path)
+    meshes = {}
+    def build(data):
+        meshes[data["filepath"]] = import_prm.build_prm_mesh(data, tpage)
+
+    helpers.import_files(operator, sorted(set(path for _, path, _ in parts)),
+                         lambda path: import_prm.parse_prm_file(path, matrix), build)
+
+    scn = context.scene
+    car = bpy.data.objects.new(params.get("name") or os.path.basename(folder), None)
+    scn.objects.link(car)
+
+    # parts sharing a file are linked duplicates
+    locations = codec_prm.transform_points(np.array([offset for _, _, offset in parts]).reshape(-1, 3), matrix)
+    for (name, path, _), location in zip(parts, locations.tolist()):
+        me = meshes.get(path)
+        if me is None:
+            continue
+        ob = bpy.data.objects.new(name, me)
+        ob.location = location
+        ob.parent = car
+        scn.objects.link(ob)
+
+        # set new object type to mesh, the texture comes from the tpage
+        ob.revolt.rv_type = "MESH"
+        ob.revolt.use_tex_num = tpage is not None
+
+    scn.objects.active = car
+    return {'FINISHED'}
@@ -11,23 +11,51 @@ import bpy, bmesh, mathutils
 import os
 from mathutils import Vector, Matrix, Euler
 import time, struct
-from . import helpers
+import numpy as np
+from . import helpers, codec_prm, codec_ncp, mesh_build, timing
 from .helpers import *
 if 'bpy' in locals():
     import imp
     imp.reload(helpers)
 
 
-export_filename = None
+######################################################
+# PARSE (bpy-free, runs in worker threads)
+######################################################
+def parse_ncp_file(filepath, matrix):
+
+    # Returns None if the file doesn't exist or if its filesize is 0 byte.
+    if not os.path.isfile(filepath) or os.path.getsize(filepath) == 0:
+        return None
+
+    # Reads all polyhedra and solves their corners in one go.
+    with open(filepath, "rb") as file:
+        data = file.read()
+    polyhedra = codec_ncp.read_ncp(data)
+    corners, valid = codec_ncp.polyhedron_corners(polyhedra)
+    timing.count("bytes", len(data))
+    timing.count("faces", len(polyhedra))
+
+    with timing.phase("transform"):
+        positions = codec_prm.transform_points(corners[valid], matrix)
+
+    return {
+        "filepath": filepath,
+        "positions": positions,
+        "corner_counts": valid.sum(axis=1),
+        "surfaces": polyhedra["surface"].copy(),
+        }
 
 ######################################################
 # IMPORT MAIN FILES
 ######################################################
-def load_ncp_file(file, matrix):
+def load_ncp_file(data):
+    if data is None:
+        return None
+
     scn = bpy.context.scene
 
-    filepath = file.name
-    name = os.path.basename(filepath)
+    name = os.path.basename(data["filepath"])
 
     # add a mesh and link it to the scene
     mesh = bpy.data.meshes.new(name)
@@ -36,54 +64,8 @@ def load_ncp_file(file, matrix):
     scn.objects.link(ob)
     scn.objects.active = ob
 
-    bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-
-    # Returns None if the file doesn't exist or if its filesize is 0 byte.
-    if not os.path.isfile(filepath) or os.path.getsize(filepath) == 0:
-        return None
-        
-    # Creates bmesh, opens file and reads the number of polyhedrons.
-    bm = bmesh.new()
-    file = open(filepath, "rb")
-
-    polyhedron_count = struct.unpack("<h", file.read(2))[0]
-    material_layer = bm.faces.layers.int.new("revolt_material")
-    
-    # Loops through each polyhedron.
-    for i in range(polyhedron_count):
-        type, surface = struct.unpack("<ll", file.read(8))
-
-        # Read some data.
-        plane_data = [struct.unpack("<ffff", file.read(16)) for n in range(5)]
-        bbox = struct.unpack("<ffffff", file.read(24))
-        v = [Vector(plane[0:3]) for plane in plane_data]
-        d = [plane[3] for plane in plane_data]
-        
-        # If first bit in type is 0 it's a tris otherwise it's a quad.
-        plane_count = 3 if type % 2 == 0 else 4
-        
-        # Loops through each plane.
-        vertices = []
-        for n in range(plane_count):
-            a = n + 1
-            b = (n + 1) % plane_count + 1
-            
-            # calculating plane-plane intersection as explained by ali
-            determinant = Matrix([v[0], v[a], v[b]]).determinant()
-            if determinant != 0:
-                pos = determinant**-1 * (-d[0] * v[a].cross(v[b]) + -d[a] * v[b].cross(v[0]) + -d[b] * v[0].cross(v[a]))
-                vert = bm.verts.new(Vector(pos) * matrix)
-                vertices.insert(0, vert)
-        
-        # createa a face if tehre are 3 or more vertices.
-        if len(vertices) >= 3:
-            face = bm.faces.new(vertices)
-            face[material_layer] = surface
-            
-    file.close();
-    bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
-    bm.to_mesh(mesh)
-    bm.free()
+    # every polyhedron with 3 or more corners becomes a face
+    mesh_build.build_ncp_mesh(mesh, data["positions"], data["corner_counts"], data["surfaces"])
 
     # set new object type to ncp
     ob.revolt.rv_type = "NCP"
@@ -94,27 +76,9 @@ def load_ncp_file(file, matrix):
 ######################################################
 # IMPORT
 ######################################################
-def load_ncp(filepath, context, matrix):
-
-    print("importing ncp: %r..." % (filepath))
-
-    time1 = time.clock()
-    file = open(filepath, 'rb')
-
-    # start reading our pkg file
-    load_ncp_file(file, matrix)
-
-    print(" done in %.4f sec." % (time.clock() - time1))
-    file.close()
-
-
-def load(operator, filepath, context, matrix):
+def load(operator, filepaths, context, matrix):
 
-    global export_filename
-    export_filename = filepath
-    
-    load_ncp(filepath,
-             context,
-             matrix)
+    matrix = np.array(matrix)
+    helpers.import_files(operator, filepaths, lambda filepath: parse_ncp_file(filepath, matrix), load_ncp_file)
 
     return {'FINISHED'}
@@ -1,57 +1,3 @@
-"""
-PAN {
-    long    number_nodes
-    long    start_node
-    float   total_dist
-
-    Nodes[number_nodes]
-}
-
-
-Node {
-    Vector  position
-    float   distance
-
-    long[4] previous_node_ids
-    long[4] next_node_ids
-}
-
-"""
-# import struct
-
-# file = open("garden1.pan", "rb")
-
-
-# print("Total Nodes", num_nodes)
-# print("Total distance", total_dist)
-
-# # read all nodes
-# for n in range(num_nodes):
-#   print("NODE", n)
-
-#   # read position
-#   vec = struct.unpack("<3f", file.read(12))
-#   print("   Position", vec)
-
-#   # read distance to finish line
-#   dist = struct.unpack("<f", file.read(4))[0]
-#   print("   Distance", dist)
-
-#   # read previews connections
-#   for x in range(4):
-#       print("   Link:", x)
-#       prv = struct.unpack("<l", file.read(4))[0]
-#       print("      Prev", prv)
-
-#   # read upcoming connections
-#   for x in range(4):
-#       print("   Link:", x)
-#       nxt = struct.unpack("<l", file.read(4))[0]
-#       print("      Next", nxt)
-
-# file.close()
-
-
 # ##### BEGIN LICENSE BLOCK #####
 #
 # This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
@@ -62,77 +8,58 @@ Node {
 # ##### END LICENSE BLOCK #####
 
 
-import bpy, struct, bmesh, re, os, glob
-import time, struct
-from mathutils import Vector, Color
- 
-from . import const, parameters
+import bpy, os
+import numpy as np
 
-export_filename = None
+from . import helpers, codec_prm, codec_pan, mesh_build, timing
+
+######################################################
+# PARSE (bpy-free, runs in worker threads)
+######################################################
+def parse_pos_file(filepath, matrix):
+    with open(filepath, 'rb') as file:
+        data = file.read()
+    start_node, total_dist, nodes = codec_pan.read_pan(data)
+    timing.count("bytes", len(data))
+    timing.count("vertices", len(nodes))
+
+    with timing.phase("transform"):
+        positions = codec_prm.transform_points(nodes["position"], matrix)
+
+    return {
+        "filepath": filepath,
+        "start_node": start_node,
+        "total_dist": total_dist,
+        "positions": positions,
+        "distances": nodes["distance"].copy(),
+        "edges": codec_pan.next_edges(nodes),
+        }
 
 ######################################################
 # IMPORT MAIN FILES
 ######################################################
-def load_pos_file(file, matrix):
+def load_pos_file(data):
     scn = bpy.context.scene
-    # read header
-    num_nodes = struct.unpack("<l", file.read(4))[0]
-    start_node = struct.unpack("<l", file.read(4))[0]
-    total_dist = struct.unpack("<f", file.read(4))[0]
-
-
-
-    for n in range(num_nodes):
-        print("NODE", n)
-
-        # read position
-        vec = Vector(struct.unpack("<3f", file.read(12)))
-        nodeob = bpy.data.objects.new("posnode{}".format(n), None)
-        bpy.context.scene.objects.link(nodeob)
-        nodeob.location = vec*matrix
-        print("   Position", vec)
-
-        # read distance to finish line
-        dist = struct.unpack("<f", file.read(4))[0]
-        print("   Distance", dist)
+    name = bpy.path.basename(data["filepath"])
 
-        # read previews connections
-        for x in range(4):
-            print("   Link:", x)
-            prv = struct.unpack("<l", file.read(4))[0]
-            print("      Prev", prv)
+    # the whole node graph is one mesh: nodes are vertices, next links are edges
+    # from a node to its next node
+    me = bpy.data.meshes.new(name)
+    mesh_build.build_node_mesh(me, data["positions"], data["edges"], data["distances"])
 
-        # read upcoming connections
-        for x in range(4):
-            print("   Link:", x)
-            nxt = struct.unpack("<l", file.read(4))[0]
-            print("      Next", nxt)
-    
+    ob = bpy.data.objects.new(name, me)
+    ob["start_node"] = data["start_node"]
+    ob["total_dist"] = data["total_dist"]
+    scn.objects.link(ob)
+    scn.objects.active = ob
 
-      
 
 ######################################################
 # IMPORT
 ######################################################
-def load_pos(filepath, context, matrix):
-
-    print("importing pos: %r..." % (filepath))
-
-    time1 = time.clock()
-    file = open(filepath, 'rb')
-
-    # start reading the pos file
-    load_pos_file(file, matrix)
-
-    print(" done in %.4f sec." % (time.clock() - time1))
-    file.close()
-
-
 def load(operator, filepath, context, matrix):
 
-    global export_filename
-    export_filename = filepath
-
-    load_pos(filepath, context, matrix)
+    matrix = np.array(matrix)
+    helpers.import_files(operator, [filepath], lambda filepath: parse_pos_file(filepath, matrix), load_pos_file)
 
     return {'FINISHED'}
@@ -10,142 +10,63 @@
 
 import bpy, struct, bmesh, re, os, glob
 import time, struct
+import numpy as np
 from mathutils import Vector, Color
  
-from . import const, parameters
+from . import const, helpers, parameters, codec_prm, textures, mesh_build, timing
+from .timing import log
 
-export_filename = None
+######################################################
+# PARSE (bpy-free, runs in worker threads)
+######################################################
+def parse_prm_file(filepath, matrix):
+    with open(filepath, 'rb') as file:
+        data = file.read()
+    polys, verts = codec_prm.read_prm(data)
+    timing.count("bytes", len(data))
+    timing.count("faces", len(polys))
+    timing.count("vertices", len(verts))
+
+    with timing.phase("transform"):
+        positions = codec_prm.transform_points(verts["position"], matrix)
+
+    return {
+        "filepath": filepath,
+        "positions": positions,
+        "faces": codec_prm.decode_polys(polys, len(verts)),
+        }
 
 ######################################################
 # IMPORT MAIN FILES
 ######################################################
-def load_prm_file(file, matrix, texfile):
-    path = file.name.split(os.sep)
-    scn = bpy.context.scene
-    
+def build_prm_mesh(data, texfile):
+    """Builds the mesh of a parsed PRM file, all faces use texfile if given."""
+    folder = os.path.dirname(os.path.abspath(data["filepath"]))
+
     # get mesh name
-    mesh_name = bpy.path.basename(export_filename)
+    me = bpy.data.meshes.new(bpy.path.basename(data["filepath"]))
+
+    # look up each texture page once, the pages are cached for the whole session
+    faces = data["faces"]
+    used_textures = faces["texture"][faces["valid"]].tolist()
+    if texfile:
+        images = {texture: texfile for texture in set(used_textures)}
+    else:
+        images = textures.get_images(folder, used_textures)
+
+    # the file has been decoded in one go already, the mesh is built from the arrays
+    mesh_build.build_mesh(me, data["positions"], faces, images)
+    return me
+
+def load_prm_file(data, texfile):
+    scn = bpy.context.scene
     
     # add a mesh and link it to the scene
-    me = bpy.data.meshes.new(mesh_name)
-    ob = bpy.data.objects.new(mesh_name, me)
-
-    # create bmesh
-    bm = bmesh.new()
-    bm.from_mesh(me)
-
-    # create layers and set names
-    uv_layer = bm.loops.layers.uv.new("uv")    
-    vc_layer = bm.loops.layers.color.new("color")
-    va_layer = bm.loops.layers.color.new("alpha")
-    flag_layer = bm.faces.layers.int.new("flags")
-    texture_layer = bm.faces.layers.int.new("texture")
-    texturefile_layer = bm.faces.layers.tex.active or bm.faces.layers.tex.new("uv")
-    
+    me = build_prm_mesh(data, texfile)
+    ob = bpy.data.objects.new(me.name, me)
+
     scn.objects.link(ob)
     scn.objects.active = ob
-    
-    bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-    
-    # read prm header
-    poly_count, vertex_count = struct.unpack('<HH', file.read(4))
-    poly_offset = file.tell()
-    
-    # skip polys real quick
-    file.seek(60 * poly_count, 1)
-    
-    # read vertices
-    print("reading verts at " + str(file.tell()))
-    for vert in range(vertex_count):
-        location = struct.unpack('fff', file.read(12))
-        normal = struct.unpack('fff', file.read(12))
-
-        # create vertices multiplied by rv matrix
-        bm.verts.new(Vector((location[0], location[1], location[2])) * matrix)
-    
-    # ensure lookup table before continuing
-    bm.verts.ensure_lookup_table()
-    
-    # read faces
-    file.seek(poly_offset, 0)
-    for poly in range(poly_count):
-        flags, texture = struct.unpack('<Hh', file.read(4))
-        indices = struct.unpack('<HHHH', file.read(8))
-
-        # read colors and uvs
-        colors = struct.unpack('<BBBBBBBBBBBBBBBB', file.read(16))
-        uvs = struct.unpack('ffffffff', file.read(32))
-
-        # check if we have a quad
-        is_quad = (flags & const.FACE_QUAD)
-        num_loops = 4 if is_quad else 3
-
-        # is this quad actually a triangle?
-        if is_quad and len(set(indices)) == 3:
-            is_quad = False
-
-        # check if it's a valid face
-        if len(set(indices)) < 2:
-            continue
-
-        # faces are reversed also
-        try:
-            face = None
-            if is_quad:
-                face = bm.faces.new((bm.verts[indices[0]], bm.verts[indices[1]], bm.verts[indices[2]], bm.verts[indices[3]]))
-            else:
-                face = bm.faces.new((bm.verts[indices[0]], bm.verts[indices[1]], bm.verts[indices[2]])) 
-              
-            # set layer properties
-            for loop in range(num_loops):
-                # set uvs
-                uv = (uvs[loop * 2], 1 - uvs[loop * 2 + 1])
-                face.loops[loop][uv_layer].uv = uv
-              
-                # set colors
-                color_idx = loop * 4
-                color_b = float(colors[color_idx]) / 255
-                color_g = float(colors[color_idx + 1]) / 255
-                color_r = float(colors[color_idx + 2]) / 255
-                color_a = 1.0 - (float(colors[color_idx + 3]) / 255)
-              
-                # apply colors and alpha to layers
-                face.loops[loop][vc_layer] = Color((color_r, color_g, color_b))
-                face.loops[loop][va_layer] = Color((color_a, color_a, color_a))
-              
-            # setup face
-            face[flag_layer] = flags
-            face[texture_layer] = texture
-            if texfile:
-                face[texturefile_layer].image = texfile
-            else:
-                texture_name = path[-2].lower() + chr(97 + texture) + ".bmp"
-                image = bpy.data.images.get(texture_name)
-                if not image:
-                    texture_path = os.sep.join([*path[:-1], texture_name])
-                    if os.path.exists(texture_path):
-                        image = bpy.data.images.load(texture_path)
-                    else:
-                        print("Texture not found: ", texture_path, "Number", texture)
-                face[texturefile_layer].image = image
-
-
-            face.smooth = True
-            face.normal_flip()
-
-        except ValueError as e:
-            print(e)
-            # set existing face as double-sided
-            #existing_face = bm.faces.get([bm.verts[i] for i in (indices if is_quad else indices[:3])])
-            #existing_face[flag_layer] |= 0x002
-      
-    # calculate normals
-    bm.normal_update()
-    
-    # free resources
-    bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
-    bm.to_mesh(me)
-    bm.free()
 
     # set new object type to mesh
     ob.revolt.rv_type = "MESH"
@@ -160,46 +81,48 @@ def load_prm_file(file, matrix, texfile):
 ######################################################
 # IMPORT
 ######################################################
-def load_prm(filepath, context, matrix, texture):
-
-    print("importing PRM: %r..." % (filepath))
-
-    time1 = time.clock()
-    file = open(filepath, 'rb')
-
-    # start reading the prm file
-    load_prm_file(file, matrix, texture)
-
-    print(" done in %.4f sec." % (time.clock() - time1))
-    file.close()
+def build_prm(data):
+    # cars take their texture from parameters.txt
+    load_prm_file(data, load_texture(data["filepath"]))
 
 # for cars
 def load_texture(filepath):
-    path = filepath.split(os.sep)
-    path = os.sep.join(path[:-1])
+    folder = os.path.dirname(os.path.abspath(filepath))
 
     # check if it's a car
-    parampath = os.sep.join([path, "parameters.txt"])
+    parampath = os.path.join(folder, "parameters.txt")
     if os.path.exists(parampath):
-        params = parameters.read_parameters(parampath)
-        if '/' in params["tpage"]: 
-            img = params["tpage"].split("/")[-1]
-        elif '\\' in params["tpage"]:
-            img = params["tpage"].split("\\")[-1]
-        texture_path = os.sep.join([path, img])
-        image = bpy.data.images.load(texture_path)
-        image.use_fake_user = True
-        return image
+        return load_tpage(folder, parameters.read_parameters(parampath))
     else:
         return None
 
-def load(operator, filepath, context, matrix):
+def find_car_file(folder, game_path):
+    """
+    Finds a file that parameters.txt references by its game path
+    (e.g. cars\\tmgreen\\car.bmp) in the car's folder.
+    """
+    name = re.split(r"[\\/]", game_path)[-1].lower()
+    file_name = textures.get_folder(folder)["files"].get(name)
+    return os.path.join(folder, file_name) if file_name else None
+
+def load_tpage(folder, params, texture_path=None):
+    """
+    Returns the texture page of a car, it is only loaded once per session.
+    texture_path skips looking it up in the car's folder.
+    """
+    tpage = params.get("tpage") if isinstance(params, dict) else None
+    if texture_path is None:
+        texture_path = find_car_file(folder, tpage) if isinstance(tpage, str) else None
+    if not texture_path:
+        log.warning("car texture not found: %s", tpage)
+        return None
+    image = bpy.data.images.load(texture_path, check_existing=True)
+    image.use_fake_user = True
+    return image
 
-    global export_filename
-    export_filename = filepath
-    
-    texture = load_texture(filepath)
+def load(operator, filepaths, context, matrix):
 
-    load_prm(filepath, context, matrix, texture)
+    matrix = np.array(matrix)
+    helpers.import_files(operator, filepaths, lambda filepath: parse_prm_file(filepath, matrix), build_prm)
 
     return {'FINISHED'}
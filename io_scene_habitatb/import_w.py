@@ -11,188 +11,135 @@
 import bpy, struct, bmesh, re, os, glob
 import time, struct
 import mathutils
+import numpy as np
 from mathutils import Vector, Color
-from . import const
+from . import const, helpers, codec_prm, codec_w, textures, mesh_build, timing
+from .timing import log
 
-export_filename = None
+######################################################
+# PARSE (bpy-free, runs in worker threads)
+######################################################
+def parse_w_file(filepath, matrix, cube_start=0, cube_end=-1, region=None, merge=False):
+
+    # index the file and only decode the requested cubes
+    cubes = []
+    with codec_w.WReader(filepath) as reader:
+        selection = reader.select(cube_start, cube_end, region, matrix)
+        log.info("%d of %d cubes", len(selection), len(reader))
+        for cube in selection:
+            polys, verts = reader.cube(cube)
+            timing.count("faces", len(polys))
+            timing.count("vertices", len(verts))
+            with timing.phase("transform"):
+                positions = codec_prm.transform_points(verts["position"], matrix)
+            entry = reader.index[cube]
+            cubes.append({
+                "number": int(cube),
+                "header": [float(v) for v in entry["center"]] + [float(entry["radius"])] + [float(v) for v in entry["bbox"]],
+                "positions": positions,
+                "faces": codec_prm.decode_polys(polys, len(verts)),
+                })
+        timing.count("bytes", reader.end_offset)
+
+    merge = merge and bool(cubes)
+    if merge:
+        with timing.phase("merge"):
+            cubes = [merge_cubes(cubes)]
+    return {"filepath": filepath, "cubes": cubes, "merged": merge}
+
+def merge_cubes(cubes):
+    """
+    Joins decoded cubes (at least one) into one. "cubes" holds the cube number of every
+    face, "headers" the bound ball and bbox of every cube as read from the
+    file: center (3), radius, bbox (6).
+    """
+    vertex_start = np.cumsum([0] + [len(cube["positions"]) for cube in cubes])
+    faces = {}
+    for key in ("flags", "texture", "indices", "loop_count", "valid", "uvs", "colors", "alpha"):
+        parts = [cube["faces"][key] for cube in cubes]
+        if key == "indices":
+            # vertex numbers continue where the previous cube's ended
+            parts = [part + start for part, start in zip(parts, vertex_start)]
+        faces[key] = np.concatenate(parts)
+
+    return {
+        "positions": np.concatenate([cube["positions"] for cube in cubes]),
+        "faces": faces,
+        "cubes": np.concatenate([np.full(len(cube["faces"]["flags"]), cube["number"], dtype=np.int32) for cube in cubes]),
+        "numbers": [cube["number"] for cube in cubes],
+        "headers": [cube["header"] for cube in cubes],
+        }
 
 ######################################################
 # IMPORT MAIN FILES
 ######################################################
-def load_w_file(file, matrix):
-    path = file.name.split(os.sep)
+def load_w_file(data):
+    folder = os.path.dirname(os.path.abspath(data["filepath"]))
 
     scn = bpy.context.scene
 
-    mesh_count = struct.unpack('<l', file.read(4))[0]
+    if data["merged"]:
+        load_merged_w(data["cubes"][0], data["filepath"], folder)
+        return
 
-    main_w = bpy.data.objects.new(bpy.path.basename(export_filename), None)
+    main_w = bpy.data.objects.new(bpy.path.basename(data["filepath"]), None)
     bpy.context.scene.objects.link(main_w)
 
-    for mesh in range(mesh_count):
+    for cube in data["cubes"]:
 
         # get mesh name
-        mesh_name = bpy.path.basename(export_filename)
+        mesh_name = bpy.path.basename(data["filepath"])
         
         # add a mesh and link it to the scene
         me = bpy.data.meshes.new(mesh_name)
         ob = bpy.data.objects.new(mesh_name, me)
         ob.parent = main_w
 
-        # create bmesh
-        bm = bmesh.new()
-        bm.from_mesh(me)
-
         # link object to scene
         scn.objects.link(ob)
         scn.objects.active = ob
 
-        # bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-
-        # create layers and set names
-        uv_layer = bm.loops.layers.uv.new("uv")    
-        vc_layer = bm.loops.layers.color.new("color")
-        va_layer = bm.loops.layers.color.new("alpha")
-        flag_layer = bm.faces.layers.int.new("flags")
-        texture_layer =  bm.faces.layers.int.new("texture")
-        texturefile_layer = bm.faces.layers.tex.new("uv")
-
-        # read bound ball
-        bound_ball_center = struct.unpack("<3f", file.read(12))
-        bound_ball_radius = struct.unpack("<f", file.read(4))[0]
-
-        # read bbox
-        xlo, xhi = struct.unpack("<ff", file.read(8))
-        ylo, yhi = struct.unpack("<ff", file.read(8))
-        zlo, zhi = struct.unpack("<ff", file.read(8))
-
-        polygon_count = struct.unpack("<h", file.read(2))[0]
-        vertex_count = struct.unpack("<h", file.read(2))[0]
-
-        vertices = []
-
-        # skip polys real quick
-        poly_offset = file.tell()
-        file.seek(60 * polygon_count, 1)
-
-        # read vertices
-        for v in range(vertex_count):
-            
-            location = struct.unpack("<3f", file.read(12))
-            normal = struct.unpack("<3f", file.read(12))
-            vert = bm.verts.new(Vector((location[0], location[1], location[2])) * matrix)
-            vert.normal = Vector((normal[0], normal[1], normal[2]))
-
-        # ensure lookup table before continuing
-        bm.verts.ensure_lookup_table()
-
-        # read polygons
-        end_offset = file.tell()
-        file.seek(poly_offset, 0)
-
-        for p in range(polygon_count):
-            poly_type = struct.unpack("<h", file.read(2))[0]
-            poly_texture = struct.unpack("<h", file.read(2))[0]
-            indices = struct.unpack("<4h", file.read(8))
-            colors = struct.unpack("<16B", file.read(16))
-            uvs = struct.unpack("<8f", file.read(32))
-
-            # check if the poly is quad
-            is_quad = poly_type & const.FACE_QUAD
-            if is_quad and len(set(indices)) == 3:
-                is_quad = False
-            num_loops = 4 if is_quad else 3
-
-
-            # check if it's a valid face
-            # if len(set(indices)) > 2:
-            try:
-                face = None
-                if is_quad:
-                  face = bm.faces.new((bm.verts[indices[0]], bm.verts[indices[1]], bm.verts[indices[2]], bm.verts[indices[3]]))
-                else:
-                  face = bm.faces.new((bm.verts[indices[0]], bm.verts[indices[1]], bm.verts[indices[2]])) 
-                  
-                # set layer properties
-                for loop in range(num_loops):
-                  # set uvs
-                  uv = (uvs[loop * 2], 1 - uvs[loop * 2 + 1])
-                  face.loops[loop][uv_layer].uv = uv
-
-                  # set colors
-                  color_idx = loop * 4
-                  color_b = float(colors[color_idx]) / 255
-                  color_g = float(colors[color_idx + 1]) / 255
-                  color_r = float(colors[color_idx + 2]) / 255
-                  color_a = 1.0 - (float(colors[color_idx + 3]) / 255)
-                  
-                  # apply colors and alpha to layers
-                  face.loops[loop][vc_layer] = Color((color_r, color_g, color_b))
-                  face.loops[loop][va_layer] = Color((color_a, color_a, color_a))
-                  
-                # setup face
-                face[flag_layer] = poly_type
-                face[texture_layer] = poly_texture
-
-                # look for an image if applicable
-                if poly_texture >= 0:
-                    texture_name = path[-2].lower() + chr(97 + poly_texture) + ".bmp"
-                    image = bpy.data.images.get(texture_name)
-                    if not image:
-                        texture_path = os.sep.join([*path[:-1], texture_name])
-                        if os.path.exists(texture_path):
-                            image = bpy.data.images.load(texture_path)
-                            image.use_fake_user = True
-                        else:
-                            print("Texture not found: ", texture_path, "Number", poly_texture)
-                    face[texturefile_layer].image = image
-                
-                face.smooth = True
-                face.normal_flip()
-
-            except ValueError as e:
-                print(e)
-
-
-        # calculate normals
-        bm.normal_update()
-        
-        # free resources
-        bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
-        bm.to_mesh(me)
-        bm.free()
+        # look up each texture page once, the pages are cached for the whole session
+        faces = cube["faces"]
+        images = textures.get_images(folder, faces["texture"][faces["valid"]].tolist(), fake_user=True)
+
+        # the cube has been decoded already, the mesh is built from the arrays
+        mesh_build.build_mesh(me, cube["positions"], faces, images)
 
         # set new object type to mesh
         ob.revolt.rv_type = "WORLD"
 
-        # reset file seek
-        file.seek(end_offset, 0)
-    
+def load_merged_w(cube, filepath, folder):
+    """
+    Builds all cubes as one object. The "cube" face layer keeps the cube
+    of every face so the export can split them again, the mesh's w_cubes
+    and w_cube_headers properties keep the cube numbers and their headers.
+    """
+    scn = bpy.context.scene
+    name = bpy.path.basename(filepath)
+    me = bpy.data.meshes.new(name)
+    ob = bpy.data.objects.new(name, me)
+    scn.objects.link(ob)
+    scn.objects.active = ob
+
+    faces = cube["faces"]
+    images = textures.get_images(folder, faces["texture"][faces["valid"]].tolist(), fake_user=True)
+    loops = mesh_build.build_mesh(me, cube["positions"], faces, images)
+    mesh_build.add_int_layer(me, "cube", cube["cubes"][loops["polys"]])
+
+    me["w_cubes"] = cube["numbers"]
+    me["w_cube_headers"] = [value for header in cube["headers"] for value in header]
+    ob.revolt.rv_type = "WORLD"
 
-      
 
 ######################################################
 # IMPORT
 ######################################################
-def load_w(filepath, context, matrix):
-
-    print("importing w: %r..." % (filepath))
-
-    time1 = time.clock()
-    file = open(filepath, 'rb')
-
-    # start reading our pkg file
-    load_w_file(file, matrix)
-
-    print(" done in %.4f sec." % (time.clock() - time1))
-    file.close()
-
-
-def load(operator, filepath, context, matrix):
+def load(operator, filepaths, context, matrix, cube_start=0, cube_end=-1, region=None, merge=False):
 
-    global export_filename
-    export_filename = filepath
-    
-    load_w(filepath, context, matrix)
+    matrix = np.array(matrix)
+    helpers.import_files(operator, filepaths,
+                         lambda filepath: parse_w_file(filepath, matrix, cube_start, cube_end, region, merge),
+                         load_w_file)
 
     return {'FINISHED'}
@@ -8,7 +8,8 @@
 # ##### END LICENSE BLOCK #####
 
 
-import bpy
+import bpy, os
+from mathutils import Vector
 from bpy_extras.io_utils import ImportHelper, ExportHelper, axis_conversion
 from bpy.props import (
         BoolProperty,
@@ -20,6 +21,23 @@ from bpy.props import (
         IntVectorProperty,
         PointerProperty
         )
+from . import timing, profiling
+
+
+def timed(operator, func, *args):
+    """
+    Runs an import or export in a timer, the JSON log goes next to the file.
+    It's profiled as well when profiling is enabled in the preferences.
+    """
+    log_path = operator.filepath + ".timing.json" if operator.log_timing else None
+    with profiling.capture(operator), timing.Timer(operator, log_path):
+        return func(*args)
+
+def get_filepaths(operator):
+    """Returns all files picked in the file browser, or just filepath."""
+    if operator.files and operator.files[0].name:
+        return [os.path.join(operator.directory, f.name) for f in operator.files]
+    return [operator.filepath]
 
 
 class ImportPRM(bpy.types.Operator, ImportHelper):
@@ -34,17 +52,21 @@ class ImportPRM(bpy.types.Operator, ImportHelper):
             options={'HIDDEN'},
             )
 
+    files = CollectionProperty(type = bpy.types.OperatorFileListElement, options = {'HIDDEN', 'SKIP_SAVE'})
+    directory = StringProperty(subtype = 'DIR_PATH', options = {'HIDDEN', 'SKIP_SAVE'})
+
     scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
     up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
     forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    log_timing = BoolProperty(default = False, name = "Write timing log", description = "Write the time spent in each phase next to the file as JSON")
 
 
     def execute(self, context):
         from . import import_prm
 
-        return import_prm.load(
+        return timed(self, import_prm.load,
             self, 
-            self.properties.filepath, 
+            get_filepaths(self), 
             context, 
             axis_conversion(to_up = self.up_axis, 
                             to_forward = self.forward_axis).to_4x4() * self.scale)
@@ -61,19 +83,40 @@ class ImportW(bpy.types.Operator, ImportHelper):
             options={'HIDDEN'},
             )
 
+    files = CollectionProperty(type = bpy.types.OperatorFileListElement, options = {'HIDDEN', 'SKIP_SAVE'})
+    directory = StringProperty(subtype = 'DIR_PATH', options = {'HIDDEN', 'SKIP_SAVE'})
+
     scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
     up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
     forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    log_timing = BoolProperty(default = False, name = "Write timing log", description = "Write the time spent in each phase next to the file as JSON")
+
+    cube_start = IntProperty(default = 0, min = 0, name = "First cube", description = "Number of the first cube to import")
+    cube_end = IntProperty(default = -1, min = -1, name = "Last cube", description = "Number of the last cube to import, -1 imports up to the last one")
+    use_selection_bounds = BoolProperty(default = False, name = "Only cubes in selection", description = "Only import cubes that intersect the bounding box of the selected objects")
+    merge_cubes = BoolProperty(default = False, name = "Merge cubes", description = "Import all cubes as one object, a face layer keeps their cube so the export can split them again")
 
     def execute(self, context):
         from . import import_w
 
-        return import_w.load(
+        region = None
+        if self.use_selection_bounds:
+            corners = [obj.matrix_world * Vector(corner) for obj in context.selected_objects for corner in obj.bound_box]
+            if not corners:
+                self.report({'WARNING'}, "No selected objects to take the bounds from")
+                return {'CANCELLED'}
+            region = ([min(c[i] for c in corners) for i in range(3)], [max(c[i] for c in corners) for i in range(3)])
+
+        return timed(self, import_w.load,
             self, 
-            self.properties.filepath, 
+            get_filepaths(self), 
             context, 
             axis_conversion(to_up = self.up_axis, 
-                            to_forward = self.forward_axis).to_4x4() * self.scale)
+                            to_forward = self.forward_axis).to_4x4() * self.scale,
+            self.cube_start,
+            self.cube_end,
+            region,
+            self.merge_cubes)
 
 class ImportNCP(bpy.types.Operator, ImportHelper):
     """Import from NCP file format (.ncp)"""
@@ -87,20 +130,108 @@ class ImportNCP(bpy.types.Operator, ImportHelper):
             options={'HIDDEN'},
             )
 
+    files = CollectionProperty(type = bpy.types.OperatorFileListElement, options = {'HIDDEN', 'SKIP_SAVE'})
+    directory = StringProperty(subtype = 'DIR_PATH', options = {'HIDDEN', 'SKIP_SAVE'})
+
     scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
     up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
     forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    log_timing = BoolProperty(default = False, name = "Write timing log", description = "Write the time spent in each phase next to the file as JSON")
     
     def execute(self, context):
         from . import import_ncp
 
-        return import_ncp.load(
+        return timed(self, import_ncp.load,
+            self, 
+            get_filepaths(self), 
+            context, 
+            axis_conversion(to_up = self.up_axis, 
+                            to_forward = self.forward_axis).to_4x4() * self.scale)
+
+class ImportCar(bpy.types.Operator, ImportHelper):
+    """Import a whole car from its parameters file (parameters.txt)"""
+    bl_idname = "import_scene.revolt_car"
+    bl_label = 'Import Car'
+    bl_options = {'UNDO'}
+
+    filename_ext = ".txt"
+    filter_glob = StringProperty(
+            default="parameters.txt", 
+            options={'HIDDEN'},
+            )
+
+    scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
+    up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    log_timing = BoolProperty(default = False, name = "Write timing log", description = "Write the time spent in each phase next to the file as JSON")
+    
+    def execute(self, context):
+        from . import import_car
+
+        return timed(self, import_car.load,
             self, 
             self.properties.filepath, 
             context, 
             axis_conversion(to_up = self.up_axis, 
                             to_forward = self.forward_axis).to_4x4() * self.scale)
 
+# enum items of the indexed cars, blender needs them to stay referenced
+car_items = []
+
+def get_car_items(self, context):
+    return car_items
+
+class ImportCarLibrary(bpy.types.Operator):
+    """Import a car found in the car library of the cars folder set in the addon preferences"""
+    bl_idname = "import_scene.revolt_car_library"
+    bl_label = 'Import Car from Library'
+    bl_options = {'UNDO'}
+    bl_property = "car"
+
+    car = EnumProperty(name = "Car", items = get_car_items)
+    scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
+    up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+
+    def get_index(self, context):
+        """Brings the library of the cars folder up to date and returns it."""
+        from . import car_library
+
+        cars_folder = bpy.path.abspath(context.user_preferences.addons[__package__].preferences.cars_folder)
+        if not os.path.isdir(cars_folder):
+            self.report({'ERROR'}, "Set the cars folder in the addon preferences")
+            return None
+        config_folder = bpy.utils.user_resource('CONFIG', path = "habitatb", create = True)
+        index, _ = car_library.update(cars_folder, car_library.get_index_path(cars_folder, config_folder))
+
+        car_items[:] = [(folder, car_library.get_name(folder, car), folder) for folder, car in car_library.get_cars(index)]
+        return index
+
+    def invoke(self, context, event):
+        if self.get_index(context) is None:
+            return{'CANCELLED'}
+        if not car_items:
+            self.report({'WARNING'}, "No cars with a parameters.txt in the cars folder")
+            return{'CANCELLED'}
+        context.window_manager.invoke_search_popup(self)
+        return{'RUNNING_MODAL'}
+
+    def execute(self, context):
+        from . import car_library, import_car
+
+        index = self.get_index(context)
+        if index is None or self.car not in index["cars"]:
+            return{'CANCELLED'}
+        with profiling.capture(self), timing.Timer(self):
+            return import_car.load(
+                self,
+                car_library.get_parameters_path(index, self.car),
+                context,
+                axis_conversion(to_up = self.up_axis,
+                                to_forward = self.forward_axis).to_4x4() * self.scale,
+                car_library.get_model_paths(index, self.car),
+                car_library.get_tpage_path(index, self.car))
+
 class ImportPOS(bpy.types.Operator, ImportHelper):
     """Import from POS file format (.pan)"""
     bl_idname = "import_scene.pan"
@@ -116,11 +247,12 @@ class ImportPOS(bpy.types.Operator, ImportHelper):
     scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
     up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
     forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    log_timing = BoolProperty(default = False, name = "Write timing log", description = "Write the time spent in each phase next to the file as JSON")
     
     def execute(self, context):
         from . import import_pos
 
-        return import_pos.load(
+        return timed(self, import_pos.load,
             self, 
             self.properties.filepath, 
             context, 
@@ -142,11 +274,12 @@ class ExportPRM(bpy.types.Operator, ExportHelper):
     scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
     up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
     forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    log_timing = BoolProperty(default = False, name = "Write timing log", description = "Write the time spent in each phase next to the file as JSON")
         
     def execute(self, context):
         from . import export_prm
                            
-        return export_prm.save(
+        return timed(self, export_prm.save,
             self, 
             self.properties.filepath, 
             context, 
@@ -167,16 +300,21 @@ class ExportW(bpy.types.Operator, ExportHelper):
     scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
     up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
     forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    log_timing = BoolProperty(default = False, name = "Write timing log", description = "Write the time spent in each phase next to the file as JSON")
+    report_memory = BoolProperty(default = False, name = "Report peak memory", description = "Measure the peak memory used while exporting")
+    split_cubes = BoolProperty(default = True, name = "Split merged cubes", description = "Write objects with a cube face layer (W imports with merged cubes) as one cube per cube number")
         
     def execute(self, context):
         from . import export_w
                            
-        return export_w.save(
+        return timed(self, export_w.save,
             self, 
             self.properties.filepath, 
             context, 
             axis_conversion(from_up = self.up_axis, 
-                            from_forward = self.forward_axis).to_4x4() * (1 / self.scale))
+                            from_forward = self.forward_axis).to_4x4() * (1 / self.scale),
+            self.report_memory,
+            self.split_cubes)
 
 
 class ExportNCP(bpy.types.Operator, ExportHelper):
@@ -193,13 +331,16 @@ class ExportNCP(bpy.types.Operator, ExportHelper):
     scale = FloatProperty(default=0.01, name = "Scale", min = 0.0005, max = 1, step = 0.01)
     up_axis = EnumProperty(default = "-Y", name = "Up axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
     forward_axis = EnumProperty(default = "Z", name = "Forward axis", items = (("X", "X", "X"), ("Y", "Y", "Y"), ("Z", "Z", "Z"), ("-X", "-X", "-X"), ("-Y", "-Y", "-Y"), ("-Z", "-Z", "-Z")))
+    log_timing = BoolProperty(default = False, name = "Write timing log", description = "Write the time spent in each phase next to the file as JSON")
+    report_memory = BoolProperty(default = False, name = "Report peak memory", description = "Measure the peak memory used while exporting")
         
     def execute(self, context):
         from . import export_ncp
         
                                     
-        return export_ncp.save(
+        return timed(self, export_ncp.save,
             self, 
             self.properties.filepath, 
             context, 
-            axis_conversion(from_up = self.up_axis, from_forward = self.forward_axis).to_4x4() * (1 / self.scale))
+            axis_conversion(from_up = self.up_axis, from_forward = self.forward_axis).to_4x4() * (1 / self.scale),
+            self.report_memory)
@@ -0,0 +1,203 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Builds Blender meshes straight from the arrays the codecs decode, without
+bmesh, edit mode or per-loop Python.
+
+build_mesh_bmesh is the former face-by-face construction. It is kept as the
+reference the array path is checked against:
+
+    build_mesh(a, positions, faces, images)
+    build_mesh_bmesh(b, positions, faces, images)
+    print(compare_meshes(a, b))
+"""
+
+import bmesh
+import numpy as np
+from mathutils import Color
+
+from . import codec_prm
+from .timing import log
+
+
+######################################################
+# ARRAY PATH
+######################################################
+def add_geometry(me, positions, loop_verts, loop_start, loop_total):
+    """Fills an empty mesh with vertices and polygons."""
+    me.vertices.add(len(positions))
+    me.vertices.foreach_set("co", np.asarray(positions, dtype=np.float32).ravel())
+
+    me.loops.add(len(loop_verts))
+    me.loops.foreach_set("vertex_index", np.asarray(loop_verts, dtype=np.int32))
+
+    me.polygons.add(len(loop_total))
+    me.polygons.foreach_set("loop_start", np.asarray(loop_start, dtype=np.int32))
+    me.polygons.foreach_set("loop_total", np.asarray(loop_total, dtype=np.int32))
+
+def add_int_layer(me, name, values):
+    layer = me.polygon_layers_int.new(name)
+    layer.data.foreach_set("value", np.asarray(values, dtype=np.int32))
+    return layer
+
+def build_mesh(me, positions, faces, images):
+    """
+    Builds a PRM or W mesh from decoded polygons.
+    images maps texture numbers to the image of their faces. Returns the
+    loops of codec_prm.mesh_loops, "polys" maps mesh faces to polygons.
+    """
+    loops = codec_prm.mesh_loops(faces)
+    poly_count = len(loops["polys"])
+    add_geometry(me, positions, loops["loop_verts"], loops["loop_start"], loops["loop_total"])
+    me.polygons.foreach_set("use_smooth", np.ones(poly_count, dtype=bool))
+
+    # creates the uv loop layer of the same name along with it
+    uv_texture = me.uv_textures.new("uv")
+    me.uv_layers["uv"].data.foreach_set("uv", loops["loop_uvs"].astype(np.float32).ravel())
+
+    me.vertex_colors.new("color").data.foreach_set("color", loops["loop_colors"].astype(np.float32).ravel())
+    alpha = np.repeat(loops["loop_alpha"].astype(np.float32), 3)
+    me.vertex_colors.new("alpha").data.foreach_set("color", alpha)
+
+    add_int_layer(me, "flags", loops["flags"])
+    add_int_layer(me, "texture", loops["texture"])
+
+    # image pointers can't be set in bulk, only textured faces are visited
+    texture_faces = uv_texture.data
+    for texture, image in images.items():
+        if image is None:
+            continue
+        for poly in (loops["texture"] == texture).nonzero()[0].tolist():
+            texture_faces[poly].image = image
+
+    me.update(calc_edges=True)
+    return loops
+
+def build_ncp_mesh(me, positions, corner_counts, surfaces):
+    """
+    Builds an NCP mesh from the corners of all polyhedra. Every corner is
+    its own vertex, polyhedra with less than three corners only leave
+    loose vertices behind.
+    """
+    corner_counts = np.asarray(corner_counts, dtype=np.int64)
+    corner_start = np.cumsum(corner_counts) - corner_counts
+    faces = corner_counts >= 3
+    loop_total = corner_counts[faces]
+    loop_start = np.cumsum(loop_total) - loop_total
+
+    # corners are wound the other way round in blender
+    local = np.arange(loop_total.sum()) - np.repeat(loop_start, loop_total)
+    loop_verts = np.repeat(corner_start[faces] + loop_total - 1, loop_total) - local
+
+    add_geometry(me, positions, loop_verts, loop_start, loop_total)
+    add_int_layer(me, "revolt_material", np.asarray(surfaces)[faces])
+    me.update(calc_edges=True)
+
+def build_node_mesh(me, positions, edges, distances):
+    """Builds a node graph mesh, distances are kept as a vertex layer."""
+    me.vertices.add(len(positions))
+    me.vertices.foreach_set("co", np.asarray(positions, dtype=np.float32).ravel())
+
+    me.edges.add(len(edges))
+    me.edges.foreach_set("vertices", np.asarray(edges, dtype=np.int32).ravel())
+
+    layer = me.vertex_layers_float.new("distance")
+    layer.data.foreach_set("value", np.asarray(distances, dtype=np.float32))
+    me.update()
+
+
+######################################################
+# BMESH REFERENCE
+######################################################
+def build_mesh_bmesh(me, positions, faces, images):
+    """Face by face construction through bmesh, same arguments as build_mesh."""
+    bm = bmesh.new()
+
+    uv_layer = bm.loops.layers.uv.new("uv")
+    vc_layer = bm.loops.layers.color.new("color")
+    va_layer = bm.loops.layers.color.new("alpha")
+    flag_layer = bm.faces.layers.int.new("flags")
+    texture_layer = bm.faces.layers.int.new("texture")
+    texturefile_layer = bm.faces.layers.tex.new("uv")
+
+    bm_verts = [bm.verts.new(co) for co in np.asarray(positions).tolist()]
+
+    indices = faces["indices"].tolist()
+    loop_counts = faces["loop_count"].tolist()
+    uvs = faces["uvs"].tolist()
+    colors = faces["colors"].tolist()
+    alphas = faces["alpha"].tolist()
+    flags = faces["flags"].tolist()
+    face_textures = faces["texture"].tolist()
+
+    for poly in faces["valid"].nonzero()[0].tolist():
+        num_loops = loop_counts[poly]
+        try:
+            face = bm.faces.new([bm_verts[i] for i in indices[poly][:num_loops]])
+        except ValueError as e:
+            log.debug("skipped face %d: %s", poly, e)
+            continue
+
+        for loop in range(num_loops):
+            face.loops[loop][uv_layer].uv = uvs[poly][loop]
+            face.loops[loop][vc_layer] = Color(colors[poly][loop])
+            alpha = alphas[poly][loop]
+            face.loops[loop][va_layer] = Color((alpha, alpha, alpha))
+
+        face[flag_layer] = flags[poly]
+        face[texture_layer] = face_textures[poly]
+        image = images.get(face_textures[poly])
+        if image is not None:
+            face[texturefile_layer].image = image
+
+        face.smooth = True
+        face.normal_flip()
+
+    bm.normal_update()
+    bm.to_mesh(me)
+    bm.free()
+
+def get_values(collection, attribute, width=1, dtype=np.float32):
+    values = np.zeros(len(collection) * width, dtype=dtype)
+    collection.foreach_get(attribute, values)
+    return values
+
+def compare_meshes(a, b, tolerance=1e-5):
+    """Returns the names of all mesh data that differs between a and b."""
+    checks = [
+        ("vertices", lambda me: me.vertices, "co", 3, np.float32),
+        ("loops", lambda me: me.loops, "vertex_index", 1, np.int32),
+        ("loop_start", lambda me: me.polygons, "loop_start", 1, np.int32),
+        ("loop_total", lambda me: me.polygons, "loop_total", 1, np.int32),
+        ("smooth", lambda me: me.polygons, "use_smooth", 1, bool),
+        ]
+    for layer in a.uv_layers:
+        checks.append((layer.name, lambda me, name=layer.name: me.uv_layers[name].data, "uv", 2, np.float32))
+    for layer in a.vertex_colors:
+        checks.append((layer.name, lambda me, name=layer.name: me.vertex_colors[name].data, "color", 3, np.float32))
+    for layer in a.polygon_layers_int:
+        checks.append((layer.name, lambda me, name=layer.name: me.polygon_layers_int[name].data, "value", 1, np.int32))
+
+    differences = []
+    for label, get_collection, attribute, width, dtype in checks:
+        try:
+            values_a = get_values(get_collection(a), attribute, width, dtype)
+            values_b = get_values(get_collection(b), attribute, width, dtype)
+        except KeyError:
+            differences.append(label + " (missing)")
+            continue
+        if values_a.shape != values_b.shape or not np.allclose(values_a, values_b, atol=tolerance):
+            differences.append(label)
+
+    images_a = [face.image for face in a.uv_textures["uv"].data] if "uv" in a.uv_textures else []
+    images_b = [face.image for face in b.uv_textures["uv"].data] if "uv" in b.uv_textures else []
+    if images_a != images_b:
+        differences.append("images")
+    return differences
@@ -0,0 +1,160 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Bulk edits of face attributes and vertex colors as masked array operations.
+
+bmesh has no bulk access, so the edit mesh is flushed to the mesh by
+leaving edit mode for the duration of the edit. The face and loop
+attributes are then read and written with foreach_get/foreach_set:
+
+    with mesh_edit.object_mode(context.object) as me:
+        mesh_edit.set_face_bits(me, const.FACE_DOUBLE, True)
+
+Face selections are read and written on the edit mesh directly, see
+get_edit_face_arrays and set_edit_face_selection, so selecting never
+leaves edit mode.
+"""
+
+import bpy
+import numpy as np
+from contextlib import contextmanager
+
+from .mesh_build import get_values
+
+
+@contextmanager
+def object_mode(ob):
+    """Leaves edit mode while the block runs and yields the object's mesh."""
+    editing = ob.mode == 'EDIT'
+    if editing:
+        bpy.ops.object.mode_set(mode='OBJECT')
+    try:
+        yield ob.data
+    finally:
+        if editing:
+            bpy.ops.object.mode_set(mode='EDIT')
+        else:
+            ob.data.update()
+
+def get_int_layer(me, name):
+    return me.polygon_layers_int.get(name) or me.polygon_layers_int.new(name)
+
+def get_color_layer(me, name):
+    return me.vertex_colors.get(name) or me.vertex_colors.new(name)
+
+def selected_faces(me):
+    return get_values(me.polygons, "select", dtype=bool)
+
+def selected_loops(me):
+    """Loops of selected vertices, these are the ones the color tools paint."""
+    vertex_select = get_values(me.vertices, "select", dtype=bool)
+    return vertex_select[get_values(me.loops, "vertex_index", dtype=np.int32)]
+
+
+######################################################
+# FACES
+######################################################
+def set_face_bits(me, mask, value, selection=None):
+    """Sets or clears the bits of mask on the selected faces, returns their count."""
+    if selection is None:
+        selection = selected_faces(me)
+    layer = get_int_layer(me, "flags")
+    flags = get_values(layer.data, "value", dtype=np.int32)
+    if value:
+        flags[selection] |= mask
+    else:
+        flags[selection] &= ~mask
+    layer.data.foreach_set("value", flags)
+    return int(selection.sum())
+
+def set_face_value(me, name, value, selection=None):
+    """Assigns value to int layer name (texture, revolt_material) of the selected faces."""
+    if selection is None:
+        selection = selected_faces(me)
+    layer = get_int_layer(me, name)
+    values = get_values(layer.data, "value", dtype=np.int32)
+    values[selection] = value
+    layer.data.foreach_set("value", values)
+    return int(selection.sum())
+
+def get_face_layer(me, name):
+    """Values of int layer name for all faces, zeros if the layer is missing."""
+    layer = me.polygon_layers_int.get(name)
+    if layer is None:
+        return np.zeros(len(me.polygons), dtype=np.int32)
+    return get_values(layer.data, "value", dtype=np.int32)
+
+def get_face_arrays(me):
+    """The arrays face queries run on, see face_query.py."""
+    return {
+        "flags": get_face_layer(me, "flags"),
+        "texture": get_face_layer(me, "texture"),
+        "material": get_face_layer(me, "revolt_material"),
+        }
+
+def set_face_selection(me, selection):
+    """Selects exactly the given faces along with their edges and vertices."""
+    loop_total = get_values(me.polygons, "loop_total", dtype=np.int32)
+    loop_selection = np.repeat(selection, loop_total)
+
+    vertex_selection = np.zeros(len(me.vertices), dtype=bool)
+    vertex_selection[get_values(me.loops, "vertex_index", dtype=np.int32)[loop_selection]] = True
+    edge_selection = np.zeros(len(me.edges), dtype=bool)
+    edge_selection[get_values(me.loops, "edge_index", dtype=np.int32)[loop_selection]] = True
+
+    me.vertices.foreach_set("select", vertex_selection)
+    me.edges.foreach_set("select", edge_selection)
+    me.polygons.foreach_set("select", selection)
+    return int(selection.sum())
+
+
+######################################################
+# EDIT MESH
+######################################################
+def get_edit_face_arrays(bm):
+    """
+    The face query arrays (see get_face_arrays) and the face selection of a
+    bmesh, from one pass over its faces.
+    """
+    # missing layers read as 0 on every face
+    layers = [bm.faces.layers.int.get(name) for name in ("flags", "texture", "revolt_material")]
+    values = []
+    selection = []
+    for face in bm.faces:
+        values.append([face[layer] if layer else 0 for layer in layers])
+        selection.append(face.select)
+    flags, textures, materials = np.array(values, dtype=np.int32).reshape(-1, 3).T.copy()
+    arrays = {"flags": flags, "texture": textures, "material": materials}
+    return arrays, np.array(selection, dtype=bool)
+
+def set_edit_face_selection(bm, selection):
+    """Selects exactly the given faces of a bmesh along with their edges and vertices."""
+    for elements in (bm.verts, bm.edges, bm.faces):
+        for element in elements:
+            element.select = False
+    for face, select in zip(bm.faces, selection.tolist()):
+        if select:
+            face.select_set(True)
+    bm.select_flush_mode()
+    return int(selection.sum())
+
+
+######################################################
+# VERTEX COLORS
+######################################################
+def set_loop_color(me, name, color, selection=None):
+    """Sets color layer name of all loops of the selected vertices to an RGB color."""
+    if selection is None:
+        selection = selected_loops(me)
+    layer = get_color_layer(me, name)
+    colors = get_values(layer.data, "color", 3).reshape(-1, 3)
+    colors[selection] = color
+    layer.data.foreach_set("color", colors.ravel())
+    return int(selection.sum())
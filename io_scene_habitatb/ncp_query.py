@@ -0,0 +1,201 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free collision queries against NCP data, e.g. to validate track sample
+points right after exporting without starting the game.
+
+All positions are in Re-Volt space, where the y axis points down. Every
+query takes arrays of query points and only tests the polyhedra stored in
+the lookup grid cells the query touches.
+
+    query = NCPQuery.from_file("nhood1.ncp")
+    height, material, index = query.ground(x, z)
+"""
+
+import numpy as np
+
+from . import codec_ncp
+
+# tolerance for points lying on a cutting plane
+EPSILON = 1e-3
+
+
+class NCPQuery:
+
+    def __init__(self, polyhedra, grid=None):
+        self.polyhedra = polyhedra
+        planes = polyhedra["planes"].astype(np.float64)
+        self.normals = planes[:, :, :3]
+        self.distances = planes[:, :, 3]
+        self.materials = polyhedra["surface"]
+        self.bboxes = polyhedra["bbox"].astype(np.float64)
+
+        # files without a grid get one built from the polyhedra
+        if grid is None:
+            grid = codec_ncp.build_grid(self.bboxes)
+        (self.min_x, self.min_z, self.x_size, self.z_size, self.grid_size), self.offsets, self.indices = grid
+
+        # vertical extent, y points down
+        self.top = self.bboxes[:, 2].min() if len(self.bboxes) else 0.0
+        self.bottom = self.bboxes[:, 3].max() if len(self.bboxes) else 0.0
+
+    @classmethod
+    def from_buffer(cls, data):
+        """Loads the polyhedra and the lookup grid from NCP file data."""
+        polyhedra = codec_ncp.read_ncp(data).copy()
+        return cls(polyhedra, codec_ncp.read_grid(data, codec_ncp.grid_offset(polyhedra)))
+
+    @classmethod
+    def from_file(cls, filepath):
+        with open(filepath, "rb") as file:
+            return cls.from_buffer(file.read())
+
+    def candidates(self, mins, maxs):
+        """
+        Returns (query, polyhedron) pairs for all polyhedra in the grid cells
+        overlapped by the (x, z) boxes mins/maxs of every query. A polyhedron
+        can show up more than once for the same query.
+        """
+        mins = np.asarray(mins, dtype=np.float64).reshape(-1, 2)
+        maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 2)
+        empty = np.zeros(0, dtype=np.int64)
+        if not self.x_size or not self.z_size:
+            return empty, empty
+
+        def cell_range(lo, hi, origin, size):
+            first = np.floor((lo - origin) / self.grid_size)
+            last = np.floor((hi - origin) / self.grid_size)
+            inside = (last >= 0) & (first < size)
+            first = np.clip(first, 0, size - 1).astype(np.int64)
+            last = np.clip(last, 0, size - 1).astype(np.int64)
+            return first, last, inside
+
+        from_x, to_x, inside_x = cell_range(mins[:, 0], maxs[:, 0], self.min_x, self.x_size)
+        from_z, to_z, inside_z = cell_range(mins[:, 1], maxs[:, 1], self.min_z, self.z_size)
+        span_x = np.where(inside_x & inside_z, to_x - from_x + 1, 0)
+        span_z = to_z - from_z + 1
+        cell_counts = span_x * span_z
+
+        # (query, cell) pairs
+        pair_queries = np.repeat(np.arange(len(mins)), cell_counts)
+        local = np.arange(cell_counts.sum()) - np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+        pair_span_z = np.repeat(span_z, cell_counts)
+        cells = (np.repeat(from_x, cell_counts) + local // pair_span_z +
+                 (np.repeat(from_z, cell_counts) + local % pair_span_z) * self.x_size)
+
+        # (query, polyhedron) pairs through the CSR table
+        starts = self.offsets[cells]
+        counts = self.offsets[cells + 1] - starts
+        queries = np.repeat(pair_queries, counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return queries, self.indices[np.repeat(starts, counts) + local]
+
+    def inside(self, points, polys, tolerance=EPSILON):
+        """Whether points lie within the cutting planes of their polyhedra."""
+        # the unused fourth plane of triangles is all zeros and contains everything
+        normals = self.normals[polys, 1:]
+        distances = self.distances[polys, 1:]
+        return np.all(np.einsum("nkj,nj->nk", normals, points) + distances <= tolerance, axis=1)
+
+    def raycast(self, origins, directions, max_distance=1e6, both_sides=False):
+        """
+        Casts rays against the floor planes of the polyhedra. Only front
+        faces are hit unless both_sides is set.
+        Returns hit distance (inf on a miss), polyhedron index (-1 on a
+        miss), hit points and floor normals.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        directions = directions / np.sqrt((directions ** 2).sum(axis=1))[:, None]
+        ends = origins + directions * max_distance
+
+        queries, polys = self.candidates(np.minimum(origins, ends)[:, [0, 2]], np.maximum(origins, ends)[:, [0, 2]])
+        o = origins[queries]
+        d = directions[queries]
+        n = self.normals[polys, 0]
+        facing = (n * d).sum(axis=1)
+        side = (n * o).sum(axis=1) + self.distances[polys, 0]
+        hit = (facing < 0) | (both_sides & (facing != 0))
+        t = -side / np.where(facing != 0, facing, 1)
+        hit &= (t >= 0) & (t <= max_distance)
+        points = o + d * t[:, None]
+        hit &= self.inside(points, polys)
+
+        return self._nearest(len(origins), queries[hit], polys[hit], t[hit], origins, directions)
+
+    def ground(self, x, z):
+        """
+        Returns the height (y) of the topmost surface below (x, z), its
+        material and polyhedron index. Positions without ground get nan, -1
+        and -1.
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        z = np.asarray(z, dtype=np.float64).ravel()
+        origins = np.column_stack((x, np.full(len(x), self.top - 1), z))
+        directions = np.tile([0.0, 1.0, 0.0], (len(x), 1))
+        distance, index, points, normals = self.raycast(origins, directions, self.bottom - self.top + 2)
+        height = np.where(index >= 0, points[:, 1], np.nan)
+        material = np.full(len(x), -1, dtype=np.int64)
+        hits = index >= 0
+        material[hits] = self.materials[index[hits]]
+        return height, material, index
+
+    def sweep_spheres(self, starts, ends, radii):
+        """
+        Moves spheres from starts to ends and returns the fraction of the way
+        at which they first touch a polyhedron (inf if they don't), its index
+        and the contact normal. Like the game, polyhedra are treated as their
+        floor plane pushed out by the radius and clipped by cutting planes
+        pushed out by the radius, which slightly rounds off corners.
+        """
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 3)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(starts),))
+        moves = ends - starts
+
+        lo = np.minimum(starts, ends) - radii[:, None]
+        hi = np.maximum(starts, ends) + radii[:, None]
+        queries, polys = self.candidates(lo[:, [0, 2]], hi[:, [0, 2]])
+        s = starts[queries]
+        m = moves[queries]
+        r = radii[queries]
+        n = self.normals[polys, 0]
+        facing = (n * m).sum(axis=1)
+        side = (n * s).sum(axis=1) + self.distances[polys, 0]
+
+        # touching when the center is one radius above the floor plane
+        hit = (facing < 0) & (side >= -r)
+        t = np.clip((r - side) / np.where(facing != 0, facing, -1), 0, None)
+        hit &= t <= 1
+        centers = s + m * t[:, None]
+        hit &= self.inside(centers, polys, r[:, None] + EPSILON)
+
+        fraction, index, _, normals = self._nearest(len(starts), queries[hit], polys[hit], t[hit], starts, moves)
+        return fraction, index, normals
+
+    def _nearest(self, count, queries, polys, t, origins, directions):
+        # keep the nearest hit of every query
+        distance = np.full(count, np.inf)
+        index = np.full(count, -1, dtype=np.int64)
+        normals = np.zeros((count, 3))
+        if not len(self.normals):
+            # no polyhedra, nothing is hit
+            return distance, index, origins.copy(), normals
+        if len(t):
+            order = np.lexsort((t, queries))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = queries[order][1:] != queries[order][:-1]
+            nearest = order[first]
+            distance[queries[nearest]] = t[nearest]
+            index[queries[nearest]] = polys[nearest]
+        points = origins + directions * np.where(index >= 0, distance, 0)[:, None]
+        hits = index >= 0
+        normals[hits] = self.normals[index[hits], 0]
+        return distance, index, points, normals
@@ -7,107 +7,203 @@
 #
 # ##### END LICENSE BLOCK #####
 
-def read_parameters(f):
-	parameters = {}
-	file = open(f, "r")
+"""
+Reads parameters.txt files of cars in one pass over a token stream.
 
-	if not "{" in file.readline():
-		print("Not a valid parameters file: File doesn't start with {")
-		return 1
+Keys are lower case, model entries include their number ("model 0"),
+blocks (BODY, WHEEL 0, ...) become dicts of their entries. Numbers, TRUE,
+FALSE and NONE are converted, quoted text is kept as is. An entry with a
+single value holds that value, otherwise a list. Comments start with ;
+and lines starting with ;) are read (1.2/RVGL entries).
 
-	block = None # used to store current context block
-	lines = file.readlines()
+Parsed files are cached by path until their mtime or size changes, so the
+same dict is returned for every read. Don't modify it.
+"""
 
-	i = 0
-	while i < len(lines):
-		line = lines[i]
+import os, re
 
-		# skips line if it's a comment
-		if line[0] == ';':
-			if line[1] == ')': # escaped 1.2/rvgl comment
-				line = line[2:]
-			else:
-				i += 1
+from .timing import log
+
+# path -> ((mtime, size), parameters)
+cache = {}
+
+# block delimiters in the token stream
+OPEN = object()
+CLOSE = object()
+
+# entries whose values continue on the next lines, with their value count
+MULTILINE_ENTRIES = {"inertia": 9}
+
+CONSTANTS = {"true": True, "false": False, "none": None}
+
+# a comment, a ; in quotes doesn't start one
+COMMENT_PATTERN = re.compile(r'("[^"]*"?)|;.*')
+
+# quoted text, braces and words of a line
+TOKEN_PATTERN = re.compile(r'"([^"]*)"?|([{}])|([^\s{}",]+)')
+
+# typed values of the words seen so far, numbers repeat a lot
+words = {}
+MAX_WORDS = 1 << 16
+
+
+######################################################
+# TOKENIZER
+######################################################
+def convert(word):
+	"""Typed value of an unquoted word."""
+	if word[0] in "0123456789-+.":
+		try:
+			return int(word)
+		except ValueError:
+			pass
+		try:
+			return float(word)
+		except ValueError:
+			pass
+	return CONSTANTS.get(word.lower(), word)
+
+def split_line(line):
+	"""Tokens of a line that has quotes or braces, braces become OPEN and CLOSE."""
+	tokens = []
+	for string, brace, word in TOKEN_PATTERN.findall(line):
+		if word:
+			tokens.append(words[word] if word in words else convert(word))
+		elif brace:
+			tokens.append(OPEN if brace == "{" else CLOSE)
+		else:
+			tokens.append(string)
+	return tokens
+
+def tokenize(text):
+	"""
+	Yields the tokens of each line that has any. Comments and commas are
+	dropped, ;) at the start of a line is skipped.
+	"""
+	for line in text.splitlines():
+		if ";" in line:
+			stripped = line.lstrip()
+			if stripped.startswith(";)"):
+				line = stripped[2:]
+			if '"' in line:
+				line = COMMENT_PATTERN.sub(r"\1", line)
+			elif ";" in line:
+				line = line[:line.index(";")]
+
+		if '"' in line or "{" in line or "}" in line:
+			tokens = split_line(line)
+		else:
+			tokens = line.replace(",", " ").split()
+			for i, word in enumerate(tokens):
+				if word not in words:
+					if len(words) > MAX_WORDS:
+						words.clear()
+					words[word] = convert(word)
+				tokens[i] = words[word]
+		if tokens:
+			yield tokens
+
+
+######################################################
+# PARSER
+######################################################
+def is_number(value):
+	return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def get_entry(tokens):
+	"""Returns (key, values) of an entry line."""
+	key = str(tokens[0]).lower()
+	values = tokens[1:]
+	if key == "model" and values:
+		key = "model {}".format(values[0]).lower()
+		values = values[1:]
+	elif key == "name":
+		values = [" ".join(str(value) for value in values)]
+	return key, values
+
+def set_entry(entries, key, values):
+	entries[key] = values[0] if len(values) == 1 else values
+
+def parse_parameters(text):
+	"""
+	Returns the parameters in text as a dict. Raises ValueError if it
+	doesn't start with {.
+	"""
+	parameters = {}
+	entries = parameters
+	block = None
+	started = False
+	# (entries, key, values, value count) of an entry continuing on the next lines
+	pending = None
+
+	for tokens in tokenize(text):
+		if pending:
+			pending_entries, key, values, value_count = pending
+			continues = all(is_number(token) for token in tokens)
+			if continues:
+				values.extend(tokens)
+				if len(values) < value_count:
+					continue
+			set_entry(pending_entries, key, values)
+			pending = None
+			if continues:
 				continue
-		
-		# split comments from lines and remove tabs
-		line = line.split(";")[0].replace('\t', ' ')
 
-		# skips an empty line
-		if not line.strip():
-			i += 1
+		if not started:
+			if tokens[0] is not OPEN:
+				raise ValueError("file doesn't start with {")
+			started = True
 			continue
 
-		# detects start of a block
-		if '{' in line:
-			block = line.split('{')[0].strip().lower()
-			print("Block:", block)
-		
-		# reads block entries
-		elif block:
-			if '}' in line:
-				block = None
-			else:
-				if not "inertia" in line[:7].lower():
-					pline = parse_line(line)
-				else: # read inertia matrix
-					pline = parse_line(' '.join([line, lines[i+1], lines[i+2]]))
-					i += 2
-				if not block in parameters:
-					parameters[block] = {}
-				parameters[block][pline[0]] = pline[1]
-
-		# detects when the file is over
-		elif '}' in line:
-			print("FILE END")
-			break
-
-		# regular entries outside of blocks
+		if OPEN in tokens:
+			block = " ".join(str(token) for token in tokens[:tokens.index(OPEN)]).lower()
+			entries = None
+			log.debug("block: %s", block)
+		elif CLOSE in tokens:
+			if block is None:
+				log.debug("file end")
+				break
+			block = None
+			entries = parameters
 		else:
-			# print("Value", line.strip())
-			pline = parse_line(line)
-			parameters[pline[0]] = pline[1]
-		i += 1
+			key, values = get_entry(tokens)
+			if entries is None:
+				entries = parameters.setdefault(block, {})
+			value_count = MULTILINE_ENTRIES.get(key)
+			if value_count and len(values) < value_count:
+				pending = (entries, key, values, value_count)
+			else:
+				set_entry(entries, key, values)
+
+	if pending:
+		set_entry(*pending[:3])
 	return parameters
 
-def parse_line(line):
-	
-	line = line.replace(',', ' ') # get rid of commas, they're not needed (e.g. offset)
-	line = line.strip() # remove whitespace
-	line = ' '.join(line.split()) # remove whitespace between words (make it just one space)
-
-	entry = line.split(' ')[0].lower()
-
-	# correct the model entries to include their number
-	if entry == "model":
-		entry = ' '.join(line.split(' ')[:2]).lower()
-		value = line.split(' ')[2:]
-	else:
-		value = line.split(' ')[1:]
-	
-	# for the name, only split once and remove the ""
-	if entry == "name":
-		value = line.split(' ', 1)[1].replace('"', '')
-
-	else:
-
-		if type(value) is list:
-			for i in range(len(value)):
-				if '.' in value[i] and value[i].replace('.', '').replace('-', '').isdigit():
-					value[i] = float(value[i])
-				elif value[i].isdigit():
-					value[i] = int(value[i])
-				elif value[i].lower() == "true":
-					value[i] = True
-				elif value[i].lower() == "false":
-					value[i] = False
-				elif value[i].lower() == "none":
-					value[i] = None
-				else:
-					value[i] = value[i].replace('"', '')
-		# convert single-element lists into a simple variable
-		if len(value) == 1:
-			value = value[0]
-
-	print(entry, value)
-	return (entry, value)
\ No newline at end of file
+def read_parameters(f):
+	"""
+	Returns the parameters of file f as a dict or 1 if it isn't a valid
+	parameters file. Files that didn't change since the last read aren't
+	read again.
+	"""
+	path = os.path.abspath(f)
+	stat = os.stat(path)
+	key = (stat.st_mtime_ns, stat.st_size)
+
+	entry = cache.get(path)
+	if entry is not None and entry[0] == key:
+		return entry[1]
+
+	with open(path, "rb") as file:
+		data = file.read()
+	try:
+		text = data.decode("utf-8")
+	except UnicodeDecodeError:
+		text = data.decode("latin-1")
+
+	try:
+		parameters = parse_parameters(text)
+	except ValueError as e:
+		log.warning("not a valid parameters file: %s", e)
+		parameters = 1
+	cache[path] = (key, parameters)
+	return parameters
@@ -0,0 +1,224 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Profiler capture for operators. When "Profile operators" is enabled in the
+addon preferences (or HABITATB_PROFILE is set, e.g. to 1 or to the number of
+entries to list), every import, export and tool operator runs under cProfile
+and tracemalloc and leaves two files next to its output file:
+
+    track.w.pstats     load with pstats or snakeviz
+    track.w.alloc.txt  the hottest functions and the top allocations
+
+Tool operators without a file write next to the .blend, or to the temp
+folder for unsaved files. The hottest functions also go to the report
+message, so they show up in the info header.
+
+The peak of the traced memory is read at the end of each timing phase to
+tell in which phase it was reached, which is cheap. Only one snapshot is
+taken at the end, the allocation report lists the lines still holding
+memory when the operator finished.
+"""
+
+import cProfile, functools, linecache, os, pstats, tempfile, threading, time, tracemalloc
+from contextlib import ExitStack
+
+from . import timing
+from .timing import log
+
+DEFAULT_TOP = 15
+# hot functions in the report message
+REPORT_TOP = 3
+
+IGNORED_TRACES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+    )
+
+
+######################################################
+# SETTINGS
+######################################################
+def get_settings():
+    """Returns (enabled, top) from HABITATB_PROFILE or the addon preferences."""
+    value = os.environ.get("HABITATB_PROFILE", "").strip().lower()
+    if value:
+        if value in ("0", "false", "off", "no"):
+            return False, DEFAULT_TOP
+        return True, int(value) if value.isdigit() and int(value) > 1 else DEFAULT_TOP
+
+    try:
+        import bpy
+        prefs = bpy.context.user_preferences.addons[__package__].preferences
+    except (ImportError, AttributeError, KeyError):
+        return False, DEFAULT_TOP
+    return prefs.profile_operators, prefs.profile_top
+
+def get_base_path(operator):
+    """The operator's file, or a file named after it next to the .blend."""
+    filepath = getattr(operator, "filepath", "")
+    if filepath:
+        return filepath
+
+    folder = tempfile.gettempdir()
+    try:
+        import bpy
+        if bpy.data.filepath:
+            folder = os.path.dirname(bpy.data.filepath)
+    except ImportError:
+        pass
+    name = getattr(operator, "bl_idname", "operator").replace(".", "_")
+    return os.path.join(folder, "habitatb_" + name)
+
+def capture(operator, base_path=None):
+    """Returns a Profile for operator if profiling is enabled, else a no-op context."""
+    enabled, top = get_settings()
+    if not enabled:
+        return ExitStack()
+    return Profile(operator, base_path or get_base_path(operator), top)
+
+def profiled(execute):
+    """Decorator for Operator.execute, profiles it if profiling is enabled."""
+    @functools.wraps(execute)
+    def wrapper(self, context):
+        with capture(self):
+            return execute(self, context)
+    return wrapper
+
+
+######################################################
+# PROFILE
+######################################################
+def function_name(key):
+    filename, line, name = key
+    if filename == "~":
+        # built-in functions
+        return name.strip("<>")
+    return "{} ({}:{})".format(name, os.path.basename(filename), line)
+
+def is_profiler_function(key):
+    filename, line, name = key
+    return filename in (__file__, tracemalloc.__file__) or "_tracemalloc" in name
+
+def format_size(size):
+    return "{:.2f} MB".format(size / 1048576) if abs(size) >= 1048576 else "{:.1f} KB".format(size / 1024)
+
+def format_statistics(statistics, top):
+    lines = []
+    for number, stat in enumerate(statistics[:top], 1):
+        frame = stat.traceback[0]
+        lines.append("{:3}. {}:{}: {} in {} blocks".format(number, frame.filename, frame.lineno,
+                                                          format_size(getattr(stat, "size_diff", stat.size)),
+                                                          getattr(stat, "count_diff", stat.count)))
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        if source:
+            lines.append("       " + source)
+    return lines
+
+
+class Profile:
+    """Runs the enclosed block under cProfile and tracemalloc and writes the results."""
+
+    def __init__(self, operator=None, base_path=None, top=DEFAULT_TOP):
+        self.operator = operator
+        self.base_path = base_path
+        self.top = top
+        self.name = getattr(operator, "bl_label", "HabitatB")
+        self.profiler = None
+        self.peak = 0
+        self.peak_phase = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.start_snapshot = tracemalloc.take_snapshot()
+        timing.phase_listeners.append(self.sample)
+
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # another profiler is running already
+            log.warning("Could not start the profiler: %s", e)
+            self.profiler = None
+        self.time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.total = time.perf_counter() - self.time_start
+
+        timing.phase_listeners.remove(self.sample)
+        self.sample("end")
+        self.end_snapshot = tracemalloc.take_snapshot()
+        if self.started_tracing:
+            tracemalloc.stop()
+        self.report()
+
+    def sample(self, phase_name):
+        """Remembers the phase that ended if the traced memory peaked during it."""
+        peak = tracemalloc.get_traced_memory()[1]
+        with self.lock:
+            # small rises come from bookkeeping between phases, they don't move the peak phase
+            if peak > self.peak * 1.01:
+                self.peak_phase = phase_name
+            self.peak = max(self.peak, peak)
+
+    def hot_functions(self, top):
+        """Returns [(name, own seconds, cumulative seconds, calls)] sorted by own time."""
+        if self.profiler is None:
+            return []
+        stats = pstats.Stats(self.profiler).stats
+        # leave out the time spent taking the memory snapshots
+        own = [item for item in stats.items() if not is_profiler_function(item[0])]
+        hot = sorted(own, key=lambda item: item[1][2], reverse=True)[:top]
+        return [(function_name(key), tt, ct, nc) for key, (cc, nc, tt, ct, callers) in hot]
+
+    def allocation_report(self):
+        lines = [
+            "HabitatB profile: {}".format(self.name),
+            "total {:.3f} sec, peak traced memory {} (reached in {})".format(self.total, format_size(self.peak), self.peak_phase),
+            "",
+            "top {} functions by own time:".format(self.top),
+            ]
+        for number, (name, tt, ct, nc) in enumerate(self.hot_functions(self.top), 1):
+            lines.append("{:3}. {:8.3f} sec own {:8.3f} sec total {:9} calls  {}".format(number, tt, ct, nc, name))
+
+        lines += ["", "top {} allocations still held at the end:".format(self.top)]
+        held = self.end_snapshot.filter_traces(IGNORED_TRACES).compare_to(
+            self.start_snapshot.filter_traces(IGNORED_TRACES), "lineno")
+        lines += format_statistics([stat for stat in held if stat.size_diff > 0], self.top)
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        written = []
+        if self.profiler is not None:
+            try:
+                self.profiler.dump_stats(self.base_path + ".pstats")
+                written.append(self.base_path + ".pstats")
+            except OSError as e:
+                log.warning("Could not write profile %s: %s", self.base_path + ".pstats", e)
+        try:
+            with open(self.base_path + ".alloc.txt", "w") as file:
+                file.write(self.allocation_report())
+            written.append(self.base_path + ".alloc.txt")
+        except OSError as e:
+            log.warning("Could not write allocation report %s: %s", self.base_path + ".alloc.txt", e)
+
+        hot = ", ".join("{} {:.3f}s".format(name, tt) for name, tt, ct, nc in self.hot_functions(REPORT_TOP))
+        summary = "Profile of {}: peak {}, hot: {}".format(self.name, format_size(self.peak), hot or "-")
+        log.info(summary)
+        for path in written:
+            log.info("wrote %s", path)
+        if self.operator is not None:
+            self.operator.report({'INFO'}, summary)
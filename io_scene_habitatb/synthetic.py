@@ -0,0 +1,222 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+bpy-free generators for valid synthetic PRM, W, NCP and PAN files, used by
+the benchmarks. All of them are built from a wavy terrain of quads with
+every fourth quad split into two triangles, so both face types show up.
+Car parameters files are generated as a corpus of many small files.
+
+The formats limit PRM to 65535 and NCP to 32767 polygons, W files are split
+into as many cubes as needed and can be of any size.
+"""
+
+import math, struct
+import numpy as np
+
+from . import const, codec_prm, codec_w, codec_ncp, codec_pan
+
+# distance between terrain vertices
+SPACING = 100.0
+MAX_CUBE_POLYS = 16384
+
+
+def terrain(poly_count, seed=0):
+    """
+    Returns vertex positions and the faces of a terrain with about
+    poly_count faces as (loop_start, loop_total, loop_verts), wound like
+    Blender faces.
+    """
+    rng = np.random.RandomState(seed)
+    # a quad becomes 1.25 faces on average
+    size = max(1, int(math.ceil(math.sqrt(poly_count / 1.25))))
+    columns = size + 1
+
+    x, z = np.meshgrid(np.arange(columns, dtype=np.float64), np.arange(columns, dtype=np.float64))
+    y = (np.sin(x * 0.3) * np.cos(z * 0.2) * 2 + rng.uniform(-0.1, 0.1, x.shape)) * SPACING
+    positions = np.column_stack((x.ravel() * SPACING, y.ravel(), z.ravel() * SPACING))
+
+    cell_x, cell_z = np.meshgrid(np.arange(size), np.arange(size))
+    corner = (cell_z * columns + cell_x).ravel()
+    # wound so the floor normals point up, which is -y in Re-Volt space
+    quads = np.column_stack((corner, corner + 1, corner + columns + 1, corner + columns))
+
+    split = np.arange(len(quads)) % 4 == 3
+    triangles = np.concatenate((quads[split][:, [0, 1, 2]], quads[split][:, [0, 2, 3]]))
+    quads = quads[~split]
+
+    loop_total = np.concatenate((np.full(len(quads), 4), np.full(len(triangles), 3)))[:poly_count]
+    loop_verts = np.concatenate((quads.ravel(), triangles.ravel()))[:loop_total.sum()]
+    loop_start = np.cumsum(loop_total) - loop_total
+    return positions, (loop_start, loop_total, loop_verts)
+
+def face_arrays(faces, seed=0):
+    """Random flags, textures, colors and UVs as encode_polys takes them."""
+    loop_start, loop_total, loop_verts = faces
+    rng = np.random.RandomState(seed)
+    loop_count = len(loop_verts)
+    return {
+        "flags": rng.choice([0, const.FACE_DOUBLE, const.FACE_TRANSLUCENT], len(loop_total)),
+        "texture": rng.randint(-1, 8, len(loop_total)),
+        "loop_verts": loop_verts,
+        "loop_start": loop_start,
+        "loop_total": loop_total,
+        "loop_colors": rng.uniform(0, 1, (loop_count, 3)),
+        "loop_alpha": rng.uniform(0, 1, loop_count),
+        "loop_uvs": rng.uniform(0, 1, (loop_count, 2)),
+        }
+
+def split_faces(faces, cube_count):
+    """Splits faces into cube_count runs, returns (faces, used vertices) per run."""
+    loop_start, loop_total, loop_verts = faces
+    runs = []
+    for polys in np.array_split(np.arange(len(loop_total)), cube_count):
+        if not len(polys):
+            continue
+        first, last = loop_start[polys[0]], loop_start[polys[-1]] + loop_total[polys[-1]]
+        used, local_verts = np.unique(loop_verts[first:last], return_inverse=True)
+        runs.append(((loop_start[polys] - first, loop_total[polys], local_verts), used))
+    return runs
+
+
+######################################################
+# FILES
+######################################################
+def make_prm(poly_count, seed=0):
+    positions, faces = terrain(min(poly_count, 0xFFFF), seed)
+    arrays = face_arrays(faces, seed)
+    buf, polys, verts = codec_prm.allocate_prm(len(faces[1]), len(positions))
+    codec_prm.encode_polys(polys, **arrays)
+    verts["position"] = positions
+    verts["normal"] = [0, -1, 0]
+    return bytes(buf)
+
+def make_w(poly_count, cube_count=None, seed=0):
+    positions, faces = terrain(poly_count, seed)
+    if cube_count is None:
+        cube_count = int(math.ceil(len(faces[1]) / MAX_CUBE_POLYS))
+    cube_count = max(cube_count, int(math.ceil(len(faces[1]) / 0x7FFF)), 1)
+
+    chunks = [struct.pack("<l", 0)]
+    cube_mins, cube_maxs = [], []
+    for cube_faces, used in split_faces(faces, cube_count):
+        coords = positions[used]
+        center = (coords.min(axis=0) + coords.max(axis=0)) / 2
+        radius, mins, maxs = codec_w.cube_bounds(coords, center)
+        cube_mins.append(mins)
+        cube_maxs.append(maxs)
+
+        buf, polys, verts = codec_w.allocate_cube(center, radius, mins, maxs, len(cube_faces[1]), len(coords))
+        codec_prm.encode_polys(polys, **face_arrays(cube_faces, seed))
+        verts["position"] = coords
+        verts["normal"] = [0, -1, 0]
+        chunks.append(bytes(buf))
+
+    chunks[0] = struct.pack("<l", len(cube_mins))
+    center, radius = codec_w.level_ball(cube_mins, cube_maxs)
+    chunks.append(struct.pack("<lffff", 1, center[0], center[1], center[2], radius))
+    chunks.append(struct.pack("<l", len(cube_mins)) + np.arange(len(cube_mins), dtype="<i4").tobytes())
+    chunks.append(struct.pack("<l", 0))
+    return b"".join(chunks)
+
+def make_ncp(poly_count, seed=0):
+    positions, (loop_start, loop_total, loop_verts) = terrain(min(poly_count, 0x7FFF), seed)
+    materials = np.random.RandomState(seed).randint(0, 27, len(loop_total))
+    polyhedra = np.zeros(len(loop_total), dtype=codec_ncp.POLYHEDRON_DTYPE)
+    codec_ncp.encode_polyhedra(polyhedra, positions, loop_verts, loop_start, loop_total, materials)
+    # queries only hit floors facing up, upside down files would time the misses
+    if (polyhedra["planes"][:, 0, 1] >= 0).any():
+        raise ValueError("synthetic NCP has floors facing down")
+    return (struct.pack("<h", len(polyhedra)) + polyhedra.tobytes() +
+            codec_ncp.encode_grid(*codec_ncp.build_grid(polyhedra["bbox"])))
+
+def make_pan(node_count, seed=0):
+    """A closed loop of nodes with a shortcut branch every 16 nodes."""
+    rng = np.random.RandomState(seed)
+    nodes = np.zeros(node_count, dtype=codec_pan.NODE_DTYPE)
+    angle = np.linspace(0, 2 * np.pi, node_count, endpoint=False)
+    radius = node_count * SPACING / (2 * np.pi)
+    nodes["position"] = np.column_stack((np.cos(angle) * radius, rng.uniform(-50, 50, node_count), np.sin(angle) * radius))
+
+    step = np.sqrt(((nodes["position"] - np.roll(nodes["position"], 1, axis=0)) ** 2).sum(axis=1))
+    total_dist = float(step.sum())
+    nodes["distance"] = total_dist - np.cumsum(step)
+    nodes["previous"] = -1
+    nodes["next"] = -1
+
+    numbers = np.arange(node_count)
+    nodes["next"][:, 0] = (numbers + 1) % node_count
+    nodes["previous"][:, 0] = (numbers - 1) % node_count
+    branch = numbers[numbers % 16 == 0]
+    nodes["next"][branch, 1] = (branch + 2) % node_count
+    nodes["previous"][(branch + 2) % node_count, 1] = branch
+    return codec_pan.encode_pan(0, total_dist, nodes)
+
+def make_car_parameters(number, rng):
+    """A parameters.txt like the ones of the stock cars, with random values."""
+    # hand tuned values, in steps of 0.5
+    def numbers(count):
+        return " ".join("{:.6f}".format(value) for value in np.round(rng.uniform(-100, 100, count) * 2) / 2)
+
+    lines = ["{", "", ";" + "=" * 60, "; Car {}".format(number), ";" + "=" * 60,
+             'Name      \t"Car {}"'.format(number), ""]
+    for model in range(19):
+        path = '"cars\\car{}\\part{}.prm"'.format(number, model) if model < 6 else '"NONE"'
+        lines.append("MODEL \t{} \t{}".format(model, path))
+    lines += ['TPAGE \t"cars\\car{}\\car.bmp"'.format(number),
+              "EnvRGB \t200 200 200",
+              "BestTime   \tTRUE",
+              ";)CPUSelectable TRUE",
+              "Class      \t1 \t\t\t; Engine type (0=Elec, 1=Glow, 2=Other)",
+              "TopSpeed   \t{:.6f} \t\t\t; Car's theoretical top speed".format(round(rng.uniform(30, 60), 2)),
+              "CoM        \t{} \t\t; Centre of mass relative to model centre".format(numbers(3)),
+              "",
+              "BODY {\t\t; Start Body",
+              "ModelNum   \t0 \t\t\t; Model Number in above list",
+              "Offset     \t0, 3.4, 3.4 \t\t; Calculated in game",
+              "Mass       \t{:.6f}".format(round(rng.uniform(1, 3), 2)),
+              "Inertia    \t{}".format(numbers(3)),
+              "           \t{}".format(numbers(3)),
+              "           \t{}".format(numbers(3)),
+              "Grip       \t0.010000 \t\t\t; Converts downforce to friction value",
+              "}     \t\t; End Body", ""]
+    for block, count in (("WHEEL", 4), ("SPRING", 4), ("PIN", 4), ("AXLE", 4)):
+        for index in range(count):
+            lines += ["{} {} {{ \t; Start {}".format(block, index, block.title()),
+                      "ModelNum \t{}".format(index + 1 if block == "WHEEL" else -1),
+                      "Offset1  \t{}".format(numbers(3)),
+                      "Offset2  \t{}".format(numbers(3)),
+                      "IsPresent   \tTRUE",
+                      "SteerRatio  \t{:.6f}".format(round(rng.uniform(-1, 1), 2)),
+                      "Gravity     \t2200.000000",
+                      "StaticFriction  \t{:.6f}".format(round(rng.uniform(0, 2), 2)),
+                      "}}          \t; End {}".format(block.title()), ""]
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def make_parameters(line_count, seed=0):
+    """
+    A corpus of car parameters files with line_count lines in total, the
+    files are separated by NUL bytes.
+    """
+    rng = np.random.RandomState(seed)
+    files = []
+    lines = 0
+    while lines < line_count:
+        files.append(make_car_parameters(len(files), rng))
+        lines += files[-1].count("\n")
+    return "\0".join(files).encode("ascii")
+
+GENERATORS = {
+    "prm": make_prm,
+    "w": make_w,
+    "ncp": make_ncp,
+    "pan": make_pan,
+    "parameters": make_parameters,
+    }
@@ -0,0 +1,87 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Texture page resolution shared by all importers for the session.
+
+Texture pages of a level or car are named after their folder followed by
+a letter for the texture number (nhood1/nhood1a.bmp, nhood1b.bmp, ...).
+Every folder is listed once, the listing is reused until the folder's
+mtime changes. Missing pages are only reported once.
+"""
+
+import os
+import bpy
+
+from . import timing
+from .timing import log
+
+# folder -> {"mtime", "files", "images", "missing"}
+folders = {}
+
+
+def get_folder(folder):
+    """Returns the cache entry of a folder, (re)scanning it if it changed."""
+    try:
+        mtime = os.stat(folder).st_mtime
+    except OSError:
+        mtime = None
+
+    entry = folders.get(folder)
+    if entry is None or entry["mtime"] != mtime:
+        files = {}
+        if mtime is not None:
+            files = {name.lower(): name for name in os.listdir(folder)}
+        entry = {
+            "mtime": mtime,
+            "files": files,     # lower case name -> actual file name
+            "images": {},       # texture number -> image name
+            "missing": set(),   # texture numbers without a file
+            }
+        folders[folder] = entry
+    return entry
+
+def texture_name(folder, number):
+    return os.path.basename(folder).lower() + chr(97 + number) + ".bmp"
+
+def get_image(folder, number, fake_user=False):
+    """
+    Returns the image of texture page number for the level or car in
+    folder, loading it if necessary. Returns None for missing pages.
+    """
+    if number < 0:
+        return None
+    entry = get_folder(folder)
+    if number in entry["missing"]:
+        return None
+
+    name = texture_name(folder, number)
+    image = bpy.data.images.get(entry["images"].get(number, name))
+    if image:
+        return image
+
+    file_name = entry["files"].get(name)
+    if file_name is None:
+        entry["missing"].add(number)
+        log.warning("texture not found: %s (number %d)", os.path.join(folder, name), number)
+        return None
+
+    image = bpy.data.images.load(os.path.join(folder, file_name))
+    if fake_user:
+        image.use_fake_user = True
+    entry["images"][number] = image.name
+    return image
+
+def get_images(folder, numbers, fake_user=False):
+    """Resolves a set of texture numbers, returns {number: image or None}."""
+    with timing.phase("texture resolve"):
+        return {number: get_image(folder, number, fake_user) for number in set(numbers)}
+
+def clear():
+    folders.clear()
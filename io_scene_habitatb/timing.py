@@ -0,0 +1,134 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Timing instrumentation and logging shared by all importers and exporters.
+
+An operator runs inside a Timer. Code anywhere below it marks named phases
+and bumps counters, which only cost something while a Timer is active:
+
+    with timing.Timer(operator, log_path):
+        with timing.phase("encode"):
+            ...
+        timing.count("faces", len(polys))
+
+Phases add up over repeated and parallel runs (parse is the sum over all
+worker threads) and may nest, e.g. texture resolve happens during mesh
+build. The summary goes to the log and to operator.report, the optional
+log_path gets the same numbers as JSON.
+
+The log level can be set with the HABITATB_LOG_LEVEL environment variable
+or set_level().
+"""
+
+import json, logging, os, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+log = logging.getLogger("io_scene_habitatb")
+if not log.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("HabitatB %(levelname)s: %(message)s"))
+    log.addHandler(handler)
+    log.propagate = False
+    log.setLevel(os.environ.get("HABITATB_LOG_LEVEL", "INFO").upper())
+
+# the timer of the running operator
+active = None
+# functions called with the phase name whenever a phase ends (see profiling.py)
+phase_listeners = []
+
+
+def set_level(level):
+    log.setLevel(level.upper() if isinstance(level, str) else level)
+
+@contextmanager
+def phase(name):
+    """Times the enclosed block as phase name of the active timer."""
+    timer = active
+    if timer is None:
+        yield
+        return
+    time1 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add_time(name, time.perf_counter() - time1)
+        for listener in phase_listeners:
+            listener(name)
+
+def count(name, value=1):
+    """Adds value to counter name of the active timer."""
+    timer = active
+    if timer is not None:
+        timer.add_count(name, value)
+
+
+class Timer:
+    """Collects phases and counters while an operator runs."""
+
+    def __init__(self, operator=None, log_path=None, name=None):
+        self.operator = operator
+        self.log_path = log_path
+        self.name = name or getattr(operator, "bl_label", "HabitatB")
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        global active
+        self.previous = active
+        active = self
+        self.time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        global active
+        self.total = time.perf_counter() - self.time_start
+        active = self.previous
+        self.report()
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "total": self.total,
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+            }
+
+    def summary(self):
+        text = "{}: {:.3f} sec".format(self.name, self.total)
+        if self.phases:
+            text += " (" + ", ".join("{} {:.3f}".format(name, seconds) for name, seconds in self.phases.items()) + ")"
+        if self.counters:
+            text += ", " + ", ".join("{} {}".format(name, value) for name, value in self.counters.items())
+        return text
+
+    def report(self):
+        summary = self.summary()
+        log.info(summary)
+        if self.operator is not None:
+            self.operator.report({'INFO'}, summary)
+
+        if self.log_path:
+            try:
+                with open(self.log_path, "w") as file:
+                    json.dump(self.as_dict(), file, indent=2)
+            except OSError as e:
+                log.warning("Could not write timing log %s: %s", self.log_path, e)
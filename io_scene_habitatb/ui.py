@@ -11,7 +11,7 @@
 import bpy
 import bmesh
 import mathutils
-from . import helpers, const, io_ops
+from . import helpers, const, io_ops, profiling, export_index, timing
 
 from bpy.props import (
         BoolProperty,
@@ -73,47 +73,40 @@ class RevoltFacePropertiesPanel(bpy.types.Panel):
     bl_context = "mesh_edit"
     bl_category = "Re-Volt"
     
-    selection = None
-    selected_face_count = None
-
     # @classmethod
     # def poll(self, context):
     #     return context.object.type == "MESH"
     
     def draw(self, context):
-        obj = context.object
-        mesh = obj.data
-        bm = bmesh.from_edit_mesh(mesh)
-        flags = bm.faces.layers.int.get("flags") or bm.faces.layers.int.new("flags")
-        texture = bm.faces.layers.int.get("texture") or bm.faces.layers.int.new("texture")
-        if self.selected_face_count is None or self.selected_face_count != mesh.total_face_sel:
-            self.selected_face_count = mesh.total_face_sel
-            self.selection = [face for face in bm.faces if face.select]
-        
-        # count the number of faces the flags are set for
-        count = [0] * len(const.FACE_PROPS)
-        # if len(self.selection) > 1:            
-        for face in self.selection:
-            for x in range(len(const.FACE_PROPS)):
-                if face[flags] & const.FACE_PROPS[x]:
-                    count[x] += 1
+        # the number of faces the flags are set for, shared with the face property getters
+        selection = helpers.get_selection_aggregate()
+        count = selection["flag_counts"]
 
 
         rvtype = context.object.revolt.rv_type
         if rvtype in ["NCP"]:
-            self.layout.prop(context.object.data.revolt, "face_material", text="Material".format(""))
+            names = {item[4]: item[1] for item in const.materials}
+            self.layout.operator_menu_enum("faceprops.set_material", "material",
+                                           text="Material: {}".format(names.get(selection["material"], "None")))
+            self.layout.operator("faceprops.select_query", icon="VIEWZOOM")
         if rvtype in ["MESH", "WORLD", "OBJECT", "INSTANCE"]:
             row  = self.layout.row()
-            col = row.column(align = True)    
-            col.prop(context.object.data.revolt, "face_double_sided", text="{}: Double sided".format(count[1]))
-            col.prop(context.object.data.revolt, "face_translucent", text="{}: Translucent".format(count[2]))
-            col.prop(context.object.data.revolt, "face_mirror", text="{}: Mirror".format(count[3]))
-            col.prop(context.object.data.revolt, "face_additive", text="{}: Additive blending".format(count[4]))
-            col.prop(context.object.data.revolt, "face_texture_animation", text="{}: Texture animation".format(count[5]))
-            col.prop(context.object.data.revolt, "face_no_envmapping", text="{}: No EnvMap".format(count[6]))
-            col.prop(context.object.data.revolt, "face_envmapping", text="{}: EnvMap".format(count[7]))
-            col.prop(context.object.data.revolt, "face_cloth", text="{}: Cloth effect".format(count[8]))
-            col.prop(context.object.data.revolt, "face_skip", text="{}: Do not export".format(count[9]))
+            col = row.column(align = True)
+            # the flags are set by operators, one undo step per click
+            for prop, label in ((const.FACE_DOUBLE, "Double sided"),
+                                (const.FACE_TRANSLUCENT, "Translucent"),
+                                (const.FACE_MIRROR, "Mirror"),
+                                (const.FACE_TRANSL_TYPE, "Additive blending"),
+                                (const.FACE_TEXANIM, "Texture animation"),
+                                (const.FACE_NOENV, "No EnvMap"),
+                                (const.FACE_ENV, "EnvMap"),
+                                (const.FACE_CLOTH, "Cloth effect"),
+                                (const.FACE_SKIP, "Do not export")):
+                is_set = bool(selection["flags"] & prop)
+                op = col.operator("faceprops.set_flags", text="{}: {}".format(count[const.FACE_PROPS.index(prop)], label),
+                                  icon="CHECKBOX_HLT" if is_set else "CHECKBOX_DEHLT")
+                op.mask = prop
+                op.value = not is_set
             col = row.column(align=True)
             col.scale_x = 0.15
             col.operator("faceprops.select", text="sel").prop = const.FACE_DOUBLE
@@ -122,16 +115,19 @@ class RevoltFacePropertiesPanel(bpy.types.Panel):
             col.operator("faceprops.select", text="sel").prop = const.FACE_TRANSL_TYPE
             col.operator("faceprops.select", text="sel").prop = const.FACE_TEXANIM
             col.operator("faceprops.select", text="sel").prop = const.FACE_NOENV
-            col.operator("faceprops.select", text="sel").prop = const.FACE_CLOTH
+            col.operator("faceprops.select", text="sel").prop = const.FACE_ENV
             col.operator("faceprops.select", text="sel").prop = const.FACE_CLOTH
             col.operator("faceprops.select", text="sel").prop = const.FACE_SKIP
 
             
-            if len(self.selection) > 1:
-                self.layout.prop(context.object.data.revolt, "face_texture", text="Texture (multiple)")
+            self.layout.operator("faceprops.select_query", icon="VIEWZOOM")
+
+            texture = selection["texture"]
+            if selection["count"] > 1:
+                self.layout.operator("faceprops.set_texture", text="Texture (multiple): {}".format(texture if texture >= 0 else "-"))
                 self.layout.label(text="(Texture will be applied to all selected faces.)")
             else:
-                self.layout.prop(context.object.data.revolt, "face_texture", text="Texture".format(""))
+                self.layout.operator("faceprops.set_texture", text="Texture: {}".format(texture))
         else:
             self.layout.label(text="Face properties are")
             self.layout.label(text="only available for Mesh,")
@@ -145,9 +141,6 @@ class RevoltVertexPanel(bpy.types.Panel):
     bl_context = "mesh_edit"
     bl_category = "Re-Volt"
 
-    selection = None
-    selected_face_count = None
-
     def draw(self, context):
         obj = context.object
         row = self.layout.row(align=True)
@@ -158,11 +151,6 @@ class RevoltVertexPanel(bpy.types.Panel):
             mesh = obj.data
             bm = bmesh.from_edit_mesh(mesh)
             vc_layer = bm.loops.layers.color.get("color")
-           
-            # update selection data
-            if self.selected_face_count is None or self.selected_face_count != mesh.total_face_sel:
-                self.selected_face_count = mesh.total_face_sel
-                self.selection = [face for face in bm.faces if face.select]
         
             if vc_layer is None:
                 row = self.layout.row()
@@ -170,7 +158,7 @@ class RevoltVertexPanel(bpy.types.Panel):
                 row = self.layout.row()
                 row.operator("vertexcolor.create_layer", icon='PLUS')
 
-            elif self.selection:
+            elif mesh.total_face_sel:
                 row = self.layout.row()
                 row.operator("vertexcolor.set", text="Grey 50%").number=50
                 row.operator("vertexcolor.set", text="")
@@ -194,6 +182,12 @@ class RevoltVertexPanel(bpy.types.Panel):
                 col.operator("vertexcolor.set", text="Grey 90%").number=90
                 col.operator("vertexcolor.set", text="White").number=100
 
+                if bm.loops.layers.color.get("alpha") is not None:
+                    self.layout.label(text="Alpha:")
+                    row = self.layout.row(align=True)
+                    for number in (0, 25, 50, 75, 100):
+                        row.operator("alphacolor.set", text="{}%".format(number)).number=number
+
 """
 Tool panel in the left sidebar of the viewport for performing
 various operations
@@ -207,14 +201,6 @@ class RevoltToolPanel(bpy.types.Panel):
 
     def draw(self, context):
         # i/o buttons
-        types = []
-        # create a list with object types to later check if an export is possible
-        for obj in bpy.context.scene.objects:
-            types.append(obj.revolt.rv_type)
-            if obj.revolt.export_as_ncp:
-                types.append("NCP")
-            if obj.revolt.export_as_w:
-                types.append("WORLD")
 
         row = self.layout.row(align=True)
         row.label(text="Import")
@@ -229,12 +215,12 @@ class RevoltToolPanel(bpy.types.Panel):
         else:
             row.operator(io_ops.ExportPRM.bl_idname, text="PRM", icon="X")
             
-        if "WORLD" in types: 
+        if export_index.can_export(context.scene, "WORLD"):
             row.operator(io_ops.ExportW.bl_idname, text="W")
         else:
             row.operator(io_ops.ExportW.bl_idname, text="W", icon="X")
         
-        if "NCP" in types:
+        if export_index.can_export(context.scene, "NCP"):
             row.operator(io_ops.ExportNCP.bl_idname, text="NCP")
         else:
             row.operator(io_ops.ExportNCP.bl_idname, text="NCP", icon="X")
@@ -266,6 +252,9 @@ class RevoltToolPanel(bpy.types.Panel):
             row.operator("objtype.setalladdncp", text="NCP", icon="RADIOBUT_ON")
             row.operator("objtype.unsetalladdncp", text="Not NCP", icon="RADIOBUT_OFF")
 
+            self.layout.label(text="Vertex lighting (world objects):")
+            self.layout.operator("vertexcolor.bake", icon="RENDER_STILL")
+
         if context.mode == "EDIT_MESH":
             mesh = obj.data
             bm = bmesh.from_edit_mesh(mesh)
@@ -288,6 +277,7 @@ class ButtonSetAllW(bpy.types.Operator):
     bl_idname = "objtype.setw"
     bl_label = "Set all selected objects to World."
  
+    @profiling.profiled
     def execute(self, context):
         helpers.set_all_w(context)
         return{'FINISHED'} 
@@ -296,6 +286,7 @@ class ButtonSetAllPRM(bpy.types.Operator):
     bl_idname = "objtype.setprm"
     bl_label = "Set all selected objects to PRM."
  
+    @profiling.profiled
     def execute(self, context):
         helpers.set_all_prm(context)
         return{'FINISHED'} 
@@ -304,26 +295,91 @@ class ButtonSetAllNCP(bpy.types.Operator):
     bl_idname = "objtype.setncp"
     bl_label = "Set all selected objects to NCP."
  
+    @profiling.profiled
     def execute(self, context):
         helpers.set_all_ncp(context)
         return{'FINISHED'} 
 # FACE PROP SELECTORS
 
+class ButtonSetFaceFlags(bpy.types.Operator):
+    bl_idname = "faceprops.set_flags"
+    bl_label = "Set or clear flags of all selected faces"
+    bl_options = {'REGISTER', 'UNDO'}
+    mask = bpy.props.IntProperty(name = "Flags")
+    value = bpy.props.BoolProperty(name = "Set", default = True)
+
+    @profiling.profiled
+    def execute(self, context):
+        helpers.set_selected_faces(context, "flags", self.value, self.mask)
+        return{'FINISHED'}
+
+class ButtonSetFaceTexture(bpy.types.Operator):
+    bl_idname = "faceprops.set_texture"
+    bl_label = "Set the texture of all selected faces"
+    bl_options = {'REGISTER', 'UNDO'}
+    texture = bpy.props.IntProperty(name = "Texture", min = -1)
+
+    def invoke(self, context, event):
+        self.texture = max(-1, helpers.get_selection_aggregate()["texture"])
+        return context.window_manager.invoke_props_dialog(self)
+
+    @profiling.profiled
+    def execute(self, context):
+        helpers.set_selected_faces(context, "texture", self.texture)
+        return{'FINISHED'}
+
+class ButtonSetFaceMaterial(bpy.types.Operator):
+    bl_idname = "faceprops.set_material"
+    bl_label = "Set the material of all selected faces"
+    bl_options = {'REGISTER', 'UNDO'}
+    material = bpy.props.EnumProperty(name = "Material", items = const.materials)
+
+    @profiling.profiled
+    def execute(self, context):
+        values = {item[0]: item[4] for item in const.materials}
+        helpers.set_selected_faces(context, "revolt_material", values[self.material])
+        return{'FINISHED'}
+
 class ButtonSelectFaceProp(bpy.types.Operator):
     bl_idname = "faceprops.select"
     bl_label = "sel"
     prop = bpy.props.IntProperty()
  
+    @profiling.profiled
     def execute(self, context):
         helpers.select_faces(context, self.prop)
         return{'FINISHED'}    
 
+class ButtonSelectFaceQuery(bpy.types.Operator):
+    """Select faces by an expression over flags, texture and material, e.g. translucent and not double"""
+    bl_idname = "faceprops.select_query"
+    bl_label = "Select Faces by Expression"
+    bl_options = {'REGISTER', 'UNDO'}
+    expression = bpy.props.StringProperty(name = "Expression", description = "e.g. translucent and not double, texture in {3, 4} and env, material == ICE1")
+    mode = bpy.props.EnumProperty(name = "Mode", default = "REPLACE", items = (("REPLACE", "Replace", "Select only the matching faces"),
+                                                                             ("EXTEND", "Extend", "Add the matching faces to the selection"),
+                                                                             ("SUBTRACT", "Subtract", "Remove the matching faces from the selection")))
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self, width = 400)
+
+    @profiling.profiled
+    def execute(self, context):
+        try:
+            count = helpers.select_faces_by_query(context, self.expression, self.mode)
+        except ValueError as e:
+            self.report({'ERROR'}, str(e))
+            return{'CANCELLED'}
+        self.report({'INFO'}, "{} faces match".format(count))
+        return{'FINISHED'}
+
 # ADDITIONAL OBJECT TYPE
 
 class ButtonSetAllAddW(bpy.types.Operator):
     bl_idname = "objtype.setalladdw"
     bl_label = "Set Additional export to selected objects."
  
+    @profiling.profiled
     def execute(self, context):
         helpers.set_all_add_w(context)
         return{'FINISHED'} 
@@ -332,6 +388,7 @@ class ButtonSetAllAddNCP(bpy.types.Operator):
     bl_idname = "objtype.setalladdncp"
     bl_label = "Set Additional export to selected objects."
  
+    @profiling.profiled
     def execute(self, context):
         helpers.set_all_add_ncp(context)
         return{'FINISHED'} 
@@ -342,6 +399,7 @@ class ButtonUnsetAllAddW(bpy.types.Operator):
     bl_idname = "objtype.unsetalladdw"
     bl_label = "Unset Additional export to selected objects."
  
+    @profiling.profiled
     def execute(self, context):
         helpers.unset_all_add_w(context)
         return{'FINISHED'} 
@@ -350,6 +408,7 @@ class ButtonUnsetAllAddNCP(bpy.types.Operator):
     bl_idname = "objtype.unsetalladdncp"
     bl_label = "Unset Additional export to selected objects."
  
+    @profiling.profiled
     def execute(self, context):
         helpers.unset_all_add_ncp(context)
         return{'FINISHED'} 
@@ -359,16 +418,133 @@ class ButtonUnsetAllAddNCP(bpy.types.Operator):
 class ButtonVertexColorSet(bpy.types.Operator):
     bl_idname = "vertexcolor.set"
     bl_label = "SET COLOR"
+    bl_options = {'REGISTER', 'UNDO'}
     number = bpy.props.IntProperty()
  
+    @profiling.profiled
     def execute(self, context):
         helpers.set_vertex_color(context, self.number)
         return{'FINISHED'}    
 
+class ButtonAlphaColorSet(bpy.types.Operator):
+    bl_idname = "alphacolor.set"
+    bl_label = "SET ALPHA"
+    bl_options = {'REGISTER', 'UNDO'}
+    number = bpy.props.IntProperty()
+ 
+    @profiling.profiled
+    def execute(self, context):
+        helpers.set_vertex_color(context, self.number, "alpha")
+        return{'FINISHED'}    
+
+class BakeVertexLighting(bpy.types.Operator):
+    """Bake sun and point lamps with shadows and ambient occlusion into the vertex colors of all world objects"""
+    bl_idname = "vertexcolor.bake"
+    bl_label = "Bake Vertex Lighting"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    ambient_color = bpy.props.FloatVectorProperty(name = "Ambient", subtype = 'COLOR', min = 0, max = 1, default = (0.5, 0.5, 0.5), description = "Light from the sky, darkened by ambient occlusion")
+    samples = bpy.props.IntProperty(name = "AO samples", min = 0, max = 1024, default = 64, description = "Ambient occlusion rays per vertex")
+    samples_per_pass = bpy.props.IntProperty(name = "Samples per pass", min = 1, max = 256, default = 4, description = "The colors are updated after every pass, fewer samples give a faster preview")
+    ao_distance = bpy.props.FloatProperty(name = "AO distance", min = 0.01, default = 5.0, description = "Geometry further away doesn't occlude")
+    shadows = BoolProperty(name = "Shadows", default = True, description = "Lamps cast shadows")
+    selected_only = BoolProperty(name = "Only selected", default = False, description = "Only bake selected world objects, all of them still cast shadows")
+    jobs = bpy.props.IntProperty(name = "Processes", min = 0, max = 64, default = 0, description = "Worker processes, 0 uses all cores")
+
+    baker = None
+    timer = None
+    timing = None
+    profile = None
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == "OBJECT"
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        from . import vertex_bake
+
+        if not export_index.can_export(context.scene, "WORLD"):
+            self.report({'WARNING'}, "No world objects to bake")
+            return{'CANCELLED'}
+
+        settings = {
+            "ambient": tuple(self.ambient_color),
+            "ao_distance": self.ao_distance,
+            "shadows": self.shadows,
+            # without samples there's no ambient occlusion, the ambient light is unshadowed
+            "samples_per_pass": min(self.samples_per_pass, self.samples),
+            }
+        # the whole bake is timed and profiled, not just this call
+        profile = profiling.capture(self)
+        profile.__enter__()
+        self.profile = profile
+        running = False
+        try:
+            timer = timing.Timer(self)
+            timer.__enter__()
+            self.timing = timer
+            self.baker = vertex_bake.Baker(context.scene, settings, self.samples, self.selected_only, self.jobs)
+
+            # without a window there's no preview, bake everything right away
+            if bpy.app.background or context.window is None:
+                self.baker.run()
+                return{'FINISHED'}
+
+            self.timer = context.window_manager.event_timer_add(0.1, context.window)
+            context.window_manager.modal_handler_add(self)
+            running = True
+            return{'RUNNING_MODAL'}
+        finally:
+            if not running:
+                self.finish(context)
+
+    def modal(self, context, event):
+        # anything but running on ends the bake, an error as well
+        running = False
+        try:
+            if event.type == 'ESC':
+                # the passes baked so far are kept
+                self.report({'INFO'}, "Bake stopped after {} samples".format(self.baker.samples_done))
+                return{'FINISHED'}
+
+            if event.type == 'TIMER' and self.baker.poll():
+                context.area.header_text_set("Baking vertex lighting: {}/{} samples, Esc to stop".format(
+                    self.baker.samples_done, self.samples))
+                context.area.tag_redraw()
+            if self.baker.finished:
+                return{'FINISHED'}
+            running = True
+            return{'PASS_THROUGH'}
+        finally:
+            if not running:
+                self.finish(context)
+
+    def finish(self, context):
+        """Stops the workers and ends timing and profiling, safe to call more than once."""
+        try:
+            if self.baker is not None:
+                self.baker.close()
+            if self.timer is not None:
+                context.window_manager.event_timer_remove(self.timer)
+                self.timer = None
+            if context.area is not None:
+                context.area.header_text_set()
+        finally:
+            if self.timing is not None:
+                self.timing.__exit__(None, None, None)
+                self.timing = None
+            if self.profile is not None:
+                self.profile.__exit__(None, None, None)
+                self.profile = None
+
 class ButtonVertexColorCreateLayer(bpy.types.Operator):
     bl_idname = "vertexcolor.create_layer"
     bl_label = "Create vertex color layer"
  
+    @profiling.profiled
     def execute(self, context):
         helpers.create_color_layer(context)
         return{'FINISHED'} 
@@ -377,6 +553,7 @@ class ButtonVertexColorCreateLayer(bpy.types.Operator):
     bl_idname = "alphacolor.create_layer"
     bl_label = "Create alpha color layer"
  
+    @profiling.profiled
     def execute(self, context):
         helpers.create_alpha_layer(context)
         return{'FINISHED'} 
@@ -0,0 +1,181 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons Attribution-NonCommercial-ShareAlike 3.0
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Copyright (C) Dummiesman, Yethiel 2017
+#
+# ##### END LICENSE BLOCK #####
+
+"""
+Bakes lighting into the "color" layer of the world objects, see bake.py
+for the tracing. The scene's sun and point lamps light the level, every
+world object is a cube baked in its own task and all world objects cast
+shadows and occlude.
+
+A Baker runs pass after pass in a process pool. The first pass has the
+direct light and a few AO samples, every pass after it adds more samples
+and the colors are written after each one, so the result refines in the
+viewport until all samples are done.
+"""
+
+import bpy, multiprocessing
+import numpy as np
+
+from . import bake, export_index, timing
+from .export_prm import get_layer_values
+from .timing import log
+
+
+######################################################
+# SCENE DATA
+######################################################
+def get_world_arrays(ob):
+    """World space vertex positions and normals and the fan triangulated faces."""
+    me = ob.data
+    coords = get_layer_values(me.vertices, "co", len(me.vertices), 3).astype(np.float64)
+    normals = get_layer_values(me.vertices, "normal", len(me.vertices), 3).astype(np.float64)
+
+    world = np.array(ob.matrix_world, dtype=np.float64)
+    coords = np.dot(coords, world[:3, :3].T) + world[:3, 3]
+    normals = bake.normalize(np.dot(normals, np.linalg.inv(world[:3, :3])))
+
+    loop_verts = get_layer_values(me.loops, "vertex_index", len(me.loops), dtype=np.int32)
+    loop_start = get_layer_values(me.polygons, "loop_start", len(me.polygons), dtype=np.int32)
+    loop_total = get_layer_values(me.polygons, "loop_total", len(me.polygons), dtype=np.int32)
+
+    # polygon corners 0, i, i + 1 for every triangle of the fan
+    triangle_counts = np.maximum(loop_total - 2, 0)
+    first = np.repeat(loop_start, triangle_counts)
+    corner = np.arange(triangle_counts.sum()) - np.repeat(np.cumsum(triangle_counts) - triangle_counts, triangle_counts)
+    triangles = loop_verts[np.column_stack((first, first + corner + 1, first + corner + 2))]
+    return coords, normals, coords[triangles]
+
+def get_lights(scene):
+    """Sun and point lamps of the scene in the form bake.init_worker takes."""
+    lights = []
+    for ob in scene.objects:
+        if ob.type != 'LAMP' or ob.hide_render or ob.data.type not in ('SUN', 'POINT'):
+            continue
+        lamp = ob.data
+        world = np.array(ob.matrix_world, dtype=np.float64)
+        light = {"type": lamp.type, "color": tuple(lamp.color), "energy": lamp.energy}
+        if lamp.type == 'SUN':
+            # suns shine along their -z axis
+            light["direction"] = tuple(world[:3, 2])
+        else:
+            light["position"] = tuple(world[:3, 3])
+            light["distance"] = lamp.distance
+        lights.append(light)
+    return lights
+
+def write_colors(ob, colors):
+    """Writes per vertex colors to the loops of the "color" layer."""
+    me = ob.data
+    layer = me.vertex_colors.get("color") or me.vertex_colors.new("color")
+    loop_verts = get_layer_values(me.loops, "vertex_index", len(me.loops), dtype=np.int32)
+    layer.data.foreach_set("color", colors[loop_verts].astype(np.float32).ravel())
+    me.update()
+
+
+######################################################
+# BAKER
+######################################################
+class Baker:
+    """Bakes the world objects of a scene pass by pass in a process pool."""
+
+    def __init__(self, scene, settings, samples, selected_only=False, jobs=0):
+        self.settings = dict(settings)
+        self.samples = samples
+        # a single pass for the direct light when there's no AO
+        self.pass_count = max(1, -(-samples // max(1, settings["samples_per_pass"])))
+        self.pass_number = 0
+        self.pending = []
+        self.pass_samples = 0
+
+        occluders = export_index.get_export_objects(scene, "WORLD")
+        self.objects = [ob for ob in occluders if ob.select] if selected_only else occluders
+
+        cubes = []
+        triangles = []
+        for ob in occluders:
+            coords, normals, object_triangles = get_world_arrays(ob)
+            triangles.append(object_triangles)
+            if ob in self.objects:
+                cubes.append((coords, normals))
+        triangles = np.concatenate(triangles) if triangles else np.zeros((0, 3, 3))
+
+        # the bias keeps rays from hitting the surface they start on
+        extent = (triangles.max(axis=(0, 1)) - triangles.min(axis=(0, 1))).max() if len(triangles) else 1.0
+        self.settings.setdefault("bias", extent * 1e-4)
+        lights = get_lights(scene)
+
+        self.direct = [None] * len(cubes)
+        self.unoccluded = [np.zeros(len(points)) for points, normals in cubes]
+        self.samples_done = 0
+        self.vertex_count = sum(len(points) for points, normals in cubes)
+        log.info("baking %d objects, %d vertices, %d triangles, %d lights",
+                 len(cubes), self.vertex_count, len(triangles), len(lights))
+
+        jobs = jobs or multiprocessing.cpu_count()
+        self.pool = None
+        if jobs > 1 and len(cubes) > 1:
+            # workers that are spawned instead of forked need a python, not blender
+            multiprocessing.set_executable(bpy.app.binary_path_python)
+            self.pool = multiprocessing.Pool(min(jobs, len(cubes)), bake.init_worker,
+                                             (triangles, cubes, lights, self.settings))
+        else:
+            bake.init_worker(triangles, cubes, lights, self.settings)
+
+    @property
+    def finished(self):
+        return self.pass_number >= self.pass_count and not self.pending
+
+    def start_pass(self):
+        # the last pass only traces the samples that are left
+        self.pass_samples = max(0, min(self.settings["samples_per_pass"], self.samples - self.samples_done))
+        tasks = [(index, self.pass_number, self.pass_samples) for index in range(len(self.objects))]
+        if self.pool is None:
+            self.pending = [bake.bake_cube(task) for task in tasks]
+        else:
+            self.pending = [self.pool.apply_async(bake.bake_cube, (task,)) for task in tasks]
+
+    def poll(self):
+        """
+        Starts the next pass or collects the running one. Returns True when a
+        pass was finished and its colors written.
+        """
+        if not self.pending:
+            if self.pass_number < self.pass_count:
+                self.start_pass()
+            return False
+        if self.pool is not None and not all(result.ready() for result in self.pending):
+            return False
+
+        with timing.phase("bake pass"):
+            for result in self.pending:
+                index, direct, unoccluded = result if self.pool is None else result.get()
+                if direct is not None:
+                    self.direct[index] = direct
+                self.unoccluded[index] += unoccluded
+        self.pending = []
+        self.pass_number += 1
+        self.samples_done += self.pass_samples
+
+        with timing.phase("write colors"):
+            for ob, direct, unoccluded in zip(self.objects, self.direct, self.unoccluded):
+                write_colors(ob, bake.get_colors(direct, unoccluded, self.samples_done, self.settings))
+        timing.count("rays", self.vertex_count * self.pass_samples)
+        return True
+
+    def run(self):
+        """Bakes all passes without returning in between."""
+        while not self.finished:
+            if not self.poll() and self.pending and self.pool is not None:
+                for result in self.pending:
+                    result.wait()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None